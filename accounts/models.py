@@ -44,7 +44,8 @@ class CustomUser(AbstractBaseUser, PermissionsMixin):
 User = get_user_model()
 
 class GoogleCredentials(models.Model):
-    user = models.OneToOneField(User, on_delete=models.CASCADE, related_name="google_credentials")
+    # Один пользователь может выдать доступ к нескольким YouTube-каналам, токен у каждого свой
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name="google_credentials")
     access_token = models.TextField()
     refresh_token = models.TextField()
     token_expiry = models.DateTimeField()
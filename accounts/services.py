@@ -1,40 +1,160 @@
-from django.utils import timezone
-from django.conf import settings
+import logging
 from datetime import timedelta
-from decouple import config
+
 import requests
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.utils import timezone
+
+from social_analytics.transport import get_session
 from .models import GoogleCredentials
 
-def refresh_google_access_token(credentials: GoogleCredentials) -> str:
-    if timezone.now() < credentials.token_expiry - timedelta(minutes=5):
+logger = logging.getLogger(__name__)
+
+# Токен считается истёкшим заранее, чтобы он не протух посреди запроса к API
+TOKEN_REFRESH_MARGIN = timedelta(minutes=5)
+
+
+class TokenRefreshError(Exception):
+    pass
+
+
+class MissingRefreshTokenError(TokenRefreshError):
+    pass
+
+
+def _token_cache_key(credentials):
+    return f'google_access_token:{credentials.pk}'
+
+
+def _is_fresh(expiry, margin=TOKEN_REFRESH_MARGIN):
+    return expiry is not None and timezone.now() < expiry - margin
+
+
+def cache_access_token(credentials):
+    """Кладёт токен в кэш до момента, когда его пора обновлять."""
+    timeout = (credentials.token_expiry - TOKEN_REFRESH_MARGIN - timezone.now()).total_seconds()
+    if timeout > 0:
+        cache.set(
+            _token_cache_key(credentials),
+            (credentials.access_token, credentials.token_expiry),
+            timeout=int(timeout),
+        )
+
+
+async def acache_access_token(credentials):
+    timeout = (credentials.token_expiry - TOKEN_REFRESH_MARGIN - timezone.now()).total_seconds()
+    if timeout > 0:
+        await cache.aset(
+            _token_cache_key(credentials),
+            (credentials.access_token, credentials.token_expiry),
+            timeout=int(timeout),
+        )
+
+
+def refresh_google_access_token(credentials: GoogleCredentials, margin=TOKEN_REFRESH_MARGIN) -> str:
+    """
+    Обновляет access token под блокировкой строки GoogleCredentials.
+
+    Токен обновляется, только если до истечения осталось меньше margin. Если несколько
+    запросов или воркеров пришли за токеном одновременно, в Google сходит только первый:
+    остальные дождутся блокировки, увидят свежий токен в базе и вернут его.
+    Результат записывается в базу, в кэш и в переданный объект.
+    """
+    with transaction.atomic():
+        locked = GoogleCredentials.objects.select_for_update().get(pk=credentials.pk)
+
+        if not _is_fresh(locked.token_expiry, margin):
+            if not locked.refresh_token:
+                raise MissingRefreshTokenError('Token expired. Please re-authenticate.')
+
+            data = {
+                'client_id': locked.client_id or settings.GOOGLE_CLIENT_ID,
+                'client_secret': locked.client_secret or settings.GOOGLE_CLIENT_SECRET,
+                'refresh_token': locked.refresh_token,
+                'grant_type': 'refresh_token',
+            }
+            try:
+                resp = get_session().post(locked.token_uri or settings.GOOGLE_TOKEN_URI, data=data)
+            except requests.exceptions.RequestException as e:
+                raise TokenRefreshError(f"Failed to refresh token: {e}") from e
+            if resp.status_code != 200:
+                raise TokenRefreshError(f"Failed to refresh token: {resp.text}")
+
+            token_data = resp.json()
+            locked.access_token = token_data['access_token']
+            locked.token_expiry = timezone.now() + timedelta(seconds=token_data.get('expires_in', 3600))
+            locked.save(update_fields=['access_token', 'token_expiry'])
+
+    credentials.access_token = locked.access_token
+    credentials.token_expiry = locked.token_expiry
+    cache_access_token(credentials)
+    return credentials.access_token
+
+
+def get_valid_access_token(credentials: GoogleCredentials) -> str:
+    """
+    Возвращает действующий access token, по возможности без обращения к базе и Google.
+    Переданный объект credentials обновляется до актуального токена.
+    """
+    cached = cache.get(_token_cache_key(credentials))
+    if cached:
+        access_token, token_expiry = cached
+        # Объект мог получить более новый токен, чем лежит в кэше (например, после OAuth callback)
+        if credentials.token_expiry is None or token_expiry > credentials.token_expiry:
+            credentials.access_token = access_token
+            credentials.token_expiry = token_expiry
+        return credentials.access_token
+
+    if _is_fresh(credentials.token_expiry):
+        cache_access_token(credentials)
         return credentials.access_token
 
-    token_url = settings.GOOGLE_TOKEN_URI
-    data = {
-        'client_id': settings.GOOGLE_CLIENT_ID,
-        'client_secret': settings.GOOGLE_CLIENT_SECRET,
-        'refresh_token': credentials.refresh_token,
-        'grant_type': 'refresh_token',
-    }
+    return refresh_google_access_token(credentials)
 
-    resp = requests.post(token_url, data=data)
-    if resp.status_code != 200:
-        raise Exception(f"Failed to refresh token: {resp.text}")
 
-    token_data = resp.json()
-    new_access_token = token_data['access_token']
-    expires_in = token_data.get('expires_in', 3600)
+async def aget_valid_access_token(credentials: GoogleCredentials) -> str:
+    """
+    Асинхронный вариант get_valid_access_token для async-представлений.
+    Обновление токена идёт синхронно в потоке: ему нужна транзакция с select_for_update.
+    """
+    cached = await cache.aget(_token_cache_key(credentials))
+    if cached:
+        access_token, token_expiry = cached
+        if credentials.token_expiry is None or token_expiry > credentials.token_expiry:
+            credentials.access_token = access_token
+            credentials.token_expiry = token_expiry
+        return credentials.access_token
 
-    credentials.access_token = new_access_token
-    credentials.token_expiry = timezone.now() + timedelta(seconds=expires_in)
-    credentials.save()
+    if _is_fresh(credentials.token_expiry):
+        await acache_access_token(credentials)
+        return credentials.access_token
 
-    return new_access_token
+    return await sync_to_async(refresh_google_access_token)(credentials)
 
 
 def get_valid_access_token_for_user(user):
-    creds = getattr(user, 'google_credentials', None)
+    creds = user.google_credentials.order_by('-pk').first()
     if not creds:
         raise Exception("Google credentials not found for user")
 
-    return refresh_google_access_token(creds)
+    return get_valid_access_token(creds)
+
+
+def refresh_expiring_tokens(window=None):
+    """Заранее обновляет токены, срок которых истекает в течение window."""
+    window = window or settings.GOOGLE_TOKEN_PREFETCH_WINDOW
+    expiring = GoogleCredentials.objects.filter(
+        token_expiry__lt=timezone.now() + window,
+    ).exclude(refresh_token='')
+
+    refreshed = 0
+    for credentials in expiring.iterator():
+        try:
+            refresh_google_access_token(credentials, margin=window)
+            refreshed += 1
+        except TokenRefreshError as e:
+            logger.warning(f"Could not refresh token for credentials {credentials.pk}: {e}")
+    return refreshed
@@ -0,0 +1,8 @@
+from celery import shared_task
+
+from .services import refresh_expiring_tokens
+
+
+@shared_task
+def refresh_expiring_google_tokens():
+    return refresh_expiring_tokens()
@@ -1,3 +1,140 @@
+from datetime import timedelta
+from unittest.mock import patch, MagicMock
+
+from django.conf import settings
+from django.core.cache import cache
 from django.test import TestCase
+from django.utils import timezone
+
+from social_analytics.transport import get_session
+from .models import CustomUser, GoogleCredentials
+from .services import (
+    MissingRefreshTokenError,
+    TokenRefreshError,
+    get_valid_access_token,
+    refresh_expiring_tokens,
+)
+from .tasks import refresh_expiring_google_tokens
+
+
+def token_response(access_token='new_access_token', expires_in=3600, status_code=200):
+    response = MagicMock(status_code=status_code, text='error')
+    response.json.return_value = {'access_token': access_token, 'expires_in': expires_in}
+    return response
+
+
+class TokenManagerTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = CustomUser.objects.create_user(email='tokens@example.com', password='testpassword')
+        self.credentials = GoogleCredentials.objects.create(
+            user=self.user,
+            access_token='old_access_token',
+            refresh_token='refresh_token',
+            token_expiry=timezone.now() + timedelta(hours=1),
+            scopes='scope',
+            client_id='client_id',
+            client_secret='client_secret',
+            token_uri='https://oauth2.googleapis.com/token',
+        )
+
+    def expire(self, credentials=None):
+        credentials = credentials or self.credentials
+        credentials.token_expiry = timezone.now() - timedelta(minutes=1)
+        credentials.save()
+
+    @patch('social_analytics.transport.PooledSession.post')
+    def test_valid_token_is_returned_without_refresh(self, mock_post):
+        """Проверка, что действующий токен возвращается без обращения к Google."""
+        self.assertEqual(get_valid_access_token(self.credentials), 'old_access_token')
+        mock_post.assert_not_called()
+
+    @patch('social_analytics.transport.PooledSession.post', return_value=token_response())
+    def test_expired_token_is_refreshed_and_saved(self, mock_post):
+        """Проверка, что истёкший токен обновляется и записывается в базу."""
+        self.expire()
+
+        self.assertEqual(get_valid_access_token(self.credentials), 'new_access_token')
+        self.credentials.refresh_from_db()
+        self.assertEqual(self.credentials.access_token, 'new_access_token')
+        self.assertGreater(self.credentials.token_expiry, timezone.now() + timedelta(minutes=30))
+        mock_post.assert_called_once()
+
+    @patch('social_analytics.transport.PooledSession.post', return_value=token_response())
+    def test_refreshed_token_is_served_from_cache(self, mock_post):
+        """Проверка, что после обновления другие копии credentials получают токен из кэша."""
+        self.expire()
+        stale_copy = GoogleCredentials.objects.get(pk=self.credentials.pk)
+
+        get_valid_access_token(self.credentials)
+        with self.assertNumQueries(0):
+            self.assertEqual(get_valid_access_token(stale_copy), 'new_access_token')
+        mock_post.assert_called_once()
+
+    @patch('social_analytics.transport.PooledSession.post', return_value=token_response())
+    def test_refresh_is_skipped_when_another_worker_already_refreshed(self, mock_post):
+        """Проверка, что под блокировкой перечитывается строка и повторного refresh не происходит."""
+        stale_copy = GoogleCredentials.objects.get(pk=self.credentials.pk)
+        stale_copy.token_expiry = timezone.now() - timedelta(minutes=1)
+        GoogleCredentials.objects.filter(pk=self.credentials.pk).update(access_token='fresh_from_other_worker')
+
+        self.assertEqual(get_valid_access_token(stale_copy), 'fresh_from_other_worker')
+        mock_post.assert_not_called()
+
+    def test_missing_refresh_token(self):
+        """Проверка, что без refresh token возвращается понятная ошибка."""
+        self.credentials.refresh_token = ''
+        self.expire()
+
+        with self.assertRaises(MissingRefreshTokenError):
+            get_valid_access_token(self.credentials)
+
+    @patch('social_analytics.transport.PooledSession.post', return_value=token_response(status_code=400))
+    def test_failed_refresh_raises(self, mock_post):
+        """Проверка, что ошибка Google превращается в TokenRefreshError."""
+        self.expire()
+
+        with self.assertRaises(TokenRefreshError):
+            get_valid_access_token(self.credentials)
+
+    @patch('social_analytics.transport.PooledSession.post', return_value=token_response())
+    def test_periodic_refresh_only_touches_expiring_tokens(self, mock_post):
+        """Проверка, что периодическая задача обновляет только токены, которые скоро истекут."""
+        other_user = CustomUser.objects.create_user(email='expiring@example.com', password='testpassword')
+        expiring = GoogleCredentials.objects.create(
+            user=other_user,
+            access_token='expiring_token',
+            refresh_token='refresh_token',
+            token_expiry=timezone.now() + timedelta(minutes=10),
+            scopes='scope',
+            client_id='client_id',
+            client_secret='client_secret',
+            token_uri='https://oauth2.googleapis.com/token',
+        )
+
+        self.assertEqual(refresh_expiring_google_tokens(), 1)
+        expiring.refresh_from_db()
+        self.assertEqual(expiring.access_token, 'new_access_token')
+        self.credentials.refresh_from_db()
+        self.assertEqual(self.credentials.access_token, 'old_access_token')
+
+    @patch('social_analytics.transport.PooledSession.post', return_value=token_response(status_code=400))
+    def test_periodic_refresh_survives_failures(self, mock_post):
+        """Проверка, что ошибка одного токена не останавливает периодическую задачу."""
+        self.expire()
+        self.assertEqual(refresh_expiring_tokens(), 0)
+
+    @patch('requests.Session.request', return_value=token_response())
+    def test_refresh_uses_pooled_session(self, mock_request):
+        """Проверка, что обновление идёт через общую сессию с таймаутами подключения и чтения."""
+        self.expire()
+
+        self.assertEqual(get_valid_access_token(self.credentials), 'new_access_token')
 
-# Create your tests here.
+        self.assertIs(get_session(), get_session())
+        self.assertEqual(
+            mock_request.call_args.kwargs['timeout'], (settings.HTTP_CONNECT_TIMEOUT, settings.HTTP_READ_TIMEOUT)
+        )
+        retries = get_session().get_adapter('https://oauth2.googleapis.com').max_retries
+        self.assertEqual(retries.total, settings.HTTP_MAX_RETRIES)
+        self.assertIn(503, retries.status_forcelist)
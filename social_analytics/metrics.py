@@ -0,0 +1,211 @@
+import os
+from contextvars import ContextVar
+from time import perf_counter
+from urllib.parse import urlsplit
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.db import connections
+from django.db.backends.signals import connection_created
+from django.http import HttpResponse
+from django.template.backends.django import DjangoTemplates, Template
+from prometheus_client import CONTENT_TYPE_LATEST, REGISTRY, CollectorRegistry, Histogram, generate_latest
+from prometheus_client import multiprocess
+
+# Под uvicorn --workers каждый процесс пишет значения в файлы этого каталога, а /metrics
+# складывает их (multiprocess-режим prometheus_client). Переменная должна быть задана до старта
+# процессов, а каталог очищаться при перезапуске (см. Dockerfile)
+MULTIPROC_DIR = os.environ.get('PROMETHEUS_MULTIPROC_DIR')
+if MULTIPROC_DIR:
+    os.makedirs(MULTIPROC_DIR, exist_ok=True)
+
+# Число вызовов — это _count соответствующей гистограммы
+VIEW_LATENCY = Histogram(
+    'django_view_latency_seconds', 'Время ответа представления', ['view', 'method', 'status'],
+)
+VIEW_DB_QUERIES = Histogram(
+    'django_view_db_queries', 'SQL-запросов за один запрос к представлению', ['view'],
+    buckets=(0, 1, 2, 3, 5, 8, 13, 21, 34, 55, 89, 144, float('inf')),
+)
+VIEW_DB_SECONDS = Histogram('django_view_db_seconds', 'Время SQL за один запрос к представлению', ['view'])
+VIEW_OUTBOUND_SECONDS = Histogram(
+    'django_view_outbound_seconds', 'Время вызовов внешних API за один запрос к представлению', ['view'],
+)
+TEMPLATE_RENDER_SECONDS = Histogram('django_template_render_seconds', 'Время рендеринга шаблона', ['template'])
+OUTBOUND_LATENCY = Histogram(
+    'outbound_request_seconds', 'Вызовы Google API и Gemini', ['service', 'endpoint', 'status'],
+    buckets=(0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, float('inf')),
+)
+
+# Представления, которые не меряются: сам сбор метрик
+UNTRACKED_VIEWS = {'metrics'}
+
+
+class RequestStats:
+    """Счётчики текущего запроса. Лежат в contextvar и доезжают до потоков sync_to_async."""
+
+    __slots__ = ('started', 'queries', 'db_seconds', 'outbound_seconds')
+
+    def __init__(self):
+        self.started = perf_counter()
+        self.queries = 0
+        self.db_seconds = 0.0
+        self.outbound_seconds = 0.0
+
+
+_request_stats = ContextVar('request_stats', default=None)
+
+
+def _record_query(execute, sql, params, many, context):
+    stats = _request_stats.get()
+    if stats is None:
+        return execute(sql, params, many, context)
+    started = perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        stats.queries += 1
+        stats.db_seconds += perf_counter() - started
+
+
+def _install_query_recorder(connection, **kwargs):
+    if _record_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(_record_query)
+
+
+# Новые соединения (в том числе в потоках sync_to_async) получают обёртку сразу,
+# уже открытые соединения текущего потока — в начале запроса
+connection_created.connect(_install_query_recorder)
+
+
+def error_status(exc):
+    if isinstance(exc, GeneratorExit):
+        return 'cancelled'
+    # HttpError googleapiclient, исключения google.api_core (Gemini) несут HTTP-статус
+    for status in (getattr(exc, 'status_code', None), getattr(exc, 'code', None),
+                   getattr(getattr(exc, 'resp', None), 'status', None)):
+        if isinstance(status, int):
+            return str(status)
+    return 'error'
+
+
+class OutboundCall:
+    """
+    Замер одного вызова внешнего API: контекстный менеджер или start()/finish() для
+    потоковых ответов. Статус успешного вызова — status (HTTP-код, по умолчанию 200),
+    при исключении — его HTTP-статус, 'cancelled' для закрытого генератора или 'error'.
+    Время вызова добавляется и к счётчикам текущего запроса.
+    """
+
+    def __init__(self, service, endpoint):
+        self.service = service
+        self.endpoint = endpoint
+        self.status = 200
+        self.started = None
+
+    def start(self):
+        self.started = perf_counter()
+        return self
+
+    def finish(self, status=None):
+        if self.started is None:
+            return
+        elapsed = perf_counter() - self.started
+        self.started = None
+        OUTBOUND_LATENCY.labels(self.service, self.endpoint, str(status or self.status)).observe(elapsed)
+        stats = _request_stats.get()
+        if stats is not None:
+            stats.outbound_seconds += elapsed
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc, tb):
+        self.finish(None if exc is None else error_status(exc))
+
+
+def url_endpoint(url):
+    """Метка вызова по URL: хост и путь без query-параметров."""
+    parts = urlsplit(str(url))
+    return f'{parts.hostname}{parts.path}'
+
+
+class InstrumentedTemplate(Template):
+    def render(self, context=None, request=None):
+        started = perf_counter()
+        try:
+            return super().render(context, request)
+        finally:
+            TEMPLATE_RENDER_SECONDS.labels(self.template.name or 'string').observe(perf_counter() - started)
+
+
+class InstrumentedDjangoTemplates(DjangoTemplates):
+    """Шаблонный движок Django, который меряет время рендеринга каждого шаблона."""
+
+    def from_string(self, template_code):
+        return InstrumentedTemplate(super().from_string(template_code).template, self)
+
+    def get_template(self, template_name):
+        return InstrumentedTemplate(super().get_template(template_name).template, self)
+
+
+class RequestMetricsMiddleware:
+    """
+    Время ответа, число и время SQL-запросов и время вызовов внешних API по представлениям.
+    Представление определяется по имени маршрута; запросы без маршрута идут под 'unmatched'.
+    У потоковых ответов меряется время до начала отдачи.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        stats, token = self._start()
+        try:
+            response = self.get_response(request)
+        finally:
+            _request_stats.reset(token)
+        self._observe(request, response, stats)
+        return response
+
+    async def __acall__(self, request):
+        stats, token = self._start()
+        try:
+            response = await self.get_response(request)
+        finally:
+            _request_stats.reset(token)
+        self._observe(request, response, stats)
+        return response
+
+    def _start(self):
+        for connection in connections.all(initialized_only=True):
+            _install_query_recorder(connection)
+        stats = RequestStats()
+        return stats, _request_stats.set(stats)
+
+    def _observe(self, request, response, stats):
+        match = request.resolver_match
+        view = match.view_name if match else 'unmatched'
+        if view in UNTRACKED_VIEWS:
+            return
+        VIEW_LATENCY.labels(view, request.method, str(response.status_code)).observe(
+            perf_counter() - stats.started
+        )
+        VIEW_DB_QUERIES.labels(view).observe(stats.queries)
+        VIEW_DB_SECONDS.labels(view).observe(stats.db_seconds)
+        VIEW_OUTBOUND_SECONDS.labels(view).observe(stats.outbound_seconds)
+
+
+def metrics_view(request):
+    """Метрики в текстовом формате Prometheus, в multiprocess-режиме — сумма по всем процессам."""
+    registry = REGISTRY
+    if MULTIPROC_DIR:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry, path=MULTIPROC_DIR)
+    return HttpResponse(generate_latest(registry), content_type=CONTENT_TYPE_LATEST)
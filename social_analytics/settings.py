@@ -41,6 +41,7 @@ INSTALLED_APPS = [
     'django.contrib.staticfiles',
     'django.contrib.humanize',
     'rest_framework',
+    'rest_framework.authtoken',
     'rest_framework_simplejwt.token_blacklist',
     'drf_yasg',
     'django_celery_beat',
@@ -50,6 +51,8 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    # Первым, чтобы в замер попало время всех остальных middleware
+    'social_analytics.metrics.RequestMetricsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -63,7 +66,8 @@ ROOT_URLCONF = 'social_analytics.urls'
 
 TEMPLATES = [
     {
-        'BACKEND': 'django.template.backends.django.DjangoTemplates',
+        # DjangoTemplates, который пишет время рендеринга шаблонов в метрики
+        'BACKEND': 'social_analytics.metrics.InstrumentedDjangoTemplates',
         'DIRS': [BASE_DIR / 'templates'], 
         'APP_DIRS': True,
         'OPTIONS': {
@@ -176,6 +180,17 @@ GOOGLE_CLIENT_SECRET = config("GOOGLE_CLIENT_SECRET")
 GOOGLE_REDIRECT_URI = config("GOOGLE_REDIRECT_URI")
 GOOGLE_SCOPES = config("GOOGLE_SCOPES") 
 GOOGLE_TOKEN_URI = config("GOOGLE_TOKEN_URI")
+# Периодическая задача обновляет токены, которые истекут в течение этого окна
+GOOGLE_TOKEN_PREFETCH_WINDOW = timedelta(minutes=15)
+
+# Исходящие HTTP-запросы (social_analytics.transport): таймауты в секундах и размер пула соединений
+HTTP_CONNECT_TIMEOUT = 5
+HTTP_READ_TIMEOUT = 30
+HTTP_POOL_MAX_CONNECTIONS = 200
+HTTP_POOL_MAX_KEEPALIVE = 50
+# Повторы при ошибках подключения и 5xx: задержка backoff_factor * 2 ** попытка
+HTTP_MAX_RETRIES = 3
+HTTP_BACKOFF_FACTOR = 0.5
 
 YOUTUBE_CLIENT_ID = config("YOUTUBE_CLIENT_ID")
 YOUTUBE_CLIENT_SECRET = config("YOUTUBE_CLIENT_SECRET")
@@ -188,6 +203,53 @@ YOUTUBE_SCOPES = [
 ]
 
 GEMINI_API_KEY = config("GEMINI_API_KEY")
+GEMINI_MODEL_NAME = config("GEMINI_MODEL_NAME", default="gemini-1.5-flash")
+# Путь к классу локальной модели вместо Gemini, например youtube.fakes.FakeGenerativeModel
+GEMINI_MODEL_FACTORY = config("GEMINI_MODEL_FACTORY", default="")
+# Сколько токенов (по оценке) может занимать сводка канала в промпте чата
+GEMINI_PROMPT_TOKEN_BUDGET = 1500
+# Сколько живёт закэшированный ответ на одинаковый вопрос по тем же данным
+GEMINI_RESPONSE_CACHE_TTL = 60 * 60 * 6
+
+# Analytics API дописывает данные за последние дни с задержкой; такие дни перезапрашиваются.
+# Инкрементальная синхронизация берёт дни после водяного знака канала плюс это окно
+YOUTUBE_ANALYTICS_SETTLE_DAYS = config('YOUTUBE_ANALYTICS_SETTLE_DAYS', default=3, cast=int)
+# Окно первой синхронизации канала, у которого ещё нет водяного знака
+YOUTUBE_INITIAL_SYNC_DAYS = 30
+# Сколько запросов к Analytics API синхронизация выполняет параллельно
+YOUTUBE_ANALYTICS_MAX_WORKERS = 4
+
+# Кэш готовых клиентов YouTube Data/Analytics API (на процесс)
+YOUTUBE_CLIENT_CACHE_SIZE = 256
+YOUTUBE_CLIENT_CACHE_TTL = 600
+# Путь к классу локального API вместо googleapiclient, например youtube.fakes.FakeYouTubeApi
+YOUTUBE_API_FACTORY = config('YOUTUBE_API_FACTORY', default='')
+
+# Дневной бюджет единиц квоты YouTube Data API на проект и часть, которую фоновые синхронизации не трогают
+YOUTUBE_QUOTA_DAILY_BUDGET = config('YOUTUBE_QUOTA_DAILY_BUDGET', default=10000, cast=int)
+YOUTUBE_QUOTA_INTERACTIVE_RESERVE = 1000
+# Token bucket для запросов к Google API: (запросов в секунду, размер всплеска)
+YOUTUBE_RATE_LIMIT_PROJECT = (10, 20)
+YOUTUBE_RATE_LIMIT_USER = (2, 10)
+# Повторы при 429 / 403 rateLimitExceeded: задержка base * 2^попытка, но не больше max секунд
+YOUTUBE_API_MAX_RETRIES = 5
+YOUTUBE_API_BACKOFF_BASE = 1.0
+YOUTUBE_API_BACKOFF_MAX = 60
+
+# Полная история канала загружается кусками по столько дней
+YOUTUBE_BACKFILL_CHUNK_DAYS = 180
+
+# Сколько месяцев вперёд держать готовые секции таблиц дневной статистики (если они секционированы,
+# см. manage.py partition_youtube_stats)
+YOUTUBE_STATS_PARTITION_MONTHS_AHEAD = 3
+
+# Хранение дневных снимков видео: 'rows' — строка на видео и день (YouTubeVideoDailyStats),
+# 'packed' — ряд видео за год в одном бинарном массиве (YouTubeVideoSeries, см. youtube/series.py).
+# При переключении на 'packed' существующие строки переносятся командой pack_youtube_video_series
+YOUTUBE_VIDEO_SERIES_STORAGE = config('YOUTUBE_VIDEO_SERIES_STORAGE', default='rows')
+
+# Сколько строк выгрузка читает из базы за один заход серверного курсора
+YOUTUBE_EXPORT_CHUNK_SIZE = 2000
 
 CSRF_COOKIE_SAMESITE = 'None'
 SESSION_COOKIE_SAMESITE = 'None'
@@ -195,4 +257,60 @@ SESSION_COOKIE_SAMESITE = 'None'
 CSRF_COOKIE_SECURE = True
 SESSION_COOKIE_SECURE = True
 
-CSRF_TRUSTED_ORIGINS = ['http://127.0.0.1']
\ No newline at end of file
+CSRF_TRUSTED_ORIGINS = ['http://127.0.0.1']
+
+
+# Cache
+# Без REDIS_CACHE_URL (локальный запуск, тесты) используется кэш в памяти процесса
+REDIS_CACHE_URL = config('REDIS_CACHE_URL', default='')
+
+if REDIS_CACHE_URL:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': REDIS_CACHE_URL,
+        }
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        }
+    }
+
+# Ответы API трендов инвалидируются сменой версии данных канала, TTL только ограничивает мусор
+YOUTUBE_RESPONSE_CACHE_TTL = 60 * 60 * 24
+
+
+# Celery
+CELERY_BROKER_URL = config('CELERY_BROKER_URL', default='redis://redis:6379/0')
+CELERY_RESULT_BACKEND = config('CELERY_RESULT_BACKEND', default=CELERY_BROKER_URL)
+CELERY_TIMEZONE = TIME_ZONE
+CELERY_TASK_ACKS_LATE = True
+CELERY_WORKER_PREFETCH_MULTIPLIER = 1
+CELERY_BEAT_SCHEDULER = 'django_celery_beat.schedulers:DatabaseScheduler'
+CELERY_BEAT_SCHEDULE = {
+    'sync-stale-youtube-channels': {
+        'task': 'youtube.tasks.sync_stale_channels',
+        'schedule': timedelta(hours=1),
+    },
+    'revalidate-youtube-channels': {
+        'task': 'youtube.tasks.revalidate_channels',
+        'schedule': timedelta(hours=6),
+    },
+    'ensure-youtube-stats-partitions': {
+        'task': 'youtube.tasks.ensure_stats_partitions',
+        'schedule': timedelta(days=1),
+    },
+    'refresh-expiring-google-tokens': {
+        'task': 'accounts.tasks.refresh_expiring_google_tokens',
+        'schedule': timedelta(minutes=5),
+    },
+}
+
+# Через сколько данные канала считаются устаревшими
+YOUTUBE_SYNC_INTERVAL = timedelta(hours=24)
+# Как часто фоновая задача перепроверяет, что токен канала по-прежнему выдан на этот канал
+YOUTUBE_CHANNEL_REVALIDATE_INTERVAL = timedelta(days=1)
+# Если синхронизация висит в queued/running дольше этого времени, её можно перезапустить
+YOUTUBE_SYNC_LOCK_TIMEOUT = timedelta(minutes=30)
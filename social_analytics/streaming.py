@@ -0,0 +1,31 @@
+from asgiref.sync import sync_to_async
+from django.core.handlers.asgi import ASGIRequest
+
+_DONE = object()
+
+
+async def aiterate(iterator):
+    """
+    Асинхронный итератор поверх синхронного: каждый кусок берётся через sync_to_async,
+    так что ответ уходит клиенту по мере готовности, а не после сбора всего списка.
+    При обрыве соединения (отмена задачи) исходный генератор закрывается в том же потоке.
+    """
+    iterator = iter(iterator)
+    try:
+        while (chunk := await sync_to_async(next)(iterator, _DONE)) is not _DONE:
+            yield chunk
+    finally:
+        close = getattr(iterator, 'close', None)
+        if close is not None:
+            await sync_to_async(close)()
+
+
+def streaming_content(request, iterator):
+    """
+    Содержимое StreamingHttpResponse для синхронного генератора. Под ASGI Django собирает
+    синхронный итератор в список целиком перед отправкой, поэтому там он оборачивается
+    в aiterate; под WSGI остаётся как есть.
+    """
+    if isinstance(request, ASGIRequest):
+        return aiterate(iterator)
+    return iterator
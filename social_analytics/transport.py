@@ -0,0 +1,132 @@
+import asyncio
+import threading
+import weakref
+
+import httplib2
+import httpx
+import requests
+from django.conf import settings
+from google.auth.transport import requests as google_requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from .metrics import OutboundCall, url_endpoint
+
+# Ответы, после которых запрос к Google имеет смысл повторить
+RETRY_STATUSES = (500, 502, 503, 504)
+
+_async_clients = weakref.WeakKeyDictionary()
+_session = None
+_session_lock = threading.Lock()
+_local = threading.local()
+
+
+def http_timeout():
+    return httpx.Timeout(
+        settings.HTTP_READ_TIMEOUT,
+        connect=settings.HTTP_CONNECT_TIMEOUT,
+        pool=settings.HTTP_CONNECT_TIMEOUT,
+    )
+
+
+def http_limits():
+    return httpx.Limits(
+        max_connections=settings.HTTP_POOL_MAX_CONNECTIONS,
+        max_keepalive_connections=settings.HTTP_POOL_MAX_KEEPALIVE,
+    )
+
+
+class InstrumentedAsyncTransport(httpx.AsyncHTTPTransport):
+    """Транспорт httpx, который пишет каждый запрос к Google в метрику outbound_request_seconds."""
+
+    async def handle_async_request(self, request):
+        with OutboundCall('google', url_endpoint(request.url)) as call:
+            response = await super().handle_async_request(request)
+            call.status = response.status_code
+        return response
+
+
+def get_async_client():
+    """
+    Общий асинхронный HTTP-клиент с пулом keep-alive соединений.
+
+    Соединения httpx привязаны к циклу событий, поэтому клиент один на цикл: под ASGI это
+    один клиент на процесс, и все запросы к Google переиспользуют TCP/TLS-соединения.
+    Повторяются только неудавшиеся подключения: обмен OAuth-кода одноразовый, и повтор
+    уже отправленного запроса вернул бы invalid_grant.
+    """
+    loop = asyncio.get_running_loop()
+    client = _async_clients.get(loop)
+    if client is None or client.is_closed:
+        transport = InstrumentedAsyncTransport(limits=http_limits(), retries=settings.HTTP_MAX_RETRIES)
+        client = httpx.AsyncClient(timeout=http_timeout(), transport=transport)
+        _async_clients[loop] = client
+    return client
+
+
+class PooledSession(requests.Session):
+    """requests.Session, у которой таймаут (connect, read) задан по умолчанию для каждого запроса."""
+
+    def request(self, method, url, **kwargs):
+        kwargs.setdefault('timeout', (settings.HTTP_CONNECT_TIMEOUT, settings.HTTP_READ_TIMEOUT))
+        return super().request(method, url, **kwargs)
+
+
+class InstrumentedAdapter(HTTPAdapter):
+    """HTTPAdapter с метрикой outbound_request_seconds; повторы urllib3 входят в один замер."""
+
+    def send(self, request, **kwargs):
+        with OutboundCall('google', url_endpoint(request.url)) as call:
+            response = super().send(request, **kwargs)
+            call.status = response.status_code
+        return response
+
+
+def _create_session():
+    retry = Retry(
+        total=settings.HTTP_MAX_RETRIES,
+        backoff_factor=settings.HTTP_BACKOFF_FACTOR,
+        status_forcelist=RETRY_STATUSES,
+        # Ответы и ошибки чтения повторяются только для идемпотентных методов (набор urllib3 по
+        # умолчанию). POST обновления токена при потерянном ответе не повторяется: Google мог уже
+        # выдать новый токен. Ошибку подключения urllib3 повторяет для любого метода — запрос не ушёл
+        allowed_methods=Retry.DEFAULT_ALLOWED_METHODS,
+        raise_on_status=False,
+    )
+    adapter = InstrumentedAdapter(pool_maxsize=settings.HTTP_POOL_MAX_KEEPALIVE, max_retries=retry)
+    session = PooledSession()
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    return session
+
+
+def get_session():
+    """
+    Общая на процесс синхронная сессия requests с пулом keep-alive соединений urllib3,
+    таймаутами и повторами при ошибках подключения и 5xx.
+    """
+    global _session
+    if _session is None:
+        with _session_lock:
+            if _session is None:
+                _session = _create_session()
+    return _session
+
+
+def google_auth_request():
+    """Транспорт google-auth (проверка id_token, загрузка сертификатов) поверх общей сессии."""
+    return google_requests.Request(session=get_session())
+
+
+def get_httplib2():
+    """
+    httplib2.Http для googleapiclient, один на поток.
+
+    httplib2 не потокобезопасен, но держит открытые соединения по хостам, поэтому все
+    клиенты API в одном потоке ходят через одно Http и переиспользуют TLS-соединения
+    вместо нового Http на каждый build.
+    """
+    http = getattr(_local, 'http', None)
+    if http is None:
+        http = _local.http = httplib2.Http(timeout=settings.HTTP_READ_TIMEOUT)
+    return http
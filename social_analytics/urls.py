@@ -21,6 +21,8 @@ from rest_framework import permissions
 from drf_yasg.views import get_schema_view
 from drf_yasg import openapi
 
+from social_analytics.metrics import metrics_view
+
 schema_view = get_schema_view(
     openapi.Info(
         title="Social Analytics API",
@@ -36,6 +38,7 @@ urlpatterns = [
     path("admin/", admin.site.urls),
     path("auth/", include("user_auth.urls")),
     path("youtube/", include('youtube.urls')),
+    path('metrics', metrics_view, name='metrics'),
     path('', TemplateView.as_view(template_name='home.html'), name='home'),
     re_path(r'^swagger(?P<format>\.json|\.yaml)$', schema_view.without_ui(cache_timeout=0), name='schema-json'),
     path('swagger/', schema_view.with_ui('swagger', cache_timeout=0), name='schema-swagger-ui'),
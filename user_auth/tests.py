@@ -1,3 +1,6 @@
+from unittest.mock import patch
+
+import httpx
 from django.test import TestCase, Client
 from django.urls import reverse
 from rest_framework import status
@@ -23,3 +26,37 @@ class AuthTests(TestCase):
         self.assertEqual(response.status_code, status.HTTP_200_OK)
         self.assertIn('message', response.json())
         self.assertEqual(response.json()['message'], 'Access granted')
+
+
+class GoogleCallbackTests(TestCase):
+    def setUp(self):
+        self.client = Client()
+
+    def mock_google(self, status_code=200, payload=None):
+        payload = payload if payload is not None else {'id_token': 'signed.id.token'}
+        return patch(
+            'user_auth.views.get_async_client',
+            side_effect=lambda: httpx.AsyncClient(
+                transport=httpx.MockTransport(lambda request: httpx.Response(status_code, json=payload))
+            ),
+        )
+
+    @patch('user_auth.views.id_token.verify_oauth2_token', return_value={'email': 'new@example.com', 'name': 'New'})
+    def test_callback_creates_user_and_logs_in(self, mock_verify):
+        """Проверка, что async callback создаёт пользователя, открывает сессию и уводит на next."""
+        with self.mock_google():
+            response = self.client.get(reverse('google_callback'), {'code': 'abc', 'next': '/youtube/'})
+
+        self.assertRedirects(response, '/youtube/', fetch_redirect_response=False)
+        user = CustomUser.objects.get(email='new@example.com')
+        self.assertEqual(user.full_name, 'New')
+        self.assertEqual(int(self.client.session['_auth_user_id']), user.pk)
+        self.assertEqual(mock_verify.call_args.args[0], 'signed.id.token')
+
+    def test_callback_reports_token_error(self):
+        """Проверка, что отказ Google в обмене кода возвращает 400 с деталями."""
+        with self.mock_google(status_code=400, payload={'error': 'invalid_grant'}):
+            response = self.client.get(reverse('google_callback'), {'code': 'abc'})
+
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json()['details'], {'error': 'invalid_grant'})
@@ -1,13 +1,16 @@
 from rest_framework import generics, status
 from rest_framework.response import Response
 from rest_framework_simplejwt.tokens import RefreshToken
-import requests
+import httpx
+from asgiref.sync import sync_to_async
+from django.http import JsonResponse
 from django.views import View
 from django.conf import settings
 from django.shortcuts import redirect, render
 from rest_framework.response import Response
 from rest_framework.decorators import api_view
-from django.contrib.auth import get_user_model, authenticate, login
+from django.contrib.auth import get_user_model, authenticate, alogin
+from django.views.decorators.http import require_GET
 from django.urls import reverse
 from rest_framework.permissions import IsAuthenticated
 from rest_framework.views import APIView
@@ -15,8 +18,8 @@ from django.utils import timezone
 from datetime import timedelta
 from accounts.models import GoogleCredentials
 from google.oauth2 import id_token
-from google.auth.transport import requests as google_requests
 from accounts.models import CustomUser
+from social_analytics.transport import get_async_client, google_auth_request
 
 
 
@@ -39,11 +42,11 @@ def google_login(request):
     return redirect(f"{base_url}?{query_string}")
 
 
-@api_view(['GET'])
-def google_callback(request):
+@require_GET
+async def google_callback(request):
     code = request.GET.get('code')
     if not code:
-        return Response({'error': 'No code provided'}, status=400)
+        return JsonResponse({'error': 'No code provided'}, status=400)
 
     token_url = 'https://oauth2.googleapis.com/token'
     token_data = {
@@ -54,31 +57,37 @@ def google_callback(request):
         'grant_type': 'authorization_code',
     }
 
-    token_resp = requests.post(token_url, data=token_data)
+    try:
+        token_resp = await get_async_client().post(token_url, data=token_data)
+    except httpx.HTTPError as e:
+        return JsonResponse({'error': 'Failed to get token', 'details': str(e)}, status=400)
     if token_resp.status_code != 200:
-        return Response({'error': 'Failed to get token', 'details': token_resp.json()}, status=400)
+        return JsonResponse({'error': 'Failed to get token', 'details': token_resp.json()}, status=400)
 
     token_json = token_resp.json()
     id_token_str = token_json.get('id_token')
     
     if not id_token_str:
-        return Response({'error': 'No id_token in token response'}, status=400)
+        return JsonResponse({'error': 'No id_token in token response'}, status=400)
 
     try:
-        id_info = id_token.verify_oauth2_token(id_token_str, google_requests.Request(), settings.GOOGLE_CLIENT_ID)
+        # Проверка подписи синхронная (google-auth + requests) и в базу не ходит, поэтому идёт в пуле потоков
+        id_info = await sync_to_async(id_token.verify_oauth2_token, thread_sensitive=False)(
+            id_token_str, google_auth_request(), settings.GOOGLE_CLIENT_ID
+        )
     except ValueError:
-        return Response({'error': 'Invalid id_token'}, status=400)
+        return JsonResponse({'error': 'Invalid id_token'}, status=400)
 
     email = id_info.get('email')
     name = id_info.get('name', '')
 
     if not email:
-        return Response({'error': 'Email not found in token'}, status=400)
+        return JsonResponse({'error': 'Email not found in token'}, status=400)
 
-    user, created = CustomUser.objects.get_or_create(email=email, defaults={'full_name': name})
+    user, created = await CustomUser.objects.aget_or_create(email=email, defaults={'full_name': name})
 
     # Вот здесь мы создаём сессию Django
-    login(request, user)
+    await alogin(request, user)
 
     # Перенаправляем на URL, откуда пришел запрос, например, на youtube_auth
     next_url = request.GET.get('next', '/')
@@ -0,0 +1,126 @@
+import logging
+from datetime import date, timedelta
+
+from django.conf import settings
+from django.utils.dateparse import parse_datetime
+
+from .models import YoutubeBackfill
+from .quota import ApiUsage, scheduler
+from .services import (
+    advance_stats_watermark,
+    daily_stats_query,
+    execute_reports,
+    get_youtube_service,
+    save_daily_stats,
+)
+from .singleflight import cache_lock
+
+logger = logging.getLogger(__name__)
+
+
+def fetch_channel_start_date(creds_obj, channel_id, usage):
+    """Дата создания канала: с неё начинается история в Analytics API."""
+    response = scheduler.execute(
+        get_youtube_service(creds_obj).channels().list(part='snippet', id=channel_id),
+        'channels.list',
+        usage
+    )
+    items = response.get('items', [])
+    if not items:
+        return None
+    published_at = parse_datetime(items[0]['snippet']['publishedAt'])
+    return published_at.date() if published_at else None
+
+
+def plan_chunks(start_date, end_date, chunk_days):
+    """Делит [start_date, end_date] на последовательные куски не длиннее chunk_days дней."""
+    chunks = []
+    chunk_start = start_date
+    while chunk_start <= end_date:
+        chunk_end = min(end_date, chunk_start + timedelta(days=chunk_days - 1))
+        chunks.append((chunk_start, chunk_end))
+        chunk_start = chunk_end + timedelta(days=1)
+    return chunks
+
+
+def _prepare(backfill, creds_obj, usage, start_date, chunk_days, restart):
+    if restart or backfill.start_date is None:
+        backfill.start_date = start_date or fetch_channel_start_date(creds_obj, backfill.channel.channel_id, usage)
+        backfill.end_date = date.today()
+        backfill.chunk_days = chunk_days or settings.YOUTUBE_BACKFILL_CHUNK_DAYS
+        backfill.completed_chunks = []
+    backfill.status = YoutubeBackfill.Status.RUNNING
+    backfill.error = ''
+    backfill.save()
+
+
+def run_backfill(creds_obj, channel, start_date=None, chunk_days=None, restart=False):
+    """
+    Загружает дневную статистику канала за всю историю кусками по chunk_days дней.
+
+    Куски запрашиваются волнами по YOUTUBE_ANALYTICS_MAX_WORKERS параллельно через
+    планировщик квоты. После каждой волны готовые куски записываются в чекпоинт
+    YoutubeBackfill.completed_chunks, поэтому прерванная загрузка продолжается
+    с недостающих кусков. Возвращает YoutubeBackfill или None, если загрузка канала
+    уже идёт в другом процессе.
+    """
+    with cache_lock(f'youtube:backfill:{channel.pk}', timeout=6 * 3600, wait=0) as acquired:
+        if not acquired:
+            logger.info(f"Backfill for channel {channel.channel_id} is already running")
+            return None
+
+        backfill, _ = YoutubeBackfill.objects.get_or_create(channel=channel)
+        try:
+            _run_chunks(backfill, creds_obj, start_date, chunk_days, restart)
+        except Exception as e:
+            backfill.status = YoutubeBackfill.Status.FAILED
+            backfill.error = str(e)
+            backfill.save(update_fields=['status', 'error', 'updated_at'])
+            raise
+        return backfill
+
+
+def _run_chunks(backfill, creds_obj, start_date, chunk_days, restart):
+    channel = backfill.channel
+    usage = ApiUsage(user_id=creds_obj.user_id)
+    _prepare(backfill, creds_obj, usage, start_date, chunk_days, restart)
+    if backfill.start_date is None:
+        raise ValueError(f'Start date of channel {channel.channel_id} is unknown')
+
+    completed = set(backfill.completed_chunks)
+    pending = [
+        chunk for chunk in plan_chunks(backfill.start_date, backfill.end_date, backfill.chunk_days)
+        if chunk[0].isoformat() not in completed
+    ]
+
+    error = None
+    wave_size = settings.YOUTUBE_ANALYTICS_MAX_WORKERS
+    for i in range(0, len(pending), wave_size):
+        wave = pending[i:i + wave_size]
+        results = execute_reports(creds_obj, {
+            chunk: daily_stats_query(channel.channel_id, *chunk) for chunk in wave
+        }, usage=usage)
+
+        for chunk in wave:
+            response = results[chunk]
+            if isinstance(response, Exception):
+                logger.error(f"Backfill chunk {chunk[0]}..{chunk[1]} for {channel.channel_id} failed: {response}")
+                error = error or response
+                continue
+            save_daily_stats(channel, response.get('rows', []))
+            completed.add(chunk[0].isoformat())
+
+        backfill.completed_chunks = sorted(completed)
+        backfill.save(update_fields=['completed_chunks', 'updated_at'])
+        if error is not None:
+            # Следующие волны упрутся в ту же ошибку (квота, доступ); продолжим при следующем запуске
+            break
+
+    if error is not None:
+        raise error
+
+    backfill.status = YoutubeBackfill.Status.DONE
+    backfill.save(update_fields=['status', 'updated_at'])
+    # Дальше регулярной синхронизации достаточно дней после конца загруженной истории
+    advance_stats_watermark(channel, backfill.end_date)
+    logger.info(f"Backfill for channel {channel.channel_id} finished, used {usage}")
@@ -0,0 +1,305 @@
+import math
+import time
+from datetime import date, timedelta
+from pathlib import Path
+
+from django.conf import settings
+from django.db import DatabaseError, connection
+from django.test import Client, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from accounts.models import CustomUser, GoogleCredentials
+from .caching import bump_data_version
+from .clients import clear_service_cache
+from .fakes import fake_channel_id
+from .models import (
+    YouTubeChannel,
+    YoutubeAudienceDemographics,
+    YoutubeDailyStats,
+    YouTubeVideo,
+    YouTubeVideoDailyStats,
+    YouTubeVideoSeries,
+)
+from .bulk import DEFAULT_BATCH_SIZE
+from .series import pack_rows, read_packed, read_rows
+from .services import VIDEOS_PAGE_SIZE, fetch_and_save_analytics_data, save_video_snapshots, update_all_videos
+
+BASELINE_PATH = Path(__file__).with_name('benchmark_baseline.json')
+
+# Потолок SQL-запросов на один запрос к представлению (кэш ответа холодный, сессия и пользователь
+# входят в счёт). Не зависит от числа видео и дней: рост значит N+1 или лишнее чтение
+VIEW_QUERY_BUDGETS = {
+    'youtube-dashboard': 7,
+    'channel_trends': 6,
+    'channel_trends_month': 6,
+    'video_trends': 5,
+    'video_timeseries': 4,
+    'audience_demographics': 4,
+    # Дни внутри окна YOUTUBE_ANALYTICS_SETTLE_DAYS перезапрашиваются и перезаписываются
+    'viewer_activity': 12,
+    'sync_status': 3,
+}
+
+# Загрузка: постоянная часть и запросы на каждую страницу из 50 видео
+INGEST_QUERY_BUDGET = 28
+INGEST_QUERY_BUDGET_PER_PAGE = 9
+
+# Бенчмарк меряет собственный код, поэтому лимиты квоты и частоты запросов к фейковому API сняты
+BENCHMARK_SETTINGS = dict(
+    YOUTUBE_API_FACTORY='youtube.fakes.FakeYouTubeApi',
+    YOUTUBE_QUOTA_DAILY_BUDGET=10 ** 9,
+    YOUTUBE_RATE_LIMIT_PROJECT=(10 ** 6, 10 ** 6),
+    YOUTUBE_RATE_LIMIT_USER=(10 ** 6, 10 ** 6),
+)
+
+
+def percentile(values, pct):
+    ordered = sorted(values)
+    return ordered[max(0, math.ceil(pct / 100 * len(ordered)) - 1)]
+
+
+def ingest_query_budget(videos):
+    return INGEST_QUERY_BUDGET + INGEST_QUERY_BUDGET_PER_PAGE * math.ceil(videos / VIDEOS_PAGE_SIZE)
+
+
+def create_fixture(email='benchmark@example.com'):
+    user = CustomUser.objects.create_user(email=email, password=None)
+    creds_obj = GoogleCredentials.objects.create(
+        user=user,
+        access_token='benchmark_access_token',
+        refresh_token='benchmark_refresh_token',
+        token_expiry=timezone.now() + timedelta(days=1),
+        scopes=' '.join(settings.YOUTUBE_SCOPES),
+        client_id=settings.YOUTUBE_CLIENT_ID,
+        client_secret=settings.YOUTUBE_CLIENT_SECRET,
+        token_uri='https://oauth2.googleapis.com/token',
+    )
+    # Свежий last_updated: дашборд не ставит синхронизацию в очередь Celery
+    channel = YouTubeChannel.objects.create(
+        user=user, credentials=creds_obj, channel_id=fake_channel_id(user.pk), title='Benchmark channel',
+        last_updated=timezone.now(),
+    )
+    return user, creds_obj, channel
+
+
+def _stored_rows():
+    return sum(
+        model.objects.count()
+        for model in (YoutubeDailyStats, YoutubeAudienceDemographics, YouTubeVideo, YouTubeVideoDailyStats)
+    )
+
+
+def bench_ingest(creds_obj, channel):
+    """Полная синхронизация канала из фейкового API: строк в секунду и число SQL-запросов."""
+    before = _stored_rows()
+    with CaptureQueriesContext(connection) as queries:
+        started = time.perf_counter()
+        fetch_and_save_analytics_data(creds_obj, channel.channel_id)
+        update_all_videos(creds_obj, channel.channel_id)
+        elapsed = time.perf_counter() - started
+    rows = _stored_rows() - before
+    return {
+        'rows': rows,
+        'seconds': round(elapsed, 3),
+        'rows_per_sec': round(rows / elapsed),
+        'queries': len(queries),
+    }
+
+
+def view_scenarios(channel, days):
+    date_to = date.today()
+    date_from = date_to - timedelta(days=days - 1)
+    period = {'date_from': date_from.isoformat(), 'date_to': date_to.isoformat()}
+    video_id = YouTubeVideo.objects.filter(channel=channel).values_list('video_id', flat=True).first()
+    return {
+        'youtube-dashboard': (reverse('youtube-dashboard'), {}),
+        'channel_trends': (reverse('channel_trends'), period),
+        'channel_trends_month': (reverse('channel_trends'), {**period, 'granularity': 'month'}),
+        'video_trends': (reverse('video_trends'), {**period, 'limit': 50}),
+        'video_timeseries': (reverse('video_timeseries', args=[video_id]), period),
+        'audience_demographics': (reverse('audience_demographics'), {'channel_id': channel.channel_id}),
+        'viewer_activity': (reverse('viewer_activity'), period),
+        'sync_status': (reverse('sync_status'), {}),
+    }
+
+
+def bench_views(client, channel, days, iterations):
+    """
+    Задержка p50/p95 и число SQL-запросов представлений. Перед каждым замером версия данных
+    канала сдвигается, так что ответ строится заново, а не берётся из кэша. Первый запрос
+    каждого сценария прогревочный: он же дозагружает активность зрителей из API.
+    """
+    results = {}
+    for name, (url, params) in view_scenarios(channel, days).items():
+        client.get(url, params)
+        timings, counts = [], []
+        for _ in range(iterations):
+            bump_data_version(channel.pk)
+            with CaptureQueriesContext(connection) as queries:
+                started = time.perf_counter()
+                response = client.get(url, params)
+                timings.append(time.perf_counter() - started)
+            if response.status_code != 200:
+                raise RuntimeError(f'{name} returned {response.status_code}')
+            counts.append(len(queries))
+        results[name] = {
+            'p50_ms': round(percentile(timings, 50) * 1000, 2),
+            'p95_ms': round(percentile(timings, 95) * 1000, 2),
+            'queries': max(counts),
+        }
+    return results
+
+
+def relation_bytes(model):
+    """Размер таблицы модели вместе с индексами (и TOAST на Postgres) или None, если база его не сообщает."""
+    table = model._meta.db_table
+    with connection.cursor() as cursor:
+        if connection.vendor == 'postgresql':
+            cursor.execute('SELECT pg_total_relation_size(%s)', [table])
+        elif connection.vendor == 'sqlite':
+            try:
+                cursor.execute(
+                    'SELECT SUM(pgsize) FROM dbstat WHERE name IN (SELECT name FROM sqlite_master WHERE tbl_name = %s)',
+                    [table]
+                )
+            except DatabaseError:
+                # SQLite собран без dbstat
+                return None
+        else:
+            return None
+        return cursor.fetchone()[0] or 0
+
+
+def bench_video_series(user, videos, days, iterations):
+    """
+    Снимки видео строками YouTubeVideoDailyStats против рядов YouTubeVideoSeries на одинаковых данных:
+    прирост размера таблиц, задержка чтения ряда одного видео за весь период (p50/p95) и дописывание
+    снимка следующего дня по всем видео через save_video_snapshots.
+    """
+    channel = YouTubeChannel.objects.create(user=user, channel_id='UC_benchmark_series', title='Benchmark series')
+    YouTubeVideo.objects.bulk_create(
+        YouTubeVideo(channel=channel, video_id=f'series_v{i}', title=f'Series video {i}', published_at=timezone.now())
+        for i in range(videos)
+    )
+    video_pks = list(YouTubeVideo.objects.filter(channel=channel).order_by('pk').values_list('pk', flat=True))
+    date_to = date.today() - timedelta(days=1)
+    date_from = date_to - timedelta(days=days - 1)
+    layouts = {'rows': YouTubeVideoDailyStats, 'packed': YouTubeVideoSeries}
+
+    sizes = {storage: relation_bytes(model) for storage, model in layouts.items()}
+    YouTubeVideoDailyStats.objects.bulk_create(
+        (
+            YouTubeVideoDailyStats(
+                video_id=pk, date=date_from + timedelta(days=day), views=(i + 1) * day, likes=day, comments=day // 10,
+                views_delta=i + 1 if day else None, likes_delta=1 if day else None,
+                comments_delta=int(day % 10 == 0) if day else None,
+            )
+            for i, pk in enumerate(video_pks)
+            for day in range(days)
+        ),
+        batch_size=DEFAULT_BATCH_SIZE,
+    )
+    pack_rows(video_pks=video_pks)
+    for storage, model in layouts.items():
+        after = relation_bytes(model)
+        sizes[storage] = None if after is None else after - sizes[storage]
+
+    if read_rows(video_pks[0], date_from, date_to) != read_packed(video_pks[0], date_from, date_to):
+        raise RuntimeError('Packed series differ from rows')
+
+    items = [
+        {'id': f'series_v{i}', 'statistics': {'viewCount': str((i + 1) * days), 'likeCount': str(days)}}
+        for i in range(videos)
+    ]
+    results = {}
+    for storage, read in (('rows', read_rows), ('packed', read_packed)):
+        timings = []
+        for n in range(iterations):
+            started = time.perf_counter()
+            read(video_pks[n % len(video_pks)], date_from, date_to)
+            timings.append(time.perf_counter() - started)
+
+        with override_settings(YOUTUBE_VIDEO_SERIES_STORAGE=storage), CaptureQueriesContext(connection) as queries:
+            started = time.perf_counter()
+            save_video_snapshots(channel, items, snapshot_date=date_to + timedelta(days=1))
+            append = time.perf_counter() - started
+
+        size = sizes[storage]
+        results[storage] = {
+            'bytes': size,
+            'bytes_per_snapshot': None if size is None else round(size / (videos * days), 1),
+            'read_p50_ms': round(percentile(timings, 50) * 1000, 2),
+            'read_p95_ms': round(percentile(timings, 95) * 1000, 2),
+            'append_ms': round(append * 1000, 2),
+            'append_queries': len(queries),
+        }
+    return results
+
+
+def run_benchmarks(videos=500, days=365, iterations=20):
+    """
+    Создаёт канал, загружает его из фейкового API и меряет загрузку и представления,
+    затем сравнивает хранилища дневных снимков видео.
+    """
+    with override_settings(**BENCHMARK_SETTINGS, YOUTUBE_FAKE_API_VIDEOS=videos, YOUTUBE_INITIAL_SYNC_DAYS=days):
+        clear_service_cache()
+        try:
+            user, creds_obj, channel = create_fixture()
+            ingest = bench_ingest(creds_obj, channel)
+            client = Client()
+            client.force_login(user)
+            views = bench_views(client, channel, days, iterations)
+            video_series = bench_video_series(user, videos, days, iterations)
+        finally:
+            clear_service_cache()
+    return {
+        'params': {'videos': videos, 'days': days, 'iterations': iterations},
+        'ingest': ingest,
+        'views': views,
+        'video_series': video_series,
+    }
+
+
+def check_query_budgets(results):
+    """Превышения бюджетов SQL-запросов (список строк, пустой, если всё в порядке)."""
+    failures = []
+    budget = ingest_query_budget(results['params']['videos'])
+    if results['ingest']['queries'] > budget:
+        failures.append(f"ingest: {results['ingest']['queries']} queries > budget {budget}")
+    for name, metrics in results['views'].items():
+        budget = VIEW_QUERY_BUDGETS.get(name)
+        if budget is not None and metrics['queries'] > budget:
+            failures.append(f"{name}: {metrics['queries']} queries > budget {budget}")
+    return failures
+
+
+def compare_with_baseline(results, baseline, tolerance=0.25):
+    """
+    Регрессии относительно сохранённого прогона: пропускная способность ниже baseline
+    больше чем на tolerance, p95 выше больше чем на tolerance, любое увеличение числа запросов.
+    """
+    regressions = []
+    current, base = results['ingest'], baseline.get('ingest', {})
+    if 'rows_per_sec' in base and current['rows_per_sec'] < base['rows_per_sec'] * (1 - tolerance):
+        regressions.append(f"ingest: {current['rows_per_sec']} rows/s < baseline {base['rows_per_sec']}")
+    if 'queries' in base and current['queries'] > base['queries']:
+        regressions.append(f"ingest: {current['queries']} queries > baseline {base['queries']}")
+
+    for name, metrics in results['views'].items():
+        base = baseline.get('views', {}).get(name)
+        if not base:
+            continue
+        if metrics['p95_ms'] > base['p95_ms'] * (1 + tolerance):
+            regressions.append(f"{name}: p95 {metrics['p95_ms']} ms > baseline {base['p95_ms']} ms")
+        if metrics['queries'] > base['queries']:
+            regressions.append(f"{name}: {metrics['queries']} queries > baseline {base['queries']}")
+
+    for storage, metrics in results.get('video_series', {}).items():
+        base = baseline.get('video_series', {}).get(storage)
+        if base and metrics['read_p95_ms'] > base['read_p95_ms'] * (1 + tolerance):
+            regressions.append(
+                f"video series ({storage}): read p95 {metrics['read_p95_ms']} ms > baseline {base['read_p95_ms']} ms"
+            )
+    return regressions
@@ -0,0 +1,93 @@
+from itertools import islice
+
+from django.db import transaction
+
+DEFAULT_BATCH_SIZE = 1000
+
+
+def _batches(objs, batch_size):
+    iterator = iter(objs)
+    while True:
+        batch = list(islice(iterator, batch_size))
+        if not batch:
+            return
+        yield batch
+
+
+def _attnames(model, field_names):
+    return [model._meta.get_field(name).attname for name in field_names]
+
+
+def _normalize(model, obj, field_names):
+    # Значения из API приходят строками ('123', '2025-08-01'), приводим их к типам полей,
+    # иначе сравнение с базой всегда будет считать строку изменённой
+    for name in field_names:
+        field = model._meta.get_field(name)
+        setattr(obj, field.attname, field.to_python(getattr(obj, field.attname)))
+
+
+def _upsert_batch(model, batch, unique_fields, update_fields):
+    key_attnames = _attnames(model, unique_fields)
+    update_attnames = _attnames(model, update_fields)
+
+    # При повторе ключа внутри пачки побеждает последняя строка (ON CONFLICT не допускает дублей)
+    by_key = {}
+    for obj in batch:
+        _normalize(model, obj, unique_fields + update_fields)
+        by_key[tuple(getattr(obj, name) for name in key_attnames)] = obj
+
+    lookup = {
+        f'{name}__in': {key[i] for key in by_key}
+        for i, name in enumerate(key_attnames)
+    }
+    key_len = len(key_attnames)
+    existing = {
+        row[:key_len]: row[key_len:]
+        for row in model.objects.filter(**lookup).values_list(*key_attnames, *update_attnames)
+    }
+
+    changed = [
+        obj for key, obj in by_key.items()
+        if existing.get(key) != tuple(getattr(obj, name) for name in update_attnames)
+    ]
+    if changed:
+        model.objects.bulk_create(
+            changed,
+            update_conflicts=True,
+            unique_fields=unique_fields,
+            update_fields=update_fields,
+        )
+    return len(changed)
+
+
+def bulk_upsert(model, objs, unique_fields, update_fields, batch_size=DEFAULT_BATCH_SIZE):
+    """
+    Вставляет или обновляет строки пачками через INSERT ... ON CONFLICT DO UPDATE.
+    На каждую пачку уходит один SELECT и не больше одного INSERT; строки, значения
+    которых не изменились, не пишутся. Возвращает число записанных строк.
+    """
+    written = 0
+    with transaction.atomic():
+        for batch in _batches(objs, batch_size):
+            written += _upsert_batch(model, batch, list(unique_fields), list(update_fields))
+    return written
+
+
+def bulk_replace(model, scope, objs, unique_fields, update_fields, batch_size=DEFAULT_BATCH_SIZE):
+    """
+    Как bulk_upsert, но дополнительно удаляет из scope строки, которых нет в objs.
+    Всё выполняется в одной транзакции, поэтому читатели не видят пустого набора.
+    Возвращает число записанных и удалённых строк.
+    """
+    objs = list(objs)
+    key_attnames = _attnames(model, unique_fields)
+    with transaction.atomic():
+        written = bulk_upsert(model, objs, unique_fields, update_fields, batch_size=batch_size)
+        keep = {tuple(getattr(obj, name) for name in key_attnames) for obj in objs}
+        stale_pks = [
+            row[0] for row in scope.values_list('pk', *key_attnames)
+            if row[1:] not in keep
+        ]
+        if stale_pks:
+            written += model.objects.filter(pk__in=stale_pks).delete()[0]
+    return written
@@ -0,0 +1,113 @@
+import hashlib
+import json
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.serializers.json import DjangoJSONEncoder
+from django.http import HttpResponse
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date
+
+
+def _version_key(channel_pk):
+    return f'youtube:data_version:{channel_pk}'
+
+
+def get_data_version(channel_pk):
+    """
+    Версия данных канала: время последней записи в миллисекундах.
+    Если ключа нет (холодный кэш или вытеснение), версия начинается с текущего момента,
+    так что старые записи кэша гарантированно не переиспользуются.
+    """
+    if channel_pk is None:
+        return 0
+    version = cache.get(_version_key(channel_pk))
+    if version is None:
+        version = int(time.time() * 1000)
+        if not cache.add(_version_key(channel_pk), version, timeout=None):
+            version = cache.get(_version_key(channel_pk), version)
+    return version
+
+
+async def aget_data_version(channel_pk):
+    if channel_pk is None:
+        return 0
+    version = await cache.aget(_version_key(channel_pk))
+    if version is None:
+        version = int(time.time() * 1000)
+        if not await cache.aadd(_version_key(channel_pk), version, timeout=None):
+            version = await cache.aget(_version_key(channel_pk), version)
+    return version
+
+
+def bump_data_version(channel_pk):
+    """
+    Вызывается после коммита новых строк канала: все закэшированные ответы канала устаревают.
+    До коммита вызывать нельзя, иначе параллельный запрос закэширует старые данные под новой версией.
+    """
+    version = max(int(time.time() * 1000), get_data_version(channel_pk) + 1)
+    cache.set(_version_key(channel_pk), version, timeout=None)
+    return version
+
+
+def _response_fingerprint(user_pk, endpoint, channel_pks, versions, params):
+    fingerprint = json.dumps(
+        [endpoint, user_pk, channel_pks, versions, params],
+        cls=DjangoJSONEncoder,
+        sort_keys=True,
+    )
+    digest = hashlib.sha1(fingerprint.encode()).hexdigest()
+    last_modified = max(versions) // 1000 if any(versions) else None
+    return digest, f'"{digest}"', last_modified
+
+
+def _with_cache_headers(response, etag, last_modified):
+    response['ETag'] = etag
+    if last_modified:
+        response['Last-Modified'] = http_date(last_modified)
+    response['Cache-Control'] = 'private, no-cache'
+    return response
+
+
+def cached_json_response(request, endpoint, channel_pks, params, build):
+    """
+    Отдаёт JSON-ответ из кэша или строит его через build().
+
+    Ключ и ETag собираются из пользователя, каналов с их версиями данных, эндпоинта
+    и параметров запроса, поэтому новый ответ появляется сразу после записи данных.
+    Условные запросы (If-None-Match / If-Modified-Since) получают 304 без обращения к кэшу.
+    """
+    versions = [get_data_version(pk) for pk in channel_pks]
+    digest, etag, last_modified = _response_fingerprint(
+        getattr(request.user, 'pk', None), endpoint, channel_pks, versions, params
+    )
+
+    response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+    if response is None:
+        key = f'youtube:response:{endpoint}:{digest}'
+        content = cache.get(key)
+        if content is None:
+            content = json.dumps(build(), cls=DjangoJSONEncoder)
+            cache.set(key, content, timeout=settings.YOUTUBE_RESPONSE_CACHE_TTL)
+        response = HttpResponse(content, content_type='application/json')
+
+    return _with_cache_headers(response, etag, last_modified)
+
+
+async def acached_json_response(request, endpoint, channel_pks, params, build):
+    """То же, что cached_json_response, для async-представлений: build — корутинная функция."""
+    user = await request.auser()
+    versions = [await aget_data_version(pk) for pk in channel_pks]
+    digest, etag, last_modified = _response_fingerprint(user.pk, endpoint, channel_pks, versions, params)
+
+    response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+    if response is None:
+        key = f'youtube:response:{endpoint}:{digest}'
+        content = await cache.aget(key)
+        if content is None:
+            content = json.dumps(await build(), cls=DjangoJSONEncoder)
+            await cache.aset(key, content, timeout=settings.YOUTUBE_RESPONSE_CACHE_TTL)
+        response = HttpResponse(content, content_type='application/json')
+
+    return _with_cache_headers(response, etag, last_modified)
@@ -0,0 +1,76 @@
+import json
+import threading
+from functools import lru_cache
+
+from cachetools import TTLCache
+from django.conf import settings
+from django.utils.module_loading import import_string
+from google.oauth2.credentials import Credentials
+from google_auth_httplib2 import AuthorizedHttp
+from googleapiclient.discovery import build_from_document
+from googleapiclient.discovery_cache import get_static_doc
+
+from accounts.services import get_valid_access_token
+from social_analytics.transport import get_httplib2
+
+_clients = TTLCache(maxsize=settings.YOUTUBE_CLIENT_CACHE_SIZE, ttl=settings.YOUTUBE_CLIENT_CACHE_TTL)
+_clients_lock = threading.Lock()
+
+
+@lru_cache(maxsize=None)
+def get_discovery_document(service_name, version):
+    """Статический discovery-документ из googleapiclient, разобранный один раз на процесс."""
+    content = get_static_doc(service_name, version)
+    if content is None:
+        raise ValueError(f"No static discovery document for {service_name} {version}")
+    return json.loads(content)
+
+
+def build_credentials(creds_obj):
+    # Токен уже проверен менеджером токенов, поэтому Credentials создаётся без expiry
+    # и не обновляет его сам в обход записи в GoogleCredentials
+    creds_info = {
+        'token': creds_obj.access_token,
+        'refresh_token': creds_obj.refresh_token,
+        'token_uri': creds_obj.token_uri,
+        'client_id': creds_obj.client_id,
+        'client_secret': creds_obj.client_secret,
+        'scopes': creds_obj.scopes.split(' '),
+        'universe_domain': 'googleapis.com'
+    }
+    return Credentials.from_authorized_user_info(info=creds_info)
+
+
+def get_service(service_name, version, creds_obj):
+    """
+    Возвращает готовый клиент API из LRU-кэша с TTL.
+
+    httplib2, на котором работает googleapiclient, не потокобезопасен, поэтому
+    клиент кэшируется отдельно для каждого потока: в ключ входит id потока.
+    Все клиенты потока работают через его общий httplib2.Http с открытыми соединениями.
+    Обновлённый access token даёт новый ключ, и старый клиент вытесняется по TTL.
+    """
+    access_token = get_valid_access_token(creds_obj)
+    key = (service_name, version, creds_obj.pk, access_token, threading.get_ident())
+    with _clients_lock:
+        service = _clients.get(key)
+    if service is not None:
+        return service
+
+    # Сборка клиента дорогая, поэтому делаем её вне блокировки
+    if settings.YOUTUBE_API_FACTORY:
+        # Локальный API (например, youtube.fakes.FakeYouTubeApi) для разработки и бенчмарков
+        service = import_string(settings.YOUTUBE_API_FACTORY)(service_name, version, creds_obj)
+    else:
+        service = build_from_document(
+            get_discovery_document(service_name, version),
+            http=AuthorizedHttp(build_credentials(creds_obj), http=get_httplib2())
+        )
+    with _clients_lock:
+        _clients[key] = service
+    return service
+
+
+def clear_service_cache():
+    with _clients_lock:
+        _clients.clear()
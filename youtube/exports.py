@@ -0,0 +1,177 @@
+import csv
+from itertools import groupby
+from operator import itemgetter
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+
+from .models import YoutubeDailyStats, YouTubeVideo, YouTubeVideoDailyStats, YouTubeVideoSeries
+from .series import packed_storage, window
+
+EXPORT_FORMATS = {
+    'csv': 'text/csv',
+    'ndjson': 'application/x-ndjson',
+}
+
+# Набор данных: модель, путь до пользователя, путь до канала, поле даты для фильтра,
+# порядок строк и колонки выгрузки (имя колонки -> lookup)
+EXPORT_DATASETS = {
+    'channel_daily': {
+        'model': YoutubeDailyStats,
+        'user': 'channel__user',
+        'channel': 'channel__channel_id',
+        'date': 'date',
+        'order_by': ('channel', 'date'),
+        'columns': {
+            'channel_id': 'channel__channel_id',
+            'date': 'date',
+            'subscribers_gained': 'subscribers_gained',
+            'subscribers_lost': 'subscribers_lost',
+            'views': 'views',
+            'estimated_minutes_watched': 'estimated_minutes_watched',
+            'likes': 'likes',
+            'comments': 'comments',
+        },
+    },
+    'videos': {
+        'model': YouTubeVideo,
+        'user': 'channel__user',
+        'channel': 'channel__channel_id',
+        'date': 'published_at__date',
+        'order_by': ('pk',),
+        'columns': {
+            'channel_id': 'channel__channel_id',
+            'video_id': 'video_id',
+            'title': 'title',
+            'published_at': 'published_at',
+            'views': 'views',
+            'likes': 'likes',
+            'comments': 'comments',
+        },
+    },
+    'video_daily': {
+        'model': YouTubeVideoDailyStats,
+        'user': 'video__channel__user',
+        'channel': 'video__channel__channel_id',
+        'date': 'date',
+        'order_by': ('video', 'date'),
+        'columns': {
+            'video_id': 'video__video_id',
+            'date': 'date',
+            'views': 'views',
+            'likes': 'likes',
+            'comments': 'comments',
+            'views_delta': 'views_delta',
+            'likes_delta': 'likes_delta',
+            'comments_delta': 'comments_delta',
+        },
+    },
+}
+
+
+class _Echo:
+    """Файлоподобный объект для csv.writer: writerow просто возвращает готовую строку."""
+
+    def write(self, value):
+        return value
+
+
+class PackedVideoDailyRows:
+    """
+    Строки набора video_daily из хранилища 'packed': ряды видео разворачиваются по дням.
+    Как и values_list, отдаёт строки через iterator(chunk_size).
+    """
+
+    def __init__(self, queryset, date_from=None, date_to=None):
+        self.queryset = queryset
+        self.date_from = date_from
+        self.date_to = date_to
+
+    def iterator(self, chunk_size):
+        # Ряд — это до 366 строк выгрузки, поэтому за один заход читается меньше рядов
+        series = self.queryset.order_by('video', 'year').values_list('video__video_id', 'year', 'first_day', 'data')
+        for video_id, group in groupby(series.iterator(chunk_size=max(1, chunk_size // 366)), key=itemgetter(0)):
+            days = window([row[1:] for row in group], self.date_from, self.date_to)
+            values = [days[name] for name in EXPORT_DATASETS['video_daily']['columns'] if name not in ('video_id', 'date')]
+            for row in zip(days['dates'], *values):
+                yield (video_id, *row)
+
+
+def _packed_video_daily(user, channel_ids, date_from, date_to):
+    queryset = YouTubeVideoSeries.objects.all()
+    if user is not None:
+        queryset = queryset.filter(video__channel__user=user)
+    if channel_ids:
+        queryset = queryset.filter(video__channel__channel_id__in=channel_ids)
+    # Предыдущий год нужен для прироста первого дня периода
+    if date_from:
+        queryset = queryset.filter(year__gte=date_from.year - 1)
+    if date_to:
+        queryset = queryset.filter(year__lte=date_to.year)
+    return PackedVideoDailyRows(queryset, date_from, date_to)
+
+
+def export_queryset(dataset, user=None, channel_ids=None, date_from=None, date_to=None):
+    """Строки набора данных в виде values_list в порядке колонок EXPORT_DATASETS."""
+    if dataset == 'video_daily' and packed_storage():
+        return _packed_video_daily(user, channel_ids, date_from, date_to)
+    spec = EXPORT_DATASETS[dataset]
+    queryset = spec['model'].objects.all()
+    if user is not None:
+        queryset = queryset.filter(**{spec['user']: user})
+    if channel_ids:
+        queryset = queryset.filter(**{f"{spec['channel']}__in": channel_ids})
+    if date_from:
+        queryset = queryset.filter(**{f"{spec['date']}__gte": date_from})
+    if date_to:
+        queryset = queryset.filter(**{f"{spec['date']}__lte": date_to})
+    return queryset.order_by(*spec['order_by']).values_list(*spec['columns'].values())
+
+
+def _iter_rows(queryset, chunk_size):
+    # iterator() не складывает строки в кэш QuerySet, а на Postgres читает их серверным курсором
+    return queryset.iterator(chunk_size=chunk_size)
+
+
+def _iter_csv(columns, rows):
+    writer = csv.writer(_Echo())
+    yield writer.writerow(columns)
+    for row in rows:
+        yield writer.writerow(row)
+
+
+def _iter_ndjson(columns, rows):
+    encoder = DjangoJSONEncoder()
+    for row in rows:
+        yield encoder.encode(dict(zip(columns, row))) + '\n'
+
+
+def _buffered(lines, lines_per_chunk):
+    # Отдаём клиенту куски по lines_per_chunk строк, а не по строке: меньше накладных
+    # расходов на запись в сокет и сжатие
+    buffer = []
+    for line in lines:
+        buffer.append(line)
+        if len(buffer) >= lines_per_chunk:
+            yield ''.join(buffer)
+            buffer = []
+    if buffer:
+        yield ''.join(buffer)
+
+
+def stream_export(dataset, fmt, queryset, chunk_size=None):
+    """
+    Генератор текстовых кусков выгрузки в формате fmt ('csv' или 'ndjson').
+    В памяти одновременно находится не больше chunk_size строк, сколько бы их ни было всего.
+    """
+    if fmt not in EXPORT_FORMATS:
+        raise ValueError(f'Unsupported export format: {fmt}')
+    chunk_size = chunk_size or settings.YOUTUBE_EXPORT_CHUNK_SIZE
+    columns = list(EXPORT_DATASETS[dataset]['columns'])
+    rows = _iter_rows(queryset, chunk_size)
+    lines = _iter_csv(columns, rows) if fmt == 'csv' else _iter_ndjson(columns, rows)
+    return _buffered(lines, chunk_size)
+
+
+def export_filename(dataset, fmt, compress=False):
+    return f"{dataset}.{fmt}{'.gz' if compress else ''}"
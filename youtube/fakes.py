@@ -0,0 +1,157 @@
+import asyncio
+import time
+from datetime import date, timedelta
+from types import SimpleNamespace
+
+from django.conf import settings
+
+
+class FakeGenerativeModel:
+    """
+    Локальная замена genai.GenerativeModel с тем же generate_content(prompt, stream=...)
+    и generate_content_async(prompt).
+    Подключается через GEMINI_MODEL_FACTORY='youtube.fakes.FakeGenerativeModel' и отвечает
+    без сети, что удобно для разработки интерфейса чата и для тестов.
+    """
+
+    reply = 'Это тестовый ответ локальной модели по сводке канала.'
+
+    def __init__(self, model_name=None, delay=0.0):
+        self.model_name = model_name
+        self.delay = delay
+        self.prompts = []
+        self.closed_streams = 0
+
+    def _chunks(self):
+        words = self.reply.split(' ')
+        return [word + (' ' if i < len(words) - 1 else '') for i, word in enumerate(words)]
+
+    def _stream(self):
+        try:
+            for chunk in self._chunks():
+                if self.delay:
+                    time.sleep(self.delay)
+                yield SimpleNamespace(text=chunk)
+        except GeneratorExit:
+            self.closed_streams += 1
+            raise
+
+    def generate_content(self, prompt, stream=False):
+        self.prompts.append(prompt)
+        if stream:
+            return self._stream()
+        return SimpleNamespace(text=self.reply)
+
+    async def generate_content_async(self, prompt):
+        self.prompts.append(prompt)
+        if self.delay:
+            await asyncio.sleep(self.delay)
+        return SimpleNamespace(text=self.reply)
+
+
+FAKE_AGE_GROUPS = ['age13-17', 'age18-24', 'age25-34', 'age35-44', 'age45-54', 'age55-64', 'age65-']
+FAKE_GENDERS = ['female', 'male']
+FAKE_DEVICE_TYPES = ['MOBILE', 'DESKTOP', 'TV', 'TABLET']
+FAKE_SUBSCRIBED_STATUSES = ['SUBSCRIBED', 'UNSUBSCRIBED']
+
+
+def fake_channel_id(user_id):
+    return f'UC_fake_{user_id}'
+
+
+class _FakeRequest:
+    def __init__(self, handler, params, latency):
+        self.handler = handler
+        self.params = params
+        self.latency = latency
+
+    def execute(self, num_retries=0):
+        if self.latency:
+            time.sleep(self.latency)
+        return self.handler(**self.params)
+
+
+class _FakeResource:
+    def __init__(self, latency, **methods):
+        for name, handler in methods.items():
+            setattr(self, name, lambda handler=handler, **params: _FakeRequest(handler, params, latency))
+
+
+class FakeYouTubeApi:
+    """
+    Локальная замена клиентов googleapiclient для YouTube Data API v3 и Analytics API v2.
+
+    Подключается через YOUTUBE_API_FACTORY='youtube.fakes.FakeYouTubeApi' и отвечает детерминированными
+    данными без сети: у каждого пользователя один канал fake_channel_id(user_id) с
+    YOUTUBE_FAKE_API_VIDEOS видео, а каждый ответ ждёт YOUTUBE_FAKE_API_LATENCY секунд,
+    как будто ходил в Google. Нужна для разработки без квоты и для бенчмарков.
+    """
+
+    def __init__(self, service_name=None, version=None, creds_obj=None):
+        self.channel_id = fake_channel_id(getattr(creds_obj, 'user_id', 0))
+        self.video_count = getattr(settings, 'YOUTUBE_FAKE_API_VIDEOS', 200)
+        self.latency = getattr(settings, 'YOUTUBE_FAKE_API_LATENCY', 0.0)
+
+    def channels(self):
+        return _FakeResource(self.latency, list=self._channels_list)
+
+    def playlistItems(self):
+        return _FakeResource(self.latency, list=self._playlist_items_list)
+
+    def videos(self):
+        return _FakeResource(self.latency, list=self._videos_list)
+
+    def reports(self):
+        return _FakeResource(self.latency, query=self._reports_query)
+
+    def _channels_list(self, part, id=None, mine=False):
+        channel_id = id or self.channel_id
+        return {'items': [{
+            'id': channel_id,
+            'snippet': {'title': f'Fake channel {channel_id}', 'description': ''},
+            'contentDetails': {'relatedPlaylists': {'uploads': f'UU{channel_id[2:]}'}},
+        }]}
+
+    def _video_id(self, index):
+        return f'{self.channel_id}_v{index}'
+
+    def _playlist_items_list(self, part, playlistId, maxResults=50, pageToken=None):
+        start = int(pageToken or 0)
+        end = min(start + maxResults, self.video_count)
+        response = {'items': [{'contentDetails': {'videoId': self._video_id(i)}} for i in range(start, end)]}
+        if end < self.video_count:
+            response['nextPageToken'] = str(end)
+        return response
+
+    def _videos_list(self, part, id, maxResults=50):
+        items = []
+        for video_id in id.split(','):
+            index = int(video_id.rsplit('_v', 1)[1])
+            published = date.today() - timedelta(days=index % 1000)
+            items.append({
+                'id': video_id,
+                'snippet': {'title': f'Fake video {index}', 'publishedAt': f'{published.isoformat()}T12:00:00Z'},
+                'statistics': {
+                    'viewCount': str(index * 7919 % 100000),
+                    'likeCount': str(index * 104729 % 5000),
+                    'commentCount': str(index * 1299709 % 500),
+                },
+            })
+        return {'items': items}
+
+    def _reports_query(self, ids, startDate, endDate, metrics, dimensions, **params):
+        start, end = date.fromisoformat(startDate), date.fromisoformat(endDate)
+        days = [start + timedelta(days=i) for i in range((end - start).days + 1)]
+
+        if dimensions == 'day':
+            rows = [[d.isoformat(), 1000 + d.toordinal() % 500, d.toordinal() % 13, d.toordinal() % 5] for d in days]
+        elif dimensions == 'ageGroup,gender':
+            buckets = [(age, gender) for age in FAKE_AGE_GROUPS for gender in FAKE_GENDERS]
+            rows = [[age, gender, round(100 / len(buckets), 2)] for age, gender in buckets]
+        elif dimensions == 'day,deviceType':
+            rows = [[d.isoformat(), v, 100 * (i + 1)] for d in days for i, v in enumerate(FAKE_DEVICE_TYPES)]
+        elif dimensions == 'day,subscribedStatus':
+            rows = [[d.isoformat(), v, 150 * (i + 1)] for d in days for i, v in enumerate(FAKE_SUBSCRIBED_STATUSES)]
+        else:
+            rows = []
+        return {'rows': rows}
@@ -1,27 +1,162 @@
+import hashlib
+import json
+import logging
+import threading
+
+from asgiref.sync import sync_to_async
 from django.conf import settings
+from django.core.cache import cache
+from django.core.serializers.json import DjangoJSONEncoder
+from django.utils.module_loading import import_string
 import google.generativeai as genai
 
+from social_analytics.metrics import OutboundCall, error_status
+
+logger = logging.getLogger(__name__)
+
+_model = None
+_model_config = None
+_model_lock = threading.Lock()
+
+
+def _create_model(model_name):
+    if settings.GEMINI_MODEL_FACTORY:
+        # Локальная модель (например, youtube.fakes.FakeGenerativeModel) для разработки и тестов
+        return import_string(settings.GEMINI_MODEL_FACTORY)(model_name)
 
-def get_gemini_model():
     api_key = settings.GEMINI_API_KEY
     if not api_key:
         raise ValueError("GEMINI_API_KEY не найден в настройках.")
-    
+
     genai.configure(api_key=api_key)
-    
-    model = genai.GenerativeModel("gemini-1.5-flash")
-    
-    return model
+    return genai.GenerativeModel(model_name)
+
+
+def get_gemini_model():
+    """
+    Общий на процесс клиент модели. Создаётся один раз и пересоздаётся,
+    только если поменялись ключ, имя модели или фабрика в настройках.
+    """
+    global _model, _model_config
+    config = (settings.GEMINI_MODEL_FACTORY, settings.GEMINI_MODEL_NAME, settings.GEMINI_API_KEY)
+    if _model is not None and _model_config == config:
+        return _model
+    with _model_lock:
+        if _model is None or _model_config != config:
+            _model = _create_model(settings.GEMINI_MODEL_NAME)
+            _model_config = config
+        return _model
+
+
+def reset_gemini_model():
+    global _model, _model_config
+    with _model_lock:
+        _model = None
+        _model_config = None
 
 
-def generate_content_summary(prompt):
+def chat_cache_key(question, data_version, *scope):
+    """
+    Ключ кэша ответа: хэш нормализованного вопроса, версии данных канала и области
+    (канал, период). Новые данные меняют версию, и старые ответы больше не находятся.
+    """
+    normalized = ' '.join(question.lower().split())
+    payload = json.dumps([normalized, data_version, *scope], cls=DjangoJSONEncoder)
+    return f'gemini:answer:{hashlib.sha256(payload.encode()).hexdigest()}'
+
+
+async def agenerate_cached_summary(cache_key, build_prompt):
+    """
+    Ответ Gemini из кэша или новый ответ, который кладётся в кэш на GEMINI_RESPONSE_CACHE_TTL.
+    Промпт строится через build_prompt() (синхронно, в потоке: там запросы к базе) только
+    при промахе кэша, а сама генерация не занимает поток, пока ждёт модель.
+    Возвращает (текст, взят ли из кэша). Ошибки генерации не кэшируются.
+    """
+    cached = await cache.aget(cache_key)
+    if cached is not None:
+        return cached, True
+
     try:
+        prompt = await sync_to_async(build_prompt)()
         model = get_gemini_model()
-        response = model.generate_content(prompt)
-        return response.text
+        with OutboundCall('gemini', 'generate_content'):
+            text = (await model.generate_content_async(prompt)).text
     except ValueError as e:
-        print(f"Ошибка: {e}")
-        return "Ошибка: API ключ не настроен."
+        logger.error(f"Gemini is not configured: {e}")
+        return "Ошибка: API ключ не настроен.", False
+    except Exception:
+        logger.exception("Gemini content generation failed")
+        return "Ошибка при генерации контента.", False
+
+    await cache.aset(cache_key, text, timeout=settings.GEMINI_RESPONSE_CACHE_TTL)
+    return text, False
+
+
+def _sse(event, data):
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
+def _close_stream(stream):
+    # У потокового ответа google-generativeai нет публичного close(): закрываем сам ответ,
+    # если умеет, иначе нижележащий gRPC/HTTP-итератор, чтобы модель перестала генерировать
+    for target in (stream, getattr(stream, '_iterator', None)):
+        for name in ('cancel', 'close'):
+            method = getattr(target, name, None)
+            if callable(method):
+                method()
+                return
+
+
+def stream_cached_summary(cache_key, build_prompt):
+    """
+    Генератор событий Server-Sent Events с ответом Gemini.
+
+    Куски текста отправляются событием token по мере генерации, в конце идёт done.
+    Ответ из кэша отдаётся одним token. Если клиент отключился, сервер закрывает
+    генератор, и поток модели закрывается вместе с ним; неполный ответ не кэшируется.
+    """
+    cached = cache.get(cache_key)
+    if cached is not None:
+        yield _sse('token', {'text': cached})
+        yield _sse('done', {'cached': True})
+        return
+
+    # Замер идёт от запроса к модели до последнего куска ответа
+    call = OutboundCall('gemini', 'stream_generate_content')
+    try:
+        model = get_gemini_model()
+        prompt = build_prompt()
+        call.start()
+        stream = model.generate_content(prompt, stream=True)
+    except ValueError as e:
+        call.finish('error')
+        logger.error(f"Gemini is not configured: {e}")
+        yield _sse('error', {'error': "Ошибка: API ключ не настроен."})
+        return
     except Exception as e:
-        print(f"Ошибка при генерации контента: {e}")
-        return "Ошибка при генерации контента."
\ No newline at end of file
+        call.finish(error_status(e))
+        logger.exception("Gemini stream failed to start")
+        yield _sse('error', {'error': "Ошибка при генерации контента."})
+        return
+
+    parts = []
+    completed = False
+    try:
+        for chunk in stream:
+            if chunk.text:
+                parts.append(chunk.text)
+                yield _sse('token', {'text': chunk.text})
+        completed = True
+        call.finish()
+    except Exception as e:
+        call.finish(error_status(e))
+        logger.exception("Gemini stream failed")
+        yield _sse('error', {'error': "Ошибка при генерации контента."})
+        return
+    finally:
+        if not completed:
+            call.finish('cancelled')
+            _close_stream(stream)
+
+    cache.set(cache_key, ''.join(parts), timeout=settings.GEMINI_RESPONSE_CACHE_TTL)
+    yield _sse('done', {'cached': False})
@@ -0,0 +1,60 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.utils.dateparse import parse_date
+
+from accounts.models import GoogleCredentials
+from youtube.backfill import run_backfill
+from youtube.models import YouTubeChannel, YoutubeBackfill
+from youtube.tasks import backfill_channel
+
+
+class Command(BaseCommand):
+    help = 'Загружает полную историю дневной статистики каналов с продолжением с последнего чекпоинта'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--channel', action='append', dest='channels', help='channel_id канала (можно несколько)')
+        parser.add_argument('--start-date', type=parse_date, help='Начало истории вместо даты создания канала')
+        parser.add_argument('--chunk-days', type=int, default=None)
+        parser.add_argument('--restart', action='store_true', help='Начать заново, игнорируя чекпоинт')
+        parser.add_argument('--async', action='store_true', dest='use_celery', help='Поставить задачи в очередь Celery')
+
+    def handle(self, *args, **options):
+        channels = YouTubeChannel.objects.select_related('credentials')
+        if options['channels']:
+            channels = channels.filter(channel_id__in=options['channels'])
+        elif not options['restart']:
+            # Без явного списка берём каналы, чья история ещё не загружена полностью
+            channels = channels.exclude(backfill__status=YoutubeBackfill.Status.DONE)
+
+        if options['use_celery']:
+            for channel in channels:
+                backfill_channel.delay(channel.pk, restart=options['restart'])
+                self.stdout.write(f'{channel.channel_id}: queued')
+            return
+
+        failed = 0
+        for channel in channels:
+            try:
+                creds_obj = channel.get_credentials()
+                if creds_obj is None:
+                    raise GoogleCredentials.DoesNotExist('No Google credentials for this channel')
+                backfill = run_backfill(
+                    creds_obj,
+                    channel,
+                    start_date=options['start_date'],
+                    chunk_days=options['chunk_days'],
+                    restart=options['restart'],
+                )
+            except Exception as e:
+                failed += 1
+                self.stderr.write(f'{channel.channel_id}: {e}')
+                continue
+
+            if backfill is None:
+                self.stdout.write(f'{channel.channel_id}: already running elsewhere')
+            else:
+                self.stdout.write(
+                    f'{channel.channel_id}: {backfill.status}, {len(backfill.completed_chunks)} chunks loaded'
+                )
+
+        if failed:
+            raise CommandError(f'{failed} channel backfills failed; rerun to resume from checkpoints')
@@ -0,0 +1,76 @@
+import json
+from pathlib import Path
+
+from django.core.management.base import BaseCommand, CommandError
+from django.test import override_settings
+from django.test.utils import (
+    setup_databases,
+    setup_test_environment,
+    teardown_databases,
+    teardown_test_environment,
+)
+
+from youtube.benchmarks import BASELINE_PATH, check_query_budgets, compare_with_baseline, run_benchmarks
+
+# Отдельный кэш: ответы и версии данных тестового канала не должны попасть в общий Redis
+BENCHMARK_CACHES = {'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}}
+
+
+class Command(BaseCommand):
+    help = (
+        'Меряет загрузку из фейкового Google API (строк/с), задержку представлений (p50/p95) '
+        'и число SQL-запросов во временной тестовой базе, сравнивает хранение снимков видео строками '
+        'и рядами и сравнивает результаты с сохранённым baseline'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--videos', type=int, default=500)
+        parser.add_argument('--days', type=int, default=365)
+        parser.add_argument('--iterations', type=int, default=20)
+        parser.add_argument('--baseline', type=Path, default=BASELINE_PATH)
+        parser.add_argument('--tolerance', type=float, default=0.25, help='Допустимое ухудшение времени, доля')
+        parser.add_argument('--update-baseline', action='store_true', help='Записать результаты как новый baseline')
+
+    def handle(self, *args, **options):
+        setup_test_environment()
+        old_config = setup_databases(verbosity=0, interactive=False)
+        try:
+            with override_settings(CACHES=BENCHMARK_CACHES):
+                results = run_benchmarks(options['videos'], options['days'], options['iterations'])
+        finally:
+            teardown_databases(old_config, verbosity=0)
+            teardown_test_environment()
+
+        ingest = results['ingest']
+        self.stdout.write(
+            f"ingest: {ingest['rows']} rows in {ingest['seconds']}s, "
+            f"{ingest['rows_per_sec']} rows/s, {ingest['queries']} queries"
+        )
+        for name, metrics in results['views'].items():
+            self.stdout.write(
+                f"{name}: p50 {metrics['p50_ms']} ms, p95 {metrics['p95_ms']} ms, {metrics['queries']} queries"
+            )
+        for storage, metrics in results['video_series'].items():
+            size = 'size n/a' if metrics['bytes'] is None else (
+                f"{metrics['bytes']} bytes ({metrics['bytes_per_snapshot']} per snapshot)"
+            )
+            self.stdout.write(
+                f"video series ({storage}): {size}, read p50 {metrics['read_p50_ms']} ms, "
+                f"p95 {metrics['read_p95_ms']} ms, append {metrics['append_ms']} ms "
+                f"in {metrics['append_queries']} queries"
+            )
+
+        failures = check_query_budgets(results)
+
+        if options['update_baseline']:
+            options['baseline'].write_text(json.dumps(results, indent=2) + '\n')
+            self.stdout.write(f"Baseline written to {options['baseline']}")
+        elif options['baseline'].exists():
+            baseline = json.loads(options['baseline'].read_text())
+            if baseline.get('params') != results['params']:
+                self.stderr.write('Baseline was recorded with other parameters, skipping comparison')
+            else:
+                failures += compare_with_baseline(results, baseline, options['tolerance'])
+
+        if failures:
+            raise CommandError('Performance regressions:\n' + '\n'.join(failures))
@@ -0,0 +1,53 @@
+import gzip
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils.dateparse import parse_date
+
+from accounts.models import CustomUser
+from youtube.exports import EXPORT_DATASETS, EXPORT_FORMATS, export_queryset, stream_export
+
+
+class Command(BaseCommand):
+    help = 'Потоково выгружает статистику каналов и видео в CSV или NDJSON'
+
+    def add_arguments(self, parser):
+        parser.add_argument('dataset', choices=sorted(EXPORT_DATASETS))
+        parser.add_argument('--format', dest='fmt', choices=sorted(EXPORT_FORMATS), default='csv')
+        parser.add_argument('--channel', action='append', dest='channels', help='channel_id канала (можно несколько)')
+        parser.add_argument('--user', help='email пользователя, чьи каналы выгружаются')
+        parser.add_argument('--date-from', type=parse_date)
+        parser.add_argument('--date-to', type=parse_date)
+        parser.add_argument('--chunk-size', type=int, default=None)
+        parser.add_argument('--output', '-o', help='Файл для записи; по умолчанию stdout')
+        parser.add_argument('--gzip', action='store_true', help='Сжать файл выгрузки (нужен --output)')
+
+    def handle(self, *args, **options):
+        if options['gzip'] and not options['output']:
+            raise CommandError('--gzip requires --output')
+
+        user = None
+        if options['user']:
+            try:
+                user = CustomUser.objects.get(email=options['user'])
+            except CustomUser.DoesNotExist:
+                raise CommandError(f"User {options['user']} not found")
+
+        queryset = export_queryset(
+            options['dataset'],
+            user=user,
+            channel_ids=options['channels'],
+            date_from=options['date_from'],
+            date_to=options['date_to'],
+        )
+        chunks = stream_export(options['dataset'], options['fmt'], queryset, chunk_size=options['chunk_size'])
+
+        if not options['output']:
+            for chunk in chunks:
+                self.stdout.write(chunk, ending='')
+            return
+
+        opener = gzip.open if options['gzip'] else open
+        with opener(options['output'], 'wt', encoding='utf-8', newline='') as output:
+            for chunk in chunks:
+                output.write(chunk)
+        self.stderr.write(f"Exported {options['dataset']} to {options['output']}")
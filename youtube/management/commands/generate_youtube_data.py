@@ -0,0 +1,73 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils.dateparse import parse_date
+
+from youtube.synthetic import DEMOGRAPHIC_BUCKETS, SyntheticDataGenerator, copy_supported
+
+
+class Command(BaseCommand):
+    help = (
+        'Генерирует синтетических пользователей, каналы, видео и статистику для проверки на больших объёмах. '
+        'На Postgres строки пишутся через COPY, иначе пачками INSERT; при одинаковых --seed и --end-date '
+        'данные совпадают'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=10)
+        parser.add_argument('--channels-per-user', type=int, default=1)
+        parser.add_argument('--videos-per-channel', type=int, default=100)
+        parser.add_argument('--years', type=float, default=1, help='Сколько лет дневной статистики каналов')
+        parser.add_argument(
+            '--demographic-buckets', type=int, default=len(DEMOGRAPHIC_BUCKETS),
+            help=f'Сколько сочетаний возраст/пол на канал (до {len(DEMOGRAPHIC_BUCKETS)})'
+        )
+        parser.add_argument('--video-days', type=int, default=0, help='Сколько последних дней снимков на видео')
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--end-date', type=parse_date, help='Последний день данных (по умолчанию сегодня)')
+        parser.add_argument('--prefix', default='synthetic', help='Префикс email сгенерированных пользователей')
+        parser.add_argument('--batch-size', type=int, default=10000)
+        parser.add_argument('--no-copy', action='store_true', help='Писать пачками INSERT даже на Postgres')
+        parser.add_argument('--skip-rollups', action='store_true', help='Не пересчитывать агрегаты по неделям и месяцам')
+        parser.add_argument('--clear', action='store_true', help='Удалить данные прошлого запуска с этим префиксом')
+
+    def handle(self, *args, **options):
+        days = round(options['years'] * 365)
+        if days < 1 or options['users'] < 1:
+            raise CommandError('--users and --years must be positive')
+        if not 0 <= options['demographic_buckets'] <= len(DEMOGRAPHIC_BUCKETS):
+            raise CommandError(f'--demographic-buckets must be between 0 and {len(DEMOGRAPHIC_BUCKETS)}')
+
+        generator = SyntheticDataGenerator(
+            users=options['users'],
+            channels_per_user=options['channels_per_user'],
+            videos_per_channel=options['videos_per_channel'],
+            days=days,
+            demographic_buckets=options['demographic_buckets'],
+            video_days=options['video_days'],
+            seed=options['seed'],
+            end_date=options['end_date'],
+            prefix=options['prefix'],
+            use_copy=copy_supported() and not options['no_copy'],
+            batch_size=options['batch_size'],
+            rollups=not options['skip_rollups'],
+        )
+
+        if options['clear']:
+            self.stdout.write(f'Deleted {generator.clear()} rows from the previous run')
+        elif generator.clear_needed():
+            raise CommandError(
+                f"Users with prefix '{options['prefix']}' already exist; pass --clear or another --prefix"
+            )
+
+        def progress(done, counts):
+            if options['verbosity'] > 1:
+                self.stdout.write(f"{done}/{options['users']} users: {counts}")
+
+        started = time.perf_counter()
+        counts = generator.generate(progress=progress)
+        elapsed = time.perf_counter() - started
+
+        rows = sum(counts.values())
+        method = 'COPY' if generator.use_copy else 'INSERT'
+        self.stdout.write(f'Generated {rows} rows in {elapsed:.1f}s ({rows / elapsed:.0f} rows/s, {method}): {counts}')
@@ -0,0 +1,18 @@
+from django.core.management.base import BaseCommand
+
+from youtube.series import pack_rows
+
+
+class Command(BaseCommand):
+    help = (
+        'Переносит дневные снимки видео из строк YouTubeVideoDailyStats в ряды YouTubeVideoSeries '
+        "перед переключением YOUTUBE_VIDEO_SERIES_STORAGE на 'packed'"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--delete-rows', action='store_true', help='Удалить перенесённые строки')
+        parser.add_argument('--chunk-size', type=int, default=10000, help='Сколько строк читать за один заход')
+
+    def handle(self, *args, **options):
+        videos, written = pack_rows(delete_rows=options['delete_rows'], chunk_size=options['chunk_size'])
+        self.stdout.write(f'Packed {videos} videos into {written} series')
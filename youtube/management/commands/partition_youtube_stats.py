@@ -0,0 +1,80 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+from django.utils.dateparse import parse_date
+
+from youtube.partitioning import (
+    PARTITIONED_MODELS,
+    convert_table,
+    ensure_partitions,
+    partition_status,
+    partitioning_supported,
+    verify_pruning,
+)
+
+
+def _date(value):
+    parsed = parse_date(value)
+    if not parsed:
+        raise CommandError(f'Invalid date: {value}')
+    return parsed
+
+
+class Command(BaseCommand):
+    help = (
+        'Помесячное секционирование таблиц дневной статистики каналов и видео на PostgreSQL: '
+        'перевод существующих таблиц, создание секций и проверка отсечения секций запросами трендов'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--convert', action='store_true', help='Перевести таблицы в секционированные')
+        parser.add_argument('--keep-old', action='store_true', help='Не удалять исходные таблицы после --convert')
+        parser.add_argument('--ensure', action='store_true', help='Создать недостающие секции')
+        parser.add_argument('--from', dest='start', type=_date, help='С какого месяца создавать секции (--ensure)')
+        parser.add_argument('--months-ahead', type=int, help='На сколько месяцев вперёд создавать секции')
+        parser.add_argument('--verify', action='store_true', help='Проверить отсечение секций по EXPLAIN')
+        parser.add_argument('--date-from', type=_date, help='Начало диапазона для --verify (по умолчанию 30 дней)')
+        parser.add_argument('--date-to', type=_date, help='Конец диапазона для --verify (по умолчанию сегодня)')
+
+    def handle(self, *args, **options):
+        if not partitioning_supported():
+            raise CommandError('Partitioning requires PostgreSQL')
+
+        if options['convert']:
+            for model in PARTITIONED_MODELS:
+                moved = convert_table(model, months_ahead=options['months_ahead'], keep_old=options['keep_old'])
+                table = model._meta.db_table
+                if moved is None:
+                    self.stdout.write(f'{table}: already partitioned')
+                else:
+                    self.stdout.write(f'{table}: converted, {moved} rows moved')
+
+        if options['ensure']:
+            created = ensure_partitions(start=options['start'], months_ahead=options['months_ahead'])
+            self.stdout.write(f'Created {len(created)} partitions')
+            for name in created:
+                self.stdout.write(f'  {name}')
+
+        for status in partition_status():
+            if status['partitioned']:
+                self.stdout.write(
+                    f"{status['table']}: {status['partitions']} partitions, "
+                    f"{status['default_rows']} rows in default partition"
+                )
+            else:
+                self.stdout.write(f"{status['table']}: not partitioned")
+
+        if options['verify']:
+            date_to = options['date_to'] or timezone.localdate()
+            date_from = options['date_from'] or date_to - timedelta(days=30)
+            failures = []
+            for report in verify_pruning(date_from, date_to):
+                self.stdout.write(
+                    f"{report['table']}: scans {len(report['scanned'])} of {report['partitions']} partitions "
+                    f"({', '.join(report['scanned']) or 'none'})"
+                )
+                if not report['pruned']:
+                    failures.append(report['table'])
+            if failures:
+                raise CommandError(f"No partition pruning for {', '.join(failures)}")
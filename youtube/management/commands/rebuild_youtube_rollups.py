@@ -0,0 +1,23 @@
+from django.core.management.base import BaseCommand
+
+from youtube.caching import bump_data_version
+from youtube.models import YouTubeChannel
+from youtube.rollups import rebuild_rollups
+
+
+class Command(BaseCommand):
+    help = 'Пересчитывает недельные и месячные агрегаты статистики каналов из дневных данных'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--channel', action='append', dest='channels', help='channel_id канала (можно несколько)')
+
+    def handle(self, *args, **options):
+        channels = YouTubeChannel.objects.all()
+        if options['channels']:
+            channels = channels.filter(channel_id__in=options['channels'])
+
+        for channel in channels.iterator():
+            written = rebuild_rollups(channel)
+            if written:
+                bump_data_version(channel.pk)
+            self.stdout.write(f'{channel.channel_id}: {written} rollup rows written')
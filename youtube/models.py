@@ -1,17 +1,52 @@
 from django.db import models
 from django.conf import settings
+from django.utils import timezone
+
+from accounts.models import GoogleCredentials
 
 class YouTubeChannel(models.Model):
+    class SyncStatus(models.TextChoices):
+        IDLE = 'idle', 'Idle'
+        QUEUED = 'queued', 'Queued'
+        RUNNING = 'running', 'Running'
+        FAILED = 'failed', 'Failed'
+
     user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='youtube_channels')
+    # Токен, выданный на этот канал при привязке (OAuth callback)
+    credentials = models.ForeignKey(
+        GoogleCredentials, on_delete=models.SET_NULL, null=True, blank=True, related_name='channels'
+    )
     channel_id = models.CharField(max_length=255, unique=True)
     title = models.CharField(max_length=255)
     description = models.TextField(blank=True, null=True)
+    uploads_playlist_id = models.CharField(max_length=255, blank=True, default='')
+    # Когда channels.list(mine=True) последний раз подтвердил, что токен выдан на этот канал
+    identity_checked_at = models.DateTimeField(null=True, blank=True)
     created_at = models.DateTimeField(auto_now_add=True)
     last_updated = models.DateTimeField(null=True, blank=True)
+    sync_status = models.CharField(max_length=16, choices=SyncStatus.choices, default=SyncStatus.IDLE)
+    sync_requested_at = models.DateTimeField(null=True, blank=True)
+    sync_error = models.TextField(blank=True, default='')
+    # Последний день, дневная статистика которого уже не пересматривается и загружена в базу
+    stats_settled_through = models.DateField(null=True, blank=True)
 
     def __str__(self):
         return self.title
 
+    def is_stale(self):
+        if not self.last_updated:
+            return True
+        return timezone.now() - self.last_updated > settings.YOUTUBE_SYNC_INTERVAL
+
+    def get_credentials(self):
+        """
+        Токен канала. У каналов, привязанных до хранения токена на канале, — последний
+        токен владельца. None, если доступ к Google не выдан.
+        """
+        if self.credentials_id:
+            return self.credentials
+        return GoogleCredentials.objects.filter(user_id=self.user_id).order_by('-pk').first()
+
 class YouTubeVideo(models.Model):
     channel = models.ForeignKey(YouTubeChannel, on_delete=models.CASCADE, related_name='videos')
     video_id = models.CharField(max_length=255, unique=True)
@@ -67,11 +102,99 @@ class YouTubeVideoDailyStats(models.Model):
     views = models.PositiveIntegerField(default=0)
     likes = models.PositiveIntegerField(default=0)
     comments = models.PositiveIntegerField(default=0)
+    # Прирост счётчиков с предыдущего снимка; пусто, если это первый снимок видео
+    views_delta = models.IntegerField(null=True, blank=True)
+    likes_delta = models.IntegerField(null=True, blank=True)
+    comments_delta = models.IntegerField(null=True, blank=True)
 
     class Meta:
+        # Уникальный индекс (video, date) обслуживает и чтение ряда одного видео по диапазону дат
         unique_together = ('video', 'date')
         ordering = ['date']
         verbose_name_plural = 'YouTube Video Daily Stats'
 
     def __str__(self):
-        return f'{self.video.title} - {self.date}'
\ No newline at end of file
+        return f'{self.video.title} - {self.date}'
+
+# Дневные снимки видео за календарный год одним массивом (хранилище 'packed', см. youtube/series.py)
+class YouTubeVideoSeries(models.Model):
+    video = models.ForeignKey(YouTubeVideo, on_delete=models.CASCADE, related_name='series')
+    year = models.PositiveSmallIntegerField()
+    # Номер дня года первой строки data (0 — 1 января)
+    first_day = models.PositiveSmallIntegerField(default=0)
+    # int32 little-endian, по строке (views, likes, comments) на день подряд; -1 — снимка нет
+    data = models.BinaryField(default=bytes)
+
+    class Meta:
+        unique_together = ('video', 'year')
+        ordering = ['year']
+        verbose_name_plural = 'YouTube Video Series'
+
+    def __str__(self):
+        return f'{self.video.title} - {self.year}'
+
+# Модель для активности зрителей по дням (тип устройства и статус подписки, из Analytics API)
+class YoutubeViewerActivity(models.Model):
+    channel = models.ForeignKey(YouTubeChannel, on_delete=models.CASCADE, related_name='viewer_activity')
+    date = models.DateField()
+    device_type = models.JSONField(default=dict)
+    subscribed_status = models.JSONField(default=dict)
+    fetched_at = models.DateTimeField()
+
+    class Meta:
+        unique_together = ('channel', 'date')
+        ordering = ['date']
+        verbose_name_plural = 'YouTube Viewer Activity'
+
+    def __str__(self):
+        return f'{self.channel.title} - {self.date}'
+
+
+# Агрегаты ежедневной статистики канала по неделям и месяцам
+class YoutubeStatsRollup(models.Model):
+    class Granularity(models.TextChoices):
+        WEEK = 'week', 'Week'
+        MONTH = 'month', 'Month'
+
+    channel = models.ForeignKey(YouTubeChannel, on_delete=models.CASCADE, related_name='stats_rollups')
+    granularity = models.CharField(max_length=8, choices=Granularity.choices)
+    period_start = models.DateField()
+    days = models.PositiveSmallIntegerField(default=0)
+    subscribers_gained = models.BigIntegerField(default=0)
+    subscribers_lost = models.BigIntegerField(default=0)
+    views = models.BigIntegerField(default=0)
+    estimated_minutes_watched = models.BigIntegerField(default=0)
+    likes = models.BigIntegerField(default=0)
+    comments = models.BigIntegerField(default=0)
+
+    class Meta:
+        unique_together = ('channel', 'granularity', 'period_start')
+        ordering = ['period_start']
+        verbose_name_plural = 'YouTube Stats Rollups'
+
+    def __str__(self):
+        return f'{self.channel.title} - {self.granularity} {self.period_start}'
+
+
+# Состояние загрузки полной истории канала; completed_chunks — чекпоинт для продолжения после обрыва
+class YoutubeBackfill(models.Model):
+    class Status(models.TextChoices):
+        PENDING = 'pending', 'Pending'
+        RUNNING = 'running', 'Running'
+        DONE = 'done', 'Done'
+        FAILED = 'failed', 'Failed'
+
+    channel = models.OneToOneField(YouTubeChannel, on_delete=models.CASCADE, related_name='backfill')
+    status = models.CharField(max_length=16, choices=Status.choices, default=Status.PENDING)
+    start_date = models.DateField(null=True, blank=True)
+    end_date = models.DateField(null=True, blank=True)
+    chunk_days = models.PositiveIntegerField(default=180)
+    completed_chunks = models.JSONField(default=list, blank=True)
+    error = models.TextField(blank=True, default='')
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        verbose_name_plural = 'YouTube Backfills'
+
+    def __str__(self):
+        return f'{self.channel.title} - {self.status}'
@@ -0,0 +1,274 @@
+import json
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.utils import timezone
+
+from .models import YoutubeDailyStats, YouTubeVideoDailyStats
+from .rollups import period_end
+
+# Модель и внешний ключ, который вместе с date образует уникальный ключ строки
+PARTITIONED_MODELS = {
+    YoutubeDailyStats: 'channel',
+    YouTubeVideoDailyStats: 'video',
+}
+
+
+def partitioning_supported():
+    return connection.vendor == 'postgresql'
+
+
+def _qn(name):
+    return connection.ops.quote_name(name)
+
+
+def month_start(day):
+    return day.replace(day=1)
+
+
+def iter_months(first, last):
+    """Первые числа месяцев от месяца first до месяца last включительно."""
+    month = month_start(first)
+    while month <= last:
+        yield month
+        month = period_end('month', month)
+
+
+def last_partition_month(months_ahead=None):
+    """Месяц последней секции, которая должна существовать заранее."""
+    if months_ahead is None:
+        months_ahead = settings.YOUTUBE_STATS_PARTITION_MONTHS_AHEAD
+    month = month_start(timezone.localdate())
+    for _ in range(months_ahead):
+        month = period_end('month', month)
+    return month
+
+
+def partition_name(table, month):
+    return f'{table}_p{month:%Y_%m}'
+
+
+def default_partition_name(table):
+    return f'{table}_default'
+
+
+def is_partitioned(table):
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT relkind FROM pg_class WHERE oid = to_regclass(%s)", [table])
+        row = cursor.fetchone()
+    return bool(row) and row[0] == 'p'
+
+
+def list_partitions(table):
+    """Имена секций таблицы."""
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT child.relname FROM pg_inherits "
+            "JOIN pg_class child ON child.oid = pg_inherits.inhrelid "
+            "WHERE pg_inherits.inhparent = to_regclass(%s) ORDER BY child.relname",
+            [table]
+        )
+        return [row[0] for row in cursor.fetchall()]
+
+
+def _bounds(month):
+    # Границы подставляются литералами: параметры в DDL не поддерживаются серверной подстановкой
+    return f"'{month.isoformat()}'", f"'{period_end('month', month).isoformat()}'"
+
+
+def create_partition(table, month):
+    """
+    Создаёт секцию месяца month, если её ещё нет. Строки этого месяца, успевшие попасть
+    в секцию по умолчанию, переносятся в новую секцию в той же транзакции.
+    Возвращает True, если секция создана.
+    """
+    name = partition_name(table, month)
+    if name in list_partitions(table):
+        return False
+
+    lower, upper = _bounds(month)
+    default = default_partition_name(table)
+    with transaction.atomic(), connection.cursor() as cursor:
+        cursor.execute(
+            f'SELECT EXISTS (SELECT 1 FROM {_qn(default)} WHERE "date" >= {lower} AND "date" < {upper})'
+        )
+        create = f'CREATE TABLE {_qn(name)} PARTITION OF {_qn(table)} FOR VALUES FROM ({lower}) TO ({upper})'
+        if not cursor.fetchone()[0]:
+            cursor.execute(create)
+            return True
+
+        # Секцию, пересекающуюся со строками секции по умолчанию, нельзя создать: отсоединяем её на время переноса
+        cursor.execute(f'ALTER TABLE {_qn(table)} DETACH PARTITION {_qn(default)}')
+        cursor.execute(create)
+        cursor.execute(
+            f'INSERT INTO {_qn(name)} SELECT * FROM {_qn(default)} WHERE "date" >= {lower} AND "date" < {upper}'
+        )
+        cursor.execute(f'DELETE FROM {_qn(default)} WHERE "date" >= {lower} AND "date" < {upper}')
+        cursor.execute(f'ALTER TABLE {_qn(table)} ATTACH PARTITION {_qn(default)} DEFAULT')
+    return True
+
+
+def ensure_partitions(start=None, months_ahead=None):
+    """
+    Создаёт недостающие секции секционированных таблиц от месяца start (по умолчанию
+    текущего) до months_ahead месяцев вперёд. Несекционированные таблицы пропускаются.
+    Возвращает список созданных секций.
+    """
+    if not partitioning_supported():
+        return []
+    last = last_partition_month(months_ahead)
+
+    created = []
+    for model in PARTITIONED_MODELS:
+        table = model._meta.db_table
+        if not is_partitioned(table):
+            continue
+        for month in iter_months(start or timezone.localdate(), last):
+            if create_partition(table, month):
+                created.append(partition_name(table, month))
+    return created
+
+
+def convert_table(model, months_ahead=None, keep_old=False):
+    """
+    Переводит таблицу модели в секционированную по месяцам поля date (PostgreSQL declarative
+    range partitioning). Модели о секционировании не знают: первичный ключ становится
+    (id, date), уникальность (канал/видео, date) сохраняется, и ON CONFLICT в bulk_upsert
+    работает как раньше.
+
+    В одной транзакции под ACCESS EXCLUSIVE блокировкой: таблица переименовывается в
+    <table>_unpartitioned, на её месте создаётся секционированная с теми же колонками,
+    CHECK-ограничениями, ключами и последовательностью id, создаются секции от первого месяца
+    данных до months_ahead месяцев вперёд и секция по умолчанию, строки копируются.
+    Старая таблица удаляется, если не задан keep_old. Возвращает число перенесённых строк
+    или None, если таблица уже секционирована.
+    """
+    table = model._meta.db_table
+    if is_partitioned(table):
+        return None
+
+    fk = model._meta.get_field(PARTITIONED_MODELS[model])
+    fk_column = fk.column
+    related_table = fk.related_model._meta.db_table
+    old = f'{table}_unpartitioned'
+    sequence = f'{table}_part_id_seq'
+
+    with transaction.atomic(), connection.cursor() as cursor:
+        cursor.execute(f'LOCK TABLE {_qn(table)} IN ACCESS EXCLUSIVE MODE')
+        cursor.execute(f'SELECT MIN("date"), MAX("id") FROM {_qn(table)}')
+        first_date, max_id = cursor.fetchone()
+
+        cursor.execute(f'ALTER TABLE {_qn(table)} RENAME TO {_qn(old)}')
+        cursor.execute(
+            f'CREATE TABLE {_qn(table)} (LIKE {_qn(old)} INCLUDING DEFAULTS INCLUDING CONSTRAINTS) '
+            f'PARTITION BY RANGE ("date")'
+        )
+        # Identity/serial-последовательность принадлежит старой таблице: у новой своя, продолжающая id
+        cursor.execute(f'ALTER TABLE {_qn(table)} ALTER COLUMN "id" DROP DEFAULT')
+        cursor.execute(f'CREATE SEQUENCE {_qn(sequence)} AS bigint OWNED BY {_qn(table)}."id"')
+        cursor.execute(f"ALTER TABLE {_qn(table)} ALTER COLUMN \"id\" SET DEFAULT nextval('{sequence}')")
+        if max_id:
+            cursor.execute('SELECT setval(%s, %s)', [sequence, max_id])
+
+        # Ключ секционирования обязан входить в первичный и уникальные ключи
+        cursor.execute(
+            f'ALTER TABLE {_qn(table)} ADD CONSTRAINT {_qn(f"{table}_part_pkey")} PRIMARY KEY ("id", "date")'
+        )
+        cursor.execute(
+            f'ALTER TABLE {_qn(table)} ADD CONSTRAINT {_qn(f"{table}_{fk_column}_date_part_uniq")} '
+            f'UNIQUE ({_qn(fk_column)}, "date")'
+        )
+        cursor.execute(
+            f'ALTER TABLE {_qn(table)} ADD CONSTRAINT {_qn(f"{table}_{fk_column}_part_fk")} '
+            f'FOREIGN KEY ({_qn(fk_column)}) REFERENCES {_qn(related_table)} ("id") DEFERRABLE INITIALLY DEFERRED'
+        )
+
+        cursor.execute(f'CREATE TABLE {_qn(default_partition_name(table))} PARTITION OF {_qn(table)} DEFAULT')
+        for month in iter_months(first_date or timezone.localdate(), last_partition_month(months_ahead)):
+            lower, upper = _bounds(month)
+            cursor.execute(
+                f'CREATE TABLE {_qn(partition_name(table, month))} PARTITION OF {_qn(table)} '
+                f'FOR VALUES FROM ({lower}) TO ({upper})'
+            )
+
+        cursor.execute(f'INSERT INTO {_qn(table)} SELECT * FROM {_qn(old)}')
+        moved = cursor.rowcount
+        if not keep_old:
+            cursor.execute(f'DROP TABLE {_qn(old)}')
+    return moved
+
+
+def _plan_relations(plan):
+    """Имена всех таблиц, которые читает план EXPLAIN (FORMAT JSON)."""
+    if isinstance(plan, list):
+        for item in plan:
+            yield from _plan_relations(item)
+    elif isinstance(plan, dict):
+        if 'Relation Name' in plan:
+            yield plan['Relation Name']
+        for value in plan.values():
+            if isinstance(value, (list, dict)):
+                yield from _plan_relations(value)
+
+
+def pruning_report(queryset, date_from, date_to):
+    """
+    Проверяет по EXPLAIN, что запрос с фильтром date__range читает только секции,
+    пересекающиеся с [date_from, date_to] (и секцию по умолчанию).
+    Возвращает словарь: число секций, прочитанные секции и pruned — нет ли среди них лишних.
+    """
+    table = queryset.model._meta.db_table
+    partitions = set(list_partitions(table))
+    plan = json.loads(queryset.explain(format='json'))
+    scanned = sorted(set(_plan_relations(plan)) & partitions)
+    allowed = {partition_name(table, month) for month in iter_months(date_from, date_to)}
+    allowed.add(default_partition_name(table))
+    return {
+        'table': table,
+        'partitions': len(partitions),
+        'scanned': scanned,
+        'pruned': bool(scanned) and set(scanned) <= allowed,
+    }
+
+
+def trend_queries(date_from, date_to, channel_id='', video_pk=0):
+    """
+    Запросы с тем же фильтром по диапазону дат, что у channel_trends и video_timeseries;
+    на них проверяется отсечение секций.
+    """
+    return [
+        YoutubeDailyStats.objects.filter(
+            channel__channel_id=channel_id, date__range=[date_from, date_to]
+        ).order_by('date').values_list('date', 'views', 'subscribers_gained', 'subscribers_lost'),
+        YouTubeVideoDailyStats.objects.filter(
+            video_id=video_pk, date__range=[date_from, date_to]
+        ).order_by('date').values_list('date', 'views', 'likes', 'comments'),
+    ]
+
+
+def verify_pruning(date_from, date_to):
+    return [
+        pruning_report(queryset, date_from, date_to)
+        for queryset in trend_queries(date_from, date_to)
+        if is_partitioned(queryset.model._meta.db_table)
+    ]
+
+
+def partition_status():
+    """Состояние таблиц: секционирована ли, число секций и строк в секции по умолчанию."""
+    status = []
+    for model in PARTITIONED_MODELS:
+        table = model._meta.db_table
+        partitioned = is_partitioned(table)
+        default_rows = 0
+        if partitioned:
+            with connection.cursor() as cursor:
+                cursor.execute(f'SELECT COUNT(*) FROM {_qn(default_partition_name(table))}')
+                default_rows = cursor.fetchone()[0]
+        status.append({
+            'table': table,
+            'partitioned': partitioned,
+            'partitions': len(list_partitions(table)) if partitioned else 0,
+            'default_rows': default_rows,
+        })
+    return status
@@ -0,0 +1,157 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.db.models import Sum
+from django.db.models.functions import Coalesce
+
+from .models import YoutubeAudienceDemographics, YoutubeDailyStats, YouTubeVideo, YoutubeStatsRollup
+from .services import read_viewer_activity
+
+DIGEST_TOP_VIDEOS = 10
+DIGEST_TITLE_LENGTH = 60
+# Если в диапазоне больше стольких недель, ряд строится по месяцам
+DIGEST_MAX_WEEKS = 26
+
+
+def estimate_tokens(text):
+    # Токенизатора Gemini локально нет; ~4 символа на токен — стандартная оценка для бюджета
+    return len(text) // 4 + 1
+
+
+def _pct_change(current, previous):
+    if not previous:
+        return None
+    return round((current - previous) * 100 / previous)
+
+
+def _format_number(value):
+    return f'{int(value or 0):,}'.replace(',', ' ')
+
+
+def build_channel_digest(channel, date_from, date_to):
+    """
+    Сводка по каналу за период из сохранённых данных: итоги, динамика, лучший день, ряд
+    по неделям или месяцам из агрегатов, топ видео, аудитория и устройства.
+    Объём сводки не зависит от числа видео и дней: ряды и списки ограничены сверху.
+    """
+    daily = YoutubeDailyStats.objects.filter(channel=channel, date__range=[date_from, date_to])
+    totals = daily.aggregate(
+        views=Coalesce(Sum('views'), 0),
+        minutes=Coalesce(Sum('estimated_minutes_watched'), 0),
+        gained=Coalesce(Sum('subscribers_gained'), 0),
+        lost=Coalesce(Sum('subscribers_lost'), 0),
+    )
+    days = (date_to - date_from).days + 1
+
+    week_start = date_to - timedelta(days=6)
+    last_week = daily.filter(date__gte=week_start).aggregate(views=Coalesce(Sum('views'), 0))['views']
+    previous_week = YoutubeDailyStats.objects.filter(
+        channel=channel, date__range=[week_start - timedelta(days=7), week_start - timedelta(days=1)]
+    ).aggregate(views=Coalesce(Sum('views'), 0))['views']
+
+    best_day = daily.order_by('-views').values_list('date', 'views').first()
+
+    granularity = (
+        YoutubeStatsRollup.Granularity.WEEK if days <= DIGEST_MAX_WEEKS * 7 else YoutubeStatsRollup.Granularity.MONTH
+    )
+    series = list(
+        YoutubeStatsRollup.objects.filter(
+            channel=channel, granularity=granularity, period_start__range=[date_from, date_to]
+        ).order_by('period_start').values_list('period_start', 'views')
+    )
+
+    top_videos = list(
+        YouTubeVideo.objects.filter(channel=channel)
+        .order_by('-views')
+        .values_list('title', 'views', 'likes', 'comments')[:DIGEST_TOP_VIDEOS]
+    )
+
+    demographics = list(
+        YoutubeAudienceDemographics.objects.filter(channel=channel, viewer_percentage__gt=0)
+        .order_by('-viewer_percentage')
+        .values_list('age_group', 'gender', 'viewer_percentage')
+    )
+
+    return {
+        'channel': channel.title,
+        'date_from': date_from,
+        'date_to': date_to,
+        'days': days,
+        'totals': totals,
+        'last_week_views': last_week,
+        'previous_week_views': previous_week,
+        'best_day': best_day,
+        'granularity': granularity,
+        'series': series,
+        'top_videos': top_videos,
+        'demographics': demographics,
+        'activity': read_viewer_activity(channel, date_from, date_to),
+    }
+
+
+def _share(rows):
+    total = sum(value for _, value in rows) or 1
+    return [f'{name} {value * 100 // total}%' for name, value in rows]
+
+
+def render_digest(digest, token_budget=None):
+    """
+    Превращает сводку в компактный текст не длиннее token_budget токенов (по оценке).
+    Обязательные строки сохраняются всегда; из списков при нехватке бюджета по очереди
+    отбрасываются последние элементы, начиная с наименее важного раздела.
+    """
+    token_budget = token_budget or settings.GEMINI_PROMPT_TOKEN_BUDGET
+    totals = digest['totals']
+    views, days = totals['views'], digest['days']
+
+    header = [
+        f"Канал: {digest['channel']}",
+        f"Период: {digest['date_from']} — {digest['date_to']} ({days} дн.)",
+        f"Итого: просмотры {_format_number(views)}; минуты просмотра {_format_number(totals['minutes'])}; "
+        f"подписчики +{totals['gained']}/−{totals['lost']} (нетто {totals['gained'] - totals['lost']:+d})",
+        f"В среднем за день: просмотры {_format_number(views / days)}",
+    ]
+    change = _pct_change(digest['last_week_views'], digest['previous_week_views'])
+    if change is not None:
+        header.append(f"Последние 7 дн. к предыдущим 7 дн.: просмотры {change:+d}%")
+    if digest['best_day']:
+        best_date, best_views = digest['best_day']
+        header.append(f"Лучший день: {best_date} ({_format_number(best_views)} просмотров)")
+
+    label = 'неделям' if digest['granularity'] == YoutubeStatsRollup.Granularity.WEEK else 'месяцам'
+    # Разделы в порядке убывания важности
+    sections = [
+        ('Топ видео (просмотры/лайки/комментарии)', [
+            f"«{title[:DIGEST_TITLE_LENGTH]}» {_format_number(v)}/{_format_number(l)}/{_format_number(c)}"
+            for title, v, l, c in digest['top_videos']
+        ]),
+        (f'Просмотры по {label}', [f'{start}: {v}' for start, v in digest['series']]),
+        ('Аудитория', [f'{age} {gender} {pct:.0f}%' for age, gender, pct in digest['demographics']]),
+        ('Устройства', _share(digest['activity'].get('device_type', []))),
+        ('Подписка', _share(digest['activity'].get('subscribed_status', []))),
+    ]
+
+    def render():
+        lines = list(header)
+        for title, items in sections:
+            if items:
+                lines.append(f"{title}: {'; '.join(items)}")
+        return '\n'.join(lines)
+
+    text = render()
+    while estimate_tokens(text) > token_budget:
+        trimmable = [items for _, items in reversed(sections) if items]
+        if not trimmable:
+            break
+        trimmable[0].pop()
+        text = render()
+    return text
+
+
+def build_chat_prompt(question, digest_text):
+    return (
+        "Ты аналитик YouTube. Ниже сводка по каналу, посчитанная по сохранённой статистике.\n"
+        f"{digest_text}\n\n"
+        f"Вопрос пользователя: \"{question}\"\n"
+        "Дай рекомендации, выводы и короткий анализ, опираясь только на сводку."
+    )
@@ -0,0 +1,285 @@
+import heapq
+import itertools
+import json
+import logging
+import random
+import threading
+import time
+from datetime import datetime
+from enum import IntEnum
+from zoneinfo import ZoneInfo
+
+from django.conf import settings
+from django.core.cache import cache
+from googleapiclient.errors import HttpError
+from httplib2 import HttpLib2Error
+
+from social_analytics.metrics import OutboundCall
+from social_analytics.transport import RETRY_STATUSES
+
+from .singleflight import cache_lock
+
+logger = logging.getLogger(__name__)
+
+# Стоимость методов YouTube Data API в единицах квоты
+# https://developers.google.com/youtube/v3/determine_quota_cost
+QUOTA_COSTS = {
+    'channels.list': 1,
+    'playlistItems.list': 1,
+    'playlists.list': 1,
+    'videos.list': 1,
+    'search.list': 100,
+    # YouTube Analytics API считает квоту отдельно от Data API и в единицах не тарифицируется
+    'reports.query': 0,
+}
+
+DEFAULT_QUOTA_COST = 1
+
+# Дневная квота Data API сбрасывается в полночь по тихоокеанскому времени
+QUOTA_TIMEZONE = ZoneInfo('America/Los_Angeles')
+
+# Причины 403, после которых повтор бесполезен до сброса квоты, и причины, после которых стоит подождать
+DAILY_QUOTA_REASONS = {'quotaExceeded', 'dailyLimitExceeded'}
+RATE_LIMIT_REASONS = {'rateLimitExceeded', 'userRateLimitExceeded'}
+
+
+class Priority(IntEnum):
+    INTERACTIVE = 0
+    BACKGROUND = 1
+
+
+class QuotaExceededError(Exception):
+    pass
+
+
+class ApiUsage:
+    """
+    Счётчик вызовов API и потраченной квоты за одну синхронизацию.
+    Заодно несёт пользователя и приоритет, с которыми планировщик выполняет её запросы.
+    """
+
+    def __init__(self, user_id=None, priority=Priority.BACKGROUND):
+        self.user_id = user_id
+        self.priority = priority
+        self.calls = {}
+        self.quota_units = 0
+        self._lock = threading.Lock()
+
+    def record(self, method, count=1):
+        with self._lock:
+            self.calls[method] = self.calls.get(method, 0) + count
+            self.quota_units += QUOTA_COSTS.get(method, DEFAULT_QUOTA_COST) * count
+
+    @property
+    def total_calls(self):
+        return sum(self.calls.values())
+
+    def as_dict(self):
+        return {
+            'api_calls': self.total_calls,
+            'quota_units': self.quota_units,
+            'calls_by_method': dict(self.calls),
+        }
+
+    def __str__(self):
+        return f"{self.total_calls} API calls, {self.quota_units} quota units"
+
+
+def quota_day(now=None):
+    return (now or datetime.now(QUOTA_TIMEZONE)).astimezone(QUOTA_TIMEZONE).date()
+
+
+def _usage_key(day, user_id=None):
+    suffix = f':user:{user_id}' if user_id is not None else ''
+    return f'youtube:quota:{day.isoformat()}{suffix}'
+
+
+def _incr(key, delta):
+    # Счётчики живут чуть дольше суток, чтобы пережить сброс квоты в любой таймзоне
+    cache.add(key, 0, timeout=2 * 24 * 3600)
+    try:
+        return cache.incr(key, delta)
+    except ValueError:
+        # Ключ вытеснили между add и incr
+        cache.set(key, delta, timeout=2 * 24 * 3600)
+        return delta
+
+
+def _error_reason(error):
+    details = getattr(error, 'error_details', None)
+    if isinstance(details, list):
+        for detail in details:
+            if isinstance(detail, dict) and detail.get('reason'):
+                return detail['reason']
+    try:
+        return json.loads(error.content)['error']['errors'][0]['reason']
+    except (KeyError, IndexError, TypeError, ValueError):
+        return None
+
+
+class TokenBucket:
+    """
+    Token bucket в общем кэше, так что лимит действует на все процессы и воркеры.
+    Состояние (токены, время пополнения) меняется только под короткой блокировкой cache_lock:
+    без неё параллельные воркеры перезаписали бы друг друга и выбрали бы больше токенов, чем есть.
+    """
+
+    # Через сколько секунд пробовать снова, если блокировку за отведённое время не получили
+    LOCK_RETRY_DELAY = 0.05
+
+    def __init__(self, key, rate, burst):
+        self.key = f'youtube:bucket:{key}'
+        self.rate = rate
+        self.burst = burst
+
+    def take(self):
+        """Забирает токен и возвращает 0 либо возвращает, сколько секунд ждать следующего."""
+        with cache_lock(self.key, timeout=5, wait=5, poll_interval=0.01) as acquired:
+            if not acquired:
+                # Блокировку держит другой воркер: токена нет, вызывающий подождёт и повторит
+                logger.warning(f"Token bucket {self.key} is locked, retrying")
+                return self.LOCK_RETRY_DELAY
+            now = time.time()
+            tokens, updated_at = cache.get(self.key, (self.burst, now))
+            tokens = min(self.burst, tokens + (now - updated_at) * self.rate)
+            if tokens >= 1:
+                cache.set(self.key, (tokens - 1, now), timeout=3600)
+                return 0
+            cache.set(self.key, (tokens, now), timeout=3600)
+            return (1 - tokens) / self.rate
+
+
+class QuotaScheduler:
+    """
+    Единая точка выполнения запросов к Google API.
+
+    Перед запросом проверяет дневной бюджет единиц квоты (фоновые запросы не трогают
+    резерв для интерактивных), затем ждёт токены в bucket пользователя и проекта.
+    За токеном проекта запросы процесса выстраиваются в очередь по приоритету, так что
+    интерактивные запросы обгоняют фоновую синхронизацию. На 429 и 403 rateLimitExceeded
+    запрос повторяется с экспоненциальной задержкой, на 403 quotaExceeded бюджет дня
+    помечается исчерпанным, и следующие запросы сразу получают QuotaExceededError.
+    """
+
+    def __init__(self, sleep=time.sleep):
+        self._sleep = sleep
+        self._cond = threading.Condition()
+        self._waiters = []
+        self._sequence = itertools.count()
+
+    @property
+    def daily_budget(self):
+        return settings.YOUTUBE_QUOTA_DAILY_BUDGET
+
+    def used(self, user_id=None):
+        return cache.get(_usage_key(quota_day(), user_id), 0)
+
+    def remaining(self, priority=Priority.BACKGROUND):
+        reserve = settings.YOUTUBE_QUOTA_INTERACTIVE_RESERVE if priority == Priority.BACKGROUND else 0
+        return max(0, self.daily_budget - reserve - self.used())
+
+    def usage(self, user_id=None):
+        used = self.used()
+        data = {
+            'quota_day': quota_day().isoformat(),
+            'daily_budget': self.daily_budget,
+            'used': used,
+            'remaining': max(0, self.daily_budget - used),
+        }
+        if user_id is not None:
+            data['used_by_user'] = self.used(user_id)
+        return data
+
+    def _charge(self, cost, user_id):
+        if not cost:
+            return
+        day = quota_day()
+        _incr(_usage_key(day), cost)
+        if user_id is not None:
+            _incr(_usage_key(day, user_id), cost)
+
+    def _mark_exhausted(self):
+        key = _usage_key(quota_day())
+        cache.set(key, max(self.daily_budget, cache.get(key, 0)), timeout=2 * 24 * 3600)
+
+    def _wait_for_token(self, bucket):
+        while True:
+            wait = bucket.take()
+            if not wait:
+                return
+            self._sleep(wait)
+
+    def _wait_for_project_token(self, priority):
+        rate, burst = settings.YOUTUBE_RATE_LIMIT_PROJECT
+        bucket = TokenBucket('project', rate, burst)
+        ticket = (priority, next(self._sequence))
+        with self._cond:
+            heapq.heappush(self._waiters, ticket)
+            try:
+                while True:
+                    # Токен проекта берёт только голова очереди: ожидающий интерактивный
+                    # запрос всегда получит его раньше фоновых
+                    if self._waiters[0] != ticket:
+                        self._cond.wait()
+                        continue
+                    wait = bucket.take()
+                    if not wait:
+                        return
+                    self._cond.wait(timeout=wait)
+            finally:
+                self._waiters.remove(ticket)
+                heapq.heapify(self._waiters)
+                self._cond.notify_all()
+
+    def _acquire(self, method, usage):
+        cost = QUOTA_COSTS.get(method, DEFAULT_QUOTA_COST)
+        if cost and self.remaining(usage.priority) < cost:
+            raise QuotaExceededError(
+                f"YouTube API daily quota exhausted ({self.used()}/{self.daily_budget} units used)"
+            )
+
+        if usage.user_id is not None:
+            rate, burst = settings.YOUTUBE_RATE_LIMIT_USER
+            # Ожидание лимита пользователя идёт вне очереди, чтобы не задерживать других пользователей
+            self._wait_for_token(TokenBucket(f'user:{usage.user_id}', rate, burst))
+        self._wait_for_project_token(usage.priority)
+
+        self._charge(cost, usage.user_id)
+        usage.record(method)
+
+    def _backoff(self, attempt, method, cause):
+        delay = min(settings.YOUTUBE_API_BACKOFF_MAX, settings.YOUTUBE_API_BACKOFF_BASE * 2 ** attempt)
+        delay *= random.uniform(0.5, 1)
+        logger.warning(f"{method} failed ({cause}), retrying in {delay:.1f}s")
+        self._sleep(delay)
+
+    def execute(self, request, method, usage):
+        """
+        Выполняет подготовленный запрос googleapiclient (request.execute()) с учётом квоты.
+        Повторяет ответы 429, 403 rateLimitExceeded и 5xx, а также обрывы соединения и таймауты.
+        """
+        for attempt in itertools.count():
+            self._acquire(method, usage)
+            try:
+                with OutboundCall('youtube', method):
+                    return request.execute()
+            except HttpError as e:
+                status, reason = e.resp.status, _error_reason(e)
+                if status == 403 and reason in DAILY_QUOTA_REASONS:
+                    self._mark_exhausted()
+                    raise QuotaExceededError(f"YouTube API daily quota exceeded: {e}") from e
+                retryable = (
+                    status == 429
+                    or status in RETRY_STATUSES
+                    or (status == 403 and reason in RATE_LIMIT_REASONS)
+                )
+                if not retryable or attempt >= settings.YOUTUBE_API_MAX_RETRIES:
+                    raise
+                self._backoff(attempt, method, f'{status} {reason}')
+            except (OSError, HttpLib2Error) as e:
+                if attempt >= settings.HTTP_MAX_RETRIES:
+                    raise
+                self._backoff(attempt, method, e)
+
+
+scheduler = QuotaScheduler()
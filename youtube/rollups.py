@@ -0,0 +1,80 @@
+from datetime import timedelta
+
+from django.db.models import Count, Sum
+from django.db.models.functions import TruncMonth, TruncWeek
+
+from .bulk import bulk_upsert
+from .models import YoutubeDailyStats, YoutubeStatsRollup
+
+ROLLUP_METRICS = [
+    'subscribers_gained',
+    'subscribers_lost',
+    'views',
+    'estimated_minutes_watched',
+    'likes',
+    'comments',
+]
+
+ROLLUP_TRUNC = {
+    YoutubeStatsRollup.Granularity.WEEK: TruncWeek,
+    YoutubeStatsRollup.Granularity.MONTH: TruncMonth,
+}
+
+
+def period_start(granularity, day):
+    if granularity == YoutubeStatsRollup.Granularity.WEEK:
+        return day - timedelta(days=day.weekday())
+    return day.replace(day=1)
+
+
+def period_end(granularity, start):
+    """Первый день следующего периода."""
+    if granularity == YoutubeStatsRollup.Granularity.WEEK:
+        return start + timedelta(days=7)
+    return (start + timedelta(days=32)).replace(day=1)
+
+
+def refresh_rollups(channel, dates):
+    """
+    Пересчитывает недельные и месячные агрегаты для периодов, в которые попадают dates.
+    Каждый период считается заново из дневных строк одним GROUP BY-запросом на гранулярность,
+    поэтому пересмотр старых дней (YouTube дописывает данные задним числом) учитывается корректно.
+    """
+    dates = set(dates)
+    if not dates:
+        return 0
+
+    written = 0
+    for granularity, trunc in ROLLUP_TRUNC.items():
+        starts = {period_start(granularity, day) for day in dates}
+        aggregates = (
+            YoutubeDailyStats.objects
+            .filter(channel=channel, date__gte=min(starts), date__lt=period_end(granularity, max(starts)))
+            .annotate(period=trunc('date'))
+            .values('period')
+            .annotate(days=Count('id'), **{metric: Sum(metric) for metric in ROLLUP_METRICS})
+            .order_by('period')
+        )
+        written += bulk_upsert(
+            YoutubeStatsRollup,
+            (
+                YoutubeStatsRollup(
+                    channel=channel,
+                    granularity=granularity,
+                    period_start=row['period'],
+                    days=row['days'],
+                    **{metric: row[metric] or 0 for metric in ROLLUP_METRICS}
+                )
+                for row in aggregates
+                if row['period'] in starts
+            ),
+            unique_fields=['channel', 'granularity', 'period_start'],
+            update_fields=['days', *ROLLUP_METRICS],
+        )
+    return written
+
+
+def rebuild_rollups(channel):
+    """Полный пересчёт агрегатов канала из дневной статистики."""
+    dates = YoutubeDailyStats.objects.filter(channel=channel).values_list('date', flat=True)
+    return refresh_rollups(channel, dates)
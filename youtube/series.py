@@ -0,0 +1,230 @@
+from datetime import date
+
+import numpy as np
+from django.conf import settings
+from django.db import transaction
+
+from .bulk import DEFAULT_BATCH_SIZE
+from .models import YouTubeVideoDailyStats, YouTubeVideoSeries
+
+# Ряд видео за год (хранилище 'packed'): массив int32 little-endian формы (дней, len(COUNTERS)),
+# строка i — снимок дня года first_day + i. Массив начинается первым и заканчивается последним
+# записанным днём, дни без снимка внутри заполнены MISSING. Одна строка таблицы вместо 365 строк
+# с заголовками кортежей и записями индекса (video, date); большой массив Postgres хранит в TOAST
+COUNTERS = ('views', 'likes', 'comments')
+DTYPE = np.dtype('<i4')
+MISSING = -1
+
+_EMPTY = np.empty((0, len(COUNTERS)), dtype=DTYPE)
+
+
+def packed_storage():
+    return settings.YOUTUBE_VIDEO_SERIES_STORAGE == 'packed'
+
+
+def decode(data):
+    """Массив ряда поверх буфера, прочитанного из базы, без копирования (только для чтения)."""
+    return np.frombuffer(data, dtype=DTYPE).reshape(-1, len(COUNTERS))
+
+
+def encode(block):
+    return np.ascontiguousarray(block, dtype=DTYPE).tobytes()
+
+
+def day_index(day):
+    return day.toordinal() - date(day.year, 1, 1).toordinal()
+
+
+def build_series(video_pk, snapshots):
+    """Ряды видео по годам из снимков (день, views, likes, comments) в любом порядке."""
+    by_year = {}
+    for day, *values in snapshots:
+        by_year.setdefault(day.year, []).append((day_index(day), values))
+
+    series = []
+    for year, items in sorted(by_year.items()):
+        indexes = np.array([index for index, _ in items], dtype=np.intp)
+        first_day = int(indexes.min())
+        block = np.full((indexes.max() - first_day + 1, len(COUNTERS)), MISSING, dtype=DTYPE)
+        block[indexes - first_day] = [values for _, values in items]
+        series.append(YouTubeVideoSeries(video_id=video_pk, year=year, first_day=first_day, data=encode(block)))
+    return series
+
+
+def _write_day(first_day, block, day, values, writable):
+    """Ряд (first_day, block) с записанным снимком дня; массив растёт до дня, пропуски остаются MISSING."""
+    index = day_index(day)
+    if not len(block):
+        first_day = index
+    start, stop = min(first_day, index), max(first_day + len(block), index + 1)
+    if (start, stop) != (first_day, first_day + len(block)):
+        # Дописывание в конец (или, при загрузке истории, в начало)
+        grown = np.full((stop - start, len(COUNTERS)), MISSING, dtype=DTYPE)
+        grown[first_day - start:first_day - start + len(block)] = block
+        first_day, block = start, grown
+    elif not writable:
+        block = block.copy()
+    block[index - first_day] = values
+    return first_day, block
+
+
+def append_snapshots(snapshots):
+    """
+    Записывает снимки (pk видео, день, views, likes, comments) в ряды их лет. На всю пачку уходит
+    один SELECT ... FOR UPDATE затронутых рядов и один INSERT ... ON CONFLICT изменившихся:
+    новый день дописывается в конец массива, повтор за тот же день перезаписывает свою строку.
+    Возвращает число записанных рядов.
+    """
+    snapshots = list(snapshots)
+    if not snapshots:
+        return 0
+
+    with transaction.atomic():
+        stored = {
+            (video_pk, year): (first_day, decode(data))
+            for video_pk, year, first_day, data in YouTubeVideoSeries.objects.select_for_update().filter(
+                video_id__in={snapshot[0] for snapshot in snapshots},
+                year__in={snapshot[1].year for snapshot in snapshots},
+            ).values_list('video_id', 'year', 'first_day', 'data')
+        }
+        series = {}
+        for video_pk, day, *values in snapshots:
+            key = (video_pk, day.year)
+            if key in series:
+                series[key] = _write_day(*series[key], day, values, writable=True)
+            else:
+                series[key] = _write_day(*stored.get(key, (0, _EMPTY)), day, values, writable=False)
+
+        changed = [
+            YouTubeVideoSeries(video_id=video_pk, year=year, first_day=first_day, data=encode(block))
+            for (video_pk, year), (first_day, block) in series.items()
+            if (video_pk, year) not in stored
+            or stored[(video_pk, year)][0] != first_day
+            or not np.array_equal(block, stored[(video_pk, year)][1])
+        ]
+        if changed:
+            YouTubeVideoSeries.objects.bulk_create(
+                changed,
+                update_conflicts=True,
+                unique_fields=['video', 'year'],
+                update_fields=['first_day', 'data'],
+                batch_size=DEFAULT_BATCH_SIZE,
+            )
+    return len(changed)
+
+
+def _gather(series):
+    """Дни со снимками (datetime64[D]) и их значения из рядов (year, first_day, data) одного видео по году."""
+    days, values = [], []
+    for year, first_day, data in series:
+        block = decode(data)
+        present = np.flatnonzero(block[:, 0] != MISSING)
+        days.append(np.datetime64(f'{year:04d}-01-01') + first_day + present)
+        # Ряд без пропусков идёт дальше как есть, без копирования
+        values.append(block if len(present) == len(block) else block[present])
+    if not days:
+        return np.empty(0, dtype='datetime64[D]'), _EMPTY
+    if len(days) == 1:
+        return days[0], values[0]
+    return np.concatenate(days), np.concatenate(values)
+
+
+def window(series, date_from=None, date_to=None):
+    """
+    Снимки рядов одного видео за [date_from, date_to]: словарь списков dates (ISO), счётчиков
+    и приростов *_delta в том же виде, что у строк YouTubeVideoDailyStats. Прирост считается
+    от предыдущего снимка в series, у самого первого снимка он пустой.
+    """
+    days, values = _gather(series)
+    start = 0 if date_from is None else int(np.searchsorted(days, np.datetime64(date_from), side='left'))
+    stop = len(days) if date_to is None else int(np.searchsorted(days, np.datetime64(date_to), side='right'))
+
+    result = {'dates': np.datetime_as_string(days[start:stop]).tolist()}
+    current = values[start:stop]
+    deltas = np.diff(values[max(start - 1, 0):stop], axis=0)
+    for i, name in enumerate(COUNTERS):
+        result[name] = current[:, i].tolist()
+    for i, name in enumerate(COUNTERS):
+        column = deltas[:, i].tolist()
+        if start == 0 and stop > 0:
+            column.insert(0, None)
+        result[f'{name}_delta'] = column
+    return result
+
+
+def read_packed(video_pk, date_from, date_to):
+    """
+    Ряд видео за период из хранилища 'packed' одним запросом. Читается и предыдущий год:
+    прирост первого дня периода считается от последнего снимка до него.
+    """
+    series = YouTubeVideoSeries.objects.filter(
+        video_id=video_pk, year__range=(date_from.year - 1, date_to.year)
+    ).order_by('year').values_list('year', 'first_day', 'data')
+    return window(series, date_from, date_to)
+
+
+def read_rows(video_pk, date_from, date_to):
+    """Ряд видео за период из строк YouTubeVideoDailyStats, в том же виде, что read_packed."""
+    snapshots = YouTubeVideoDailyStats.objects.filter(
+        video_id=video_pk,
+        date__range=[date_from, date_to]
+    ).order_by('date').values_list(
+        'date', *COUNTERS, *(f'{name}_delta' for name in COUNTERS)
+    )
+
+    result = {'dates': []}
+    result.update((name, []) for name in COUNTERS)
+    result.update((f'{name}_delta', []) for name in COUNTERS)
+    for row in snapshots:
+        for key, value in zip(result, row):
+            result[key].append(value.isoformat() if key == 'dates' else value)
+    return result
+
+
+def read_video_series(video_pk, date_from, date_to):
+    """Ряд видео за период из хранилища, выбранного YOUTUBE_VIDEO_SERIES_STORAGE."""
+    if packed_storage():
+        return read_packed(video_pk, date_from, date_to)
+    return read_rows(video_pk, date_from, date_to)
+
+
+def pack_rows(video_pks=None, delete_rows=False, chunk_size=10000):
+    """
+    Переносит снимки из YouTubeVideoDailyStats в ряды (для перехода на хранилище 'packed';
+    ряды перенесённых видео и лет перезаписываются). Строки читаются по видео итератором,
+    ряды пишутся пачками. С delete_rows перенесённые строки удаляются.
+    Возвращает число видео и записанных рядов.
+    """
+    rows = YouTubeVideoDailyStats.objects.order_by('video', 'date')
+    if video_pks is not None:
+        rows = rows.filter(video_id__in=video_pks)
+
+    videos, written, pending = 0, 0, []
+    current, snapshots = None, []
+
+    def flush():
+        nonlocal written
+        YouTubeVideoSeries.objects.bulk_create(
+            pending, update_conflicts=True, unique_fields=['video', 'year'], update_fields=['first_day', 'data'],
+        )
+        written += len(pending)
+        pending.clear()
+
+    with transaction.atomic():
+        for video_pk, *snapshot in rows.values_list('video_id', 'date', *COUNTERS).iterator(chunk_size=chunk_size):
+            if video_pk != current:
+                if snapshots:
+                    pending.extend(build_series(current, snapshots))
+                    videos += 1
+                current, snapshots = video_pk, []
+                if len(pending) >= DEFAULT_BATCH_SIZE:
+                    flush()
+            snapshots.append(snapshot)
+        if snapshots:
+            pending.extend(build_series(current, snapshots))
+            videos += 1
+        if pending:
+            flush()
+        if delete_rows:
+            rows.delete()
+    return videos, written
@@ -1,211 +1,665 @@
 import logging
+import math
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from datetime import date, timedelta
 from django.conf import settings
-from googleapiclient.discovery import build
 from googleapiclient.errors import HttpError
-from google.oauth2.credentials import Credentials
-import requests
 from django.core.exceptions import ObjectDoesNotExist
-from google.auth.transport import requests as google_requests
+from django.db import connections, transaction
+from django.db.models import OuterRef, Q, Subquery
+from django.utils import timezone
+from django.utils.dateparse import parse_date
 
-from .models import YouTubeChannel, YoutubeDailyStats, YouTubeVideo, YoutubeAudienceDemographics
+from .models import (
+    YouTubeChannel,
+    YoutubeDailyStats,
+    YouTubeVideo,
+    YouTubeVideoDailyStats,
+    YoutubeAudienceDemographics,
+    YoutubeViewerActivity,
+)
+from .bulk import bulk_replace, bulk_upsert
+from .caching import bump_data_version
+from .clients import get_service
+from .quota import ApiUsage, Priority, QuotaExceededError, scheduler
+from .rollups import refresh_rollups
+from .series import COUNTERS, append_snapshots, packed_storage
+from .singleflight import SingleFlight, cache_lock
 
 logger = logging.getLogger(__name__)
 
 def get_youtube_service(creds_obj):
-    creds_info = {
-        'token': creds_obj.access_token,
-        'refresh_token': creds_obj.refresh_token,
-        'token_uri': creds_obj.token_uri,
-        'client_id': creds_obj.client_id,
-        'client_secret': creds_obj.client_secret,
-        'scopes': creds_obj.scopes.split(' '),
-        'universe_domain': 'googleapis.com'
-    }
-    creds = Credentials.from_authorized_user_info(info=creds_info)
-    
-    if not creds.valid:
-        creds.refresh(google_requests.Request())
-
-    return build('youtube', 'v3', credentials=creds)
+    return get_service('youtube', 'v3', creds_obj)
 
 
 def get_youtube_analytics_service(creds_obj):
-    creds_info = {
-        'token': creds_obj.access_token,
-        'refresh_token': creds_obj.refresh_token,
-        'token_uri': creds_obj.token_uri,
-        'client_id': creds_obj.client_id,
-        'client_secret': creds_obj.client_secret,
-        'scopes': creds_obj.scopes.split(' '),
-        'universe_domain': 'googleapis.com'
-    }
-    creds = Credentials.from_authorized_user_info(info=creds_info)
-    
-    if not creds.valid:
-        creds.refresh(google_requests.Request())
+    return get_service('youtubeAnalytics', 'v2', creds_obj)
 
-    return build('youtubeAnalytics', 'v2', credentials=creds)
 
+class ChannelLinkError(Exception):
+    pass
 
-def fetch_own_channel_id(creds_obj):
-    try:
-        youtube = get_youtube_service(creds_obj)
-        response = youtube.channels().list(
-            part='id',
-            mine=True
-        ).execute()
-        
-        if 'items' in response and len(response['items']) > 0:
-            return response['items'][0]['id']
-        else:
-            logger.error("No channels found for the authenticated user.")
-            return None
-    except HttpError as e:
-        logger.error(f"HTTP Error fetching own channel ID: {e}")
-        return None
-    except Exception as e:
-        logger.error(f"Error fetching own channel ID: {e}")
+
+def fetch_channel_identity(creds_obj, priority=Priority.INTERACTIVE):
+    """
+    Канал, на который выдан токен: channels.list(mine=True). Возвращает словарь с channel_id,
+    title, description и uploads_playlist_id или None, если у аккаунта нет канала.
+    """
+    youtube = get_youtube_service(creds_obj)
+    response = scheduler.execute(
+        youtube.channels().list(part='id,snippet,contentDetails', mine=True),
+        'channels.list',
+        ApiUsage(user_id=creds_obj.user_id, priority=priority)
+    )
+
+    items = response.get('items', [])
+    if not items:
         return None
+    item = items[0]
+    snippet = item.get('snippet', {})
+    return {
+        'channel_id': item['id'],
+        'title': snippet.get('title') or item['id'],
+        'description': snippet.get('description', ''),
+        'uploads_playlist_id': item.get('contentDetails', {}).get('relatedPlaylists', {}).get('uploads', ''),
+    }
 
 
-def fetch_and_save_analytics_data(creds_obj, channel_id):
+def link_channel(user, creds_obj, identity):
+    """
+    Привязывает канал к пользователю с токеном creds_obj (после OAuth). Повторная привязка
+    того же канала заменяет его токен; старый токен удаляется, если им больше не пользуется
+    ни один канал. Канал другого пользователя не перепривязывается: ChannelLinkError.
+    Возвращает (канал, создан ли).
+    """
+    with transaction.atomic():
+        channel = YouTubeChannel.objects.select_for_update().filter(channel_id=identity['channel_id']).first()
+        if channel and channel.user_id != user.pk:
+            raise ChannelLinkError('This YouTube channel is already linked to another account.')
+
+        created = channel is None
+        if created:
+            channel = YouTubeChannel(user=user, channel_id=identity['channel_id'])
+        previous = channel.credentials
+
+        channel.title = identity['title']
+        channel.description = identity['description']
+        channel.uploads_playlist_id = identity['uploads_playlist_id']
+        channel.credentials = creds_obj
+        channel.identity_checked_at = timezone.now()
+        channel.save()
+
+        if previous and previous.pk != creds_obj.pk:
+            # Google отдаёт refresh_token не при каждом согласии: сохраняем прежний
+            if not creds_obj.refresh_token and previous.refresh_token:
+                creds_obj.refresh_token = previous.refresh_token
+                creds_obj.save(update_fields=['refresh_token'])
+            if not previous.channels.exists():
+                previous.delete()
+
+    return channel, created
+
+
+def revalidate_channel_identity(channel):
+    """
+    Фоновая проверка, что токен канала по-прежнему выдан на этот канал. Название, описание
+    и плейлист загрузок обновляются; если токен теперь указывает на другой канал или канала
+    нет, синхронизация канала помечается ошибкой. Возвращает True, если канал подтверждён.
+    Ошибки Google API пробрасываются, и канал проверяется при следующем запуске.
+    """
+    creds_obj = channel.get_credentials()
+    identity = fetch_channel_identity(creds_obj, priority=Priority.BACKGROUND) if creds_obj else None
+    now = timezone.now()
+
+    if not identity or identity['channel_id'] != channel.channel_id:
+        logger.warning(f"Channel {channel.channel_id} is no longer accessible with its linked Google account")
+        YouTubeChannel.objects.filter(pk=channel.pk).update(
+            sync_status=YouTubeChannel.SyncStatus.FAILED,
+            sync_error='Channel access was revoked, link the channel again.',
+            identity_checked_at=now,
+        )
+        return False
+
+    YouTubeChannel.objects.filter(pk=channel.pk).update(
+        title=identity['title'],
+        description=identity['description'],
+        uploads_playlist_id=identity['uploads_playlist_id'],
+        identity_checked_at=now,
+    )
+    return True
+
+
+def save_daily_stats(channel, rows):
+    stats = [
+        YoutubeDailyStats(
+            channel=channel,
+            date=report_date,
+            views=views,
+            subscribers_gained=subs_gained,
+            subscribers_lost=subs_lost
+        )
+        for report_date, views, subs_gained, subs_lost in rows
+    ]
+    with transaction.atomic():
+        written = bulk_upsert(
+            YoutubeDailyStats,
+            stats,
+            unique_fields=['channel', 'date'],
+            update_fields=['views', 'subscribers_gained', 'subscribers_lost'],
+        )
+        if written:
+            # bulk_upsert уже привёл даты из API к date
+            refresh_rollups(channel, [stat.date for stat in stats])
+    if written:
+        transaction.on_commit(lambda: bump_data_version(channel.pk))
+    return written
+
+
+def save_demographics(channel, rows):
+    written = bulk_replace(
+        YoutubeAudienceDemographics,
+        YoutubeAudienceDemographics.objects.filter(channel=channel),
+        (
+            YoutubeAudienceDemographics(
+                channel=channel,
+                age_group=age_group,
+                gender=gender,
+                viewer_percentage=viewer_percentage
+            )
+            for age_group, gender, viewer_percentage in rows
+        ),
+        unique_fields=['channel', 'age_group', 'gender'],
+        update_fields=['viewer_percentage'],
+    )
+    if written:
+        transaction.on_commit(lambda: bump_data_version(channel.pk))
+    return written
+
+
+_report_executor = None
+_report_executor_pid = None
+_report_executor_lock = threading.Lock()
+
+
+def _get_report_executor():
+    # Пул создаётся лениво и пересоздаётся после fork (prefork-воркеры Celery, gunicorn)
+    global _report_executor, _report_executor_pid
+    with _report_executor_lock:
+        if _report_executor is None or _report_executor_pid != os.getpid():
+            _report_executor = ThreadPoolExecutor(
+                max_workers=settings.YOUTUBE_ANALYTICS_MAX_WORKERS,
+                thread_name_prefix='youtube-analytics',
+            )
+            _report_executor_pid = os.getpid()
+        return _report_executor
+
+
+def _execute_report(creds_obj, query, usage):
     try:
-        youtube_analytics = get_youtube_analytics_service(creds_obj)
+        return scheduler.execute(
+            get_youtube_analytics_service(creds_obj).reports().query(**query), 'reports.query', usage
+        )
+    finally:
+        # Потоки пула не должны держать соединения с базой
+        connections.close_all()
 
-        start_date = (date.today() - timedelta(days=30)).isoformat()
-        end_date = date.today().isoformat()
 
-        response = youtube_analytics.reports().query(
-            startDate=start_date,
-            endDate=end_date,
-            metrics='views,subscribersGained,subscribersLost',
-            dimensions='day',
-            ids=f'channel=={channel_id}'
-        ).execute()
+def execute_reports(creds_obj, queries, usage=None):
+    """
+    Выполняет независимые запросы reports().query параллельно в ограниченном пуле потоков.
+    queries: {имя: параметры запроса}. Возвращает {имя: ответ или исключение},
+    так что ошибка одного запроса не мешает остальным.
+    """
+    usage = usage or ApiUsage(user_id=creds_obj.user_id)
+    # Токен обновляем в текущем потоке, чтобы потоки пула не ходили в базу и в Google за ним
+    get_youtube_analytics_service(creds_obj)
+
+    executor = _get_report_executor()
+    futures = {name: executor.submit(_execute_report, creds_obj, query, usage) for name, query in queries.items()}
+    results = {}
+    for name, future in futures.items():
+        try:
+            results[name] = future.result()
+        except Exception as e:
+            results[name] = e
+    return results
 
+
+def daily_stats_query(channel_id, start_date, end_date):
+    """Параметры reports().query для дневной статистики канала (строки под save_daily_stats)."""
+    return dict(
+        startDate=start_date.isoformat(),
+        endDate=end_date.isoformat(),
+        metrics='views,subscribersGained,subscribersLost',
+        dimensions='day',
+        ids=f'channel=={channel_id}'
+    )
+
+
+def daily_stats_sync_range(channel, today=None):
+    """
+    Диапазон дней для инкрементальной синхронизации: всё после водяного знака
+    stats_settled_through. Знак отстаёт от даты последней синхронизации на
+    YOUTUBE_ANALYTICS_SETTLE_DAYS, так что дни, которые YouTube ещё пересматривает, перезапрашиваются.
+    """
+    today = today or date.today()
+    if channel.stats_settled_through:
+        start_date = channel.stats_settled_through + timedelta(days=1)
+    else:
+        start_date = today - timedelta(days=settings.YOUTUBE_INITIAL_SYNC_DAYS)
+    return min(start_date, today), today
+
+
+def advance_stats_watermark(channel, synced_through):
+    """Сдвигает водяной знак вперёд после загрузки дней по synced_through включительно."""
+    settled = synced_through - timedelta(days=settings.YOUTUBE_ANALYTICS_SETTLE_DAYS)
+    # Условный UPDATE: параллельная синхронизация или backfill не откатят знак назад
+    YouTubeChannel.objects.filter(pk=channel.pk).filter(
+        Q(stats_settled_through__isnull=True) | Q(stats_settled_through__lt=settled)
+    ).update(stats_settled_through=settled)
+
+
+def fetch_and_save_analytics_data(creds_obj, channel_id):
+    """
+    Загружает дневную статистику и демографию канала. Успешные отчёты сохраняются, даже если
+    другой отчёт упал; затем первая ошибка пробрасывается дальше, чтобы задача синхронизации
+    отметила сбой. Водяной знак сдвигается только после сохранения дневной статистики.
+    """
+    try:
         channel = YouTubeChannel.objects.get(channel_id=channel_id)
-        
-        if 'rows' in response:
-            for row in response['rows']:
-                report_date, views, subs_gained, subs_lost = row
-                YoutubeDailyStats.objects.update_or_create(
-                    channel=channel,
-                    date=report_date,
-                    defaults={
-                        'views': views,
-                        'subscribers_gained': subs_gained,
-                        'subscribers_lost': subs_lost
-                    }
-                )
+        stats_start, stats_end = daily_stats_sync_range(channel)
+        start_date = (date.today() - timedelta(days=30)).isoformat()
+        end_date = date.today().isoformat()
 
-        demographics_response = youtube_analytics.reports().query(
-            startDate=start_date,
-            endDate=end_date,
-            metrics='viewerPercentage',
-            dimensions='ageGroup,gender',
-            ids=f'channel=={channel_id}'
-        ).execute()
-        
-        YoutubeAudienceDemographics.objects.filter(channel=channel).delete()
-        if 'rows' in demographics_response:
-            for row in demographics_response['rows']:
-                age_group, gender, viewer_percentage = row
-                YoutubeAudienceDemographics.objects.create(
-                    channel=channel,
-                    age_group=age_group,
-                    gender=gender,
-                    viewer_percentage=viewer_percentage
-                )
+        results = execute_reports(creds_obj, {
+            'daily_stats': daily_stats_query(channel_id, stats_start, stats_end),
+            'demographics': dict(
+                startDate=start_date,
+                endDate=end_date,
+                metrics='viewerPercentage',
+                dimensions='ageGroup,gender',
+                ids=f'channel=={channel_id}'
+            ),
+        })
 
+        errors = []
+        for name, save in (('daily_stats', save_daily_stats), ('demographics', save_demographics)):
+            response = results[name]
+            if isinstance(response, HttpError):
+                logger.error(f"HTTP Error during analytics fetch ({name}): {response}")
+                errors.append(response)
+            elif isinstance(response, Exception):
+                logger.error(f"Error fetching analytics data ({name}): {response}")
+                errors.append(response)
+            else:
+                save(channel, response.get('rows', []))
+                if name == 'daily_stats':
+                    advance_stats_watermark(channel, stats_end)
     except HttpError as e:
         logger.error(f"HTTP Error during analytics fetch: {e}")
+        raise
     except Exception as e:
         logger.error(f"Error fetching and saving analytics data: {e}")
+        raise
 
-def update_all_videos(creds_obj):
-    try:
-        youtube = get_youtube_service(creds_obj)
-        channel_id = fetch_own_channel_id(creds_obj)
-        if not channel_id:
-            return
+    if errors:
+        raise errors[0]
 
-        channel = YouTubeChannel.objects.get(channel_id=channel_id)
-        
-        request = youtube.search().list(
-            part='snippet',
-            channelId=channel_id,
-            maxResults=20,
-            order='date',
-            type='video'
+
+# Максимальный размер страницы playlistItems.list и число ID в одном videos.list
+VIDEOS_PAGE_SIZE = 50
+
+
+def fetch_uploads_playlist_id(youtube, usage, channel_id=None):
+    if channel_id:
+        request = youtube.channels().list(part='id,contentDetails', id=channel_id)
+    else:
+        request = youtube.channels().list(part='id,contentDetails', mine=True)
+    response = scheduler.execute(request, 'channels.list', usage)
+
+    items = response.get('items', [])
+    if not items:
+        return None, None
+    return items[0]['id'], items[0]['contentDetails']['relatedPlaylists']['uploads']
+
+
+def iter_playlist_video_ids(youtube, playlist_id, usage, max_pages=None):
+    """Отдаёт ID видео плейлиста постранично, не держа в памяти весь список."""
+    page_token = None
+    pages = 0
+    while True:
+        response = scheduler.execute(
+            youtube.playlistItems().list(
+                part='contentDetails',
+                playlistId=playlist_id,
+                maxResults=VIDEOS_PAGE_SIZE,
+                pageToken=page_token
+            ),
+            'playlistItems.list',
+            usage
         )
+        pages += 1
 
-        response = request.execute()
-        
-        for item in response['items']:
-            video_id = item['id']['videoId']
-            title = item['snippet']['title']
-            published_at = item['snippet']['publishedAt']
-
-            stats_response = youtube.videos().list(
-                part='statistics',
-                id=video_id
-            ).execute()
-            
-            if 'items' in stats_response and len(stats_response['items']) > 0:
-                stats = stats_response['items'][0]['statistics']
-                views = stats.get('viewCount', 0)
-                likes = stats.get('likeCount', 0)
-                comments = stats.get('commentCount', 0)
-
-                YouTubeVideo.objects.update_or_create(
-                    video_id=video_id,
-                    defaults={
-                        'channel': channel,
-                        'title': title,
-                        'published_at': published_at,
-                        'views': views,
-                        'likes': likes,
-                        'comments': comments
-                    }
-                )
+        video_ids = [item['contentDetails']['videoId'] for item in response.get('items', [])]
+        if video_ids:
+            yield video_ids
+
+        page_token = response.get('nextPageToken')
+        if not page_token or (max_pages and pages >= max_pages):
+            break
+
+
+def fetch_videos_details(youtube, video_ids, usage):
+    """Снипеты и статистика для пачки до 50 видео одним запросом."""
+    response = scheduler.execute(
+        youtube.videos().list(
+            part='snippet,statistics',
+            id=','.join(video_ids),
+            maxResults=VIDEOS_PAGE_SIZE
+        ),
+        'videos.list',
+        usage
+    )
+    return response.get('items', [])
+
+
+def save_videos(channel, items):
+    written = bulk_upsert(
+        YouTubeVideo,
+        (
+            YouTubeVideo(
+                channel=channel,
+                video_id=item['id'],
+                title=item['snippet']['title'],
+                published_at=item['snippet']['publishedAt'],
+                views=item.get('statistics', {}).get('viewCount', 0),
+                likes=item.get('statistics', {}).get('likeCount', 0),
+                comments=item.get('statistics', {}).get('commentCount', 0)
+            )
+            for item in items
+        ),
+        unique_fields=['video_id'],
+        update_fields=['channel', 'title', 'published_at', 'views', 'likes', 'comments'],
+    )
+    if written:
+        transaction.on_commit(lambda: bump_data_version(channel.pk))
+    return written
+
+
+VIDEO_SNAPSHOT_COUNTERS = {
+    'views': 'viewCount',
+    'likes': 'likeCount',
+    'comments': 'commentCount',
+}
+
+
+def save_video_snapshots(channel, items, snapshot_date=None):
+    """
+    Записывает дневной снимок счётчиков видео из ответа videos.list и прирост с предыдущего снимка.
+    Повторный запуск в тот же день обновляет снимок дня. Предыдущие значения читаются одним
+    запросом с подзапросами по индексу (video, date). В хранилище 'packed' снимки дописываются
+    в ряды видео (см. youtube/series.py). Возвращает число записанных строк или рядов.
+    """
+    snapshot_date = snapshot_date or timezone.localdate()
+    stats_by_id = {item['id']: item.get('statistics', {}) for item in items}
+    if not stats_by_id:
+        return 0
+
+    if packed_storage():
+        # В рядах прирост не хранится, а считается при чтении
+        videos = YouTubeVideo.objects.filter(channel=channel, video_id__in=stats_by_id).values_list('pk', 'video_id')
+        written = append_snapshots(
+            (pk, snapshot_date, *(
+                int(stats_by_id[video_id].get(VIDEO_SNAPSHOT_COUNTERS[name], 0)) for name in COUNTERS
+            ))
+            for pk, video_id in videos
+        )
+        if written:
+            transaction.on_commit(lambda: bump_data_version(channel.pk))
+        return written
 
+    previous = YouTubeVideoDailyStats.objects.filter(
+        video=OuterRef('pk'), date__lt=snapshot_date
+    ).order_by('-date')
+    videos = YouTubeVideo.objects.filter(
+        channel=channel, video_id__in=stats_by_id
+    ).annotate(**{
+        f'previous_{field}': Subquery(previous.values(field)[:1])
+        for field in VIDEO_SNAPSHOT_COUNTERS
+    }).values('pk', 'video_id', *(f'previous_{field}' for field in VIDEO_SNAPSHOT_COUNTERS))
+
+    snapshots = []
+    for video in videos:
+        statistics = stats_by_id[video['video_id']]
+        counters = {field: int(statistics.get(key, 0)) for field, key in VIDEO_SNAPSHOT_COUNTERS.items()}
+        deltas = {
+            f'{field}_delta': None if video[f'previous_{field}'] is None else value - video[f'previous_{field}']
+            for field, value in counters.items()
+        }
+        snapshots.append(YouTubeVideoDailyStats(video_id=video['pk'], date=snapshot_date, **counters, **deltas))
+
+    written = bulk_upsert(
+        YouTubeVideoDailyStats,
+        snapshots,
+        unique_fields=['video', 'date'],
+        update_fields=[*VIDEO_SNAPSHOT_COUNTERS, *(f'{field}_delta' for field in VIDEO_SNAPSHOT_COUNTERS)],
+    )
+    if written:
+        transaction.on_commit(lambda: bump_data_version(channel.pk))
+    return written
+
+
+def update_all_videos(creds_obj, channel_id=None, max_pages=None):
+    """
+    Обходит плейлист загрузок канала, обновляет статистику всех видео и пишет их дневной снимок.
+    max_pages ограничивает обход последними max_pages * 50 видео.
+    Возвращает ApiUsage с числом вызовов и потраченной квотой.
+    """
+    usage = ApiUsage(user_id=creds_obj.user_id)
+    try:
+        youtube = get_youtube_service(creds_obj)
+        channel = YouTubeChannel.objects.filter(channel_id=channel_id).first() if channel_id else None
+        # Плейлист загрузок сохраняется при привязке канала, channels.list нужен только старым каналам
+        uploads_playlist_id = channel.uploads_playlist_id if channel else None
+        if not uploads_playlist_id:
+            channel_id, uploads_playlist_id = fetch_uploads_playlist_id(youtube, usage, channel_id)
+            if not uploads_playlist_id:
+                logger.error("No uploads playlist found for the channel.")
+                return usage
+            channel = channel or YouTubeChannel.objects.get(channel_id=channel_id)
+
+        # Снимок берётся из того же ответа videos.list, дополнительной квоты он не тратит
+        snapshot_date = timezone.localdate()
+        for video_ids in iter_playlist_video_ids(youtube, uploads_playlist_id, usage, max_pages=max_pages):
+            items = fetch_videos_details(youtube, video_ids, usage)
+            save_videos(channel, items)
+            save_video_snapshots(channel, items, snapshot_date)
+
+    except QuotaExceededError:
+        # Молча продолжать нельзя: синхронизация должна завершиться ошибкой до сброса квоты
+        logger.error(f"Video sync for channel {channel_id} stopped: quota exhausted after {usage}")
+        raise
     except HttpError as e:
-        logger.error(f"HTTP Error during video update: {e}")
+        # Недообойдённый плейлист — неполная синхронизация: ошибка уходит в sync_channel, статус FAILED
+        logger.error(f"HTTP Error during video update after {usage}: {e}")
+        raise
     except Exception as e:
-        logger.error(f"Error updating videos: {e}")
+        logger.error(f"Error updating videos after {usage}: {e}")
+        raise
+
+    logger.info(f"Video sync for channel {channel_id} used {usage}")
+    return usage
         
         
-def fetch_viewer_activity(creds_obj, channel_id, start_date_str, end_date_str):
-    try:
-        analytics = get_youtube_analytics_service(creds_obj)
-
-        device_request = analytics.reports().query(
-            ids=f'channel=={channel_id}',
-            startDate=start_date_str,
-            endDate=end_date_str,
-            metrics='views',
-            dimensions='deviceType',
-        )
-        device_response = device_request.execute()
-
-        subscribed_request = analytics.reports().query(
-            ids=f'channel=={channel_id}',
-            startDate=start_date_str,
-            endDate=end_date_str,
-            metrics='views',
-            dimensions='subscribedStatus',
-        )
-        subscribed_response = subscribed_request.execute()
+_viewer_activity_flight = SingleFlight()
+
+VIEWER_ACTIVITY_DIMENSIONS = {
+    'device_type': 'deviceType',
+    'subscribed_status': 'subscribedStatus',
+}
 
-        return {
-            'device_type': device_response.get('rows', []),
-            'subscribed_status': subscribed_response.get('rows', [])
-        }
 
+def _date_ranges(days):
+    """Склеивает отсортированный список дат в непрерывные диапазоны (start, end)."""
+    ranges = []
+    for day in days:
+        if ranges and day == ranges[-1][1] + timedelta(days=1):
+            ranges[-1][1] = day
+        else:
+            ranges.append([day, day])
+    return [tuple(r) for r in ranges]
+
+
+def find_missing_viewer_activity(channel, start_date, end_date):
+    """
+    Диапазоны дат, которых нет в базе или которые были загружены до того,
+    как Analytics API закончил их пересчитывать.
+    """
+    settle = timedelta(days=settings.YOUTUBE_ANALYTICS_SETTLE_DAYS)
+    settled_dates = {
+        row_date
+        for row_date, fetched_at in YoutubeViewerActivity.objects.filter(
+            channel=channel, date__range=[start_date, end_date]
+        ).values_list('date', 'fetched_at')
+        if fetched_at.date() >= row_date + settle
+    }
+    days = (start_date + timedelta(days=i) for i in range((end_date - start_date).days + 1))
+    return _date_ranges([day for day in days if day not in settled_dates])
+
+
+def save_viewer_activity(channel, start_date, end_date, breakdowns):
+    now = timezone.now()
+    days = [start_date + timedelta(days=i) for i in range((end_date - start_date).days + 1)]
+    return bulk_upsert(
+        YoutubeViewerActivity,
+        (
+            YoutubeViewerActivity(
+                channel=channel,
+                date=day,
+                device_type=breakdowns['device_type'].get(day.isoformat(), {}),
+                subscribed_status=breakdowns['subscribed_status'].get(day.isoformat(), {}),
+                fetched_at=now
+            )
+            for day in days
+        ),
+        unique_fields=['channel', 'date'],
+        update_fields=['device_type', 'subscribed_status', 'fetched_at'],
+    )
+
+
+def _reports_timeout(reports):
+    """
+    Верхняя оценка времени execute_reports на reports отчётов: волны по YOUTUBE_ANALYTICS_MAX_WORKERS,
+    в каждой все попытки планировщика с таймаутами HTTP и паузами между повторами.
+    """
+    attempts = settings.YOUTUBE_API_MAX_RETRIES + 1
+    backoff = sum(
+        min(settings.YOUTUBE_API_BACKOFF_MAX, settings.YOUTUBE_API_BACKOFF_BASE * 2 ** attempt)
+        for attempt in range(settings.YOUTUBE_API_MAX_RETRIES)
+    )
+    per_report = attempts * (settings.HTTP_CONNECT_TIMEOUT + settings.HTTP_READ_TIMEOUT) + backoff
+    return math.ceil(reports / settings.YOUTUBE_ANALYTICS_MAX_WORKERS) * per_report
+
+
+def fill_viewer_activity(creds_obj, channel, start_date, end_date, usage=None):
+    # Блокировка на канал: параллельные запросы из других процессов дождутся загрузки
+    # и пересчитают недостающие дни уже после неё. Блокировка живёт не меньше самой загрузки
+    missing = find_missing_viewer_activity(channel, start_date, end_date)
+    if not missing:
+        return
+    timeout = _reports_timeout(len(missing) * len(VIEWER_ACTIVITY_DIMENSIONS)) + 60
+
+    with cache_lock(f'viewer_activity:{channel.pk}', timeout=timeout) as acquired:
+        missing = find_missing_viewer_activity(channel, start_date, end_date)
+        if not missing:
+            return
+        if not acquired:
+            # Загрузку ведёт другой процесс; второй параллельный запрос к API не делаем
+            logger.warning(f"Viewer activity for channel {channel.channel_id} is still being fetched elsewhere")
+            return
+
+        results = execute_reports(creds_obj, {
+            (range_start, range_end, key): dict(
+                ids=f'channel=={channel.channel_id}',
+                startDate=range_start.isoformat(),
+                endDate=range_end.isoformat(),
+                metrics='views',
+                dimensions=f'day,{dimension}',
+            )
+            for range_start, range_end in missing
+            for key, dimension in VIEWER_ACTIVITY_DIMENSIONS.items()
+        }, usage=usage)
+
+        error = None
+        for range_start, range_end in missing:
+            breakdowns = {}
+            for key in VIEWER_ACTIVITY_DIMENSIONS:
+                response = results[(range_start, range_end, key)]
+                if isinstance(response, Exception):
+                    error = response
+                    break
+                by_day = {}
+                for report_date, value, views in response.get('rows', []):
+                    by_day.setdefault(report_date, {})[value] = views
+                breakdowns[key] = by_day
+            else:
+                save_viewer_activity(channel, range_start, range_end, breakdowns)
+
+        # Успешно загруженные диапазоны уже сохранены, ошибку отдаём вызывающему для логирования
+        if error is not None:
+            raise error
+
+
+def read_viewer_activity(channel, start_date, end_date):
+    totals = {key: {} for key in VIEWER_ACTIVITY_DIMENSIONS}
+    rows = YoutubeViewerActivity.objects.filter(
+        channel=channel, date__range=[start_date, end_date]
+    ).values_list('device_type', 'subscribed_status')
+    for device_type, subscribed_status in rows:
+        for key, breakdown in (('device_type', device_type), ('subscribed_status', subscribed_status)):
+            for value, views in breakdown.items():
+                totals[key][value] = totals[key].get(value, 0) + views
+
+    return {
+        key: sorted(([value, views] for value, views in values.items()), key=lambda row: row[1], reverse=True)
+        for key, values in totals.items()
+    }
+
+
+def fetch_viewer_activity(creds_obj, channel_id, start_date_str, end_date_str, channel=None):
+    """
+    Активность зрителей за период из базы. Из Analytics API загружаются только
+    недостающие дни; одинаковые запросы, пришедшие одновременно, делают один вызов.
+    Уже загруженный канал можно передать в channel, чтобы не читать его повторно.
+    """
+    empty = {key: [] for key in VIEWER_ACTIVITY_DIMENSIONS}
+
+    start_date = parse_date(start_date_str) if start_date_str else None
+    end_date = parse_date(end_date_str) if end_date_str else None
+    if not start_date or not end_date:
+        return empty
+    end_date = min(end_date, date.today())
+    if start_date > end_date:
+        return empty
+
+    channel = channel or YouTubeChannel.objects.filter(channel_id=channel_id).first()
+    if not channel:
+        return empty
+
+    try:
+        if find_missing_viewer_activity(channel, start_date, end_date):
+            _viewer_activity_flight.do(
+                (channel.pk, start_date, end_date),
+                lambda: fill_viewer_activity(
+                    creds_obj, channel, start_date, end_date,
+                    usage=ApiUsage(user_id=creds_obj.user_id, priority=Priority.INTERACTIVE)
+                )
+            )
+    except HttpError as e:
+        logger.error(f"HTTP Error during viewer activity fetch: {e}")
     except Exception as e:
-        print(f"HTTP Error during viewer activity fetch: {e}")
-        return {
-            'device_type': [],
-            'subscribed_status': []
-        }
+        logger.error(f"Error fetching viewer activity: {e}")
+
+    return read_viewer_activity(channel, start_date, end_date)
@@ -0,0 +1,71 @@
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+from django.core.cache import cache
+
+
+class _Call:
+    def __init__(self):
+        self.event = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """
+    Схлопывает одновременные вызовы с одинаковым ключом в один: первый поток выполняет
+    функцию, остальные ждут и получают тот же результат (или то же исключение).
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+
+    def do(self, key, fn):
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+
+        if not leader:
+            call.event.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = fn()
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.event.set()
+        return call.result
+
+
+@contextmanager
+def cache_lock(key, timeout=60, wait=30, poll_interval=0.2):
+    """
+    Межпроцессная блокировка на cache.add. Отдаёт True, если блокировка получена,
+    и False, если за wait секунд её так и не отпустили.
+
+    В ключе хранится случайный токен владельца: если блокировка истекла по timeout
+    и её уже взял другой процесс, прежний владелец при выходе её не снимет.
+    """
+    lock_key = f'lock:{key}'
+    token = uuid.uuid4().hex
+    deadline = time.monotonic() + wait
+    acquired = cache.add(lock_key, token, timeout=timeout)
+    while not acquired and time.monotonic() < deadline:
+        time.sleep(poll_interval)
+        acquired = cache.add(lock_key, token, timeout=timeout)
+    try:
+        yield acquired
+    finally:
+        if acquired and cache.get(lock_key) == token:
+            cache.delete(lock_key)
@@ -0,0 +1,283 @@
+import csv
+import io
+import math
+import random
+from datetime import datetime, time, timedelta
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.utils import timezone
+
+from accounts.models import CustomUser, GoogleCredentials
+from .fakes import FAKE_AGE_GROUPS, FAKE_GENDERS, fake_channel_id
+from .models import (
+    YouTubeChannel,
+    YoutubeAudienceDemographics,
+    YoutubeDailyStats,
+    YouTubeVideo,
+    YouTubeVideoDailyStats,
+    YouTubeVideoSeries,
+)
+from .rollups import rebuild_rollups
+from .series import build_series, packed_storage
+
+DEMOGRAPHIC_BUCKETS = [(age, gender) for age in FAKE_AGE_GROUPS for gender in FAKE_GENDERS]
+
+
+def copy_supported():
+    return connection.vendor == 'postgresql'
+
+
+class RowWriter:
+    """
+    Буфер строк одной таблицы. Строки — кортежи значений в порядке fields (attname полей модели).
+    Пачка уходит в базу через COPY FROM STDIN на Postgres или одним executemany INSERT на других базах:
+    bulk_create собирает модель и готовит каждое значение через поле, и на миллионах строк это
+    в десятки раз медленнее самой вставки.
+    """
+
+    def __init__(self, model, fields, use_copy, batch_size):
+        self.model = model
+        self.fields = fields
+        self.use_copy = use_copy
+        self.batch_size = batch_size
+        self.rows = []
+        self.written = 0
+
+        model_fields = [model._meta.get_field(name) for name in fields]
+        self.table = connection.ops.quote_name(model._meta.db_table)
+        self.columns = ', '.join(connection.ops.quote_name(field.column) for field in model_fields)
+        self.adapters = [self._adapter(field) for field in model_fields]
+
+    @staticmethod
+    def _adapter(field):
+        internal_type = field.get_internal_type()
+        if internal_type == 'DateTimeField':
+            return connection.ops.adapt_datetimefield_value
+        if internal_type == 'DateField':
+            return connection.ops.adapt_datefield_value
+        return None
+
+    def add(self, *row):
+        self.rows.append(row)
+        if len(self.rows) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        if not self.rows:
+            return
+        if self.use_copy:
+            self._copy()
+        else:
+            self._insert()
+        self.written += len(self.rows)
+        self.rows = []
+
+    def _insert(self):
+        adapters = [(i, adapt) for i, adapt in enumerate(self.adapters) if adapt]
+        rows = self.rows
+        if adapters:
+            rows = [list(row) for row in rows]
+            for row in rows:
+                for i, adapt in adapters:
+                    row[i] = adapt(row[i])
+        placeholders = ', '.join(['%s'] * len(self.fields))
+        with connection.cursor() as cursor:
+            cursor.executemany(f'INSERT INTO {self.table} ({self.columns}) VALUES ({placeholders})', rows)
+
+    def _copy(self):
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        for row in self.rows:
+            writer.writerow(['' if value is None else value for value in row])
+        buffer.seek(0)
+        with connection.cursor() as cursor:
+            # В формате csv пустое поле без кавычек читается как NULL
+            cursor.copy_expert(f'COPY {self.table} ({self.columns}) FROM STDIN WITH (FORMAT csv)', buffer)
+
+
+class SyntheticDataGenerator:
+    """
+    Детерминированный генератор данных в реальные модели для проверки схемы на больших объёмах.
+
+    Для каждого канала заводится свой генератор случайных чисел от (seed, номер пользователя,
+    номер канала), поэтому одинаковые параметры и дата окончания дают одинаковые данные.
+    Первый канал пользователя получает channel_id фейкового API (fake_channel_id), так что с
+    YOUTUBE_API_FACTORY=youtube.fakes.FakeYouTubeApi дашборд открывает сгенерированный канал.
+    """
+
+    def __init__(self, users, channels_per_user, videos_per_channel, days, demographic_buckets,
+                 video_days=0, seed=0, end_date=None, prefix='synthetic', use_copy=None, batch_size=10000,
+                 rollups=True):
+        self.users = users
+        self.channels_per_user = channels_per_user
+        self.videos_per_channel = videos_per_channel
+        self.days = days
+        self.demographic_buckets = DEMOGRAPHIC_BUCKETS[:demographic_buckets]
+        self.video_days = video_days
+        self.seed = seed
+        self.end_date = end_date or timezone.localdate()
+        self.start_date = self.end_date - timedelta(days=days - 1)
+        self.prefix = prefix
+        self.use_copy = copy_supported() if use_copy is None else use_copy
+        self.batch_size = batch_size
+        self.rollups = rollups
+        self.counts = {}
+
+    def writer(self, model, fields):
+        return RowWriter(model, fields, self.use_copy, self.batch_size)
+
+    def email(self, index):
+        return f'{self.prefix}-{index}@example.com'
+
+    def _generated_users(self):
+        return CustomUser.objects.filter(email__startswith=f'{self.prefix}-', email__endswith='@example.com')
+
+    def clear_needed(self):
+        return self._generated_users().exists()
+
+    def clear(self):
+        """Удаляет пользователей прошлого запуска с тем же префиксом вместе с их каналами и статистикой."""
+        deleted, _ = self._generated_users().delete()
+        return deleted
+
+    def generate(self, progress=None):
+        for user_index in range(self.users):
+            with transaction.atomic():
+                user = CustomUser.objects.create_user(
+                    email=self.email(user_index), full_name=f'Synthetic user {user_index}'
+                )
+                creds_obj = GoogleCredentials.objects.create(
+                    user=user,
+                    access_token='synthetic',
+                    token_expiry=timezone.now() + timedelta(days=3650),
+                    scopes=' '.join(settings.YOUTUBE_SCOPES),
+                    token_uri='https://oauth2.googleapis.com/token',
+                )
+                for channel_index in range(self.channels_per_user):
+                    self.generate_channel(user, creds_obj, user_index, channel_index)
+            self._count('users', 1)
+            if progress:
+                progress(user_index + 1, dict(self.counts))
+        return self.counts
+
+    def _count(self, name, value):
+        self.counts[name] = self.counts.get(name, 0) + value
+
+    def generate_channel(self, user, creds_obj, user_index, channel_index):
+        rng = random.Random(f'{self.seed}:{user_index}:{channel_index}')
+        channel_id = fake_channel_id(user.pk) + (f'_{channel_index}' if channel_index else '')
+        channel = YouTubeChannel.objects.create(
+            user=user,
+            credentials=creds_obj,
+            channel_id=channel_id,
+            title=f'Synthetic channel {user_index}.{channel_index}',
+            last_updated=timezone.now(),
+            stats_settled_through=self.end_date,
+        )
+        self._count('channels', 1)
+
+        # Популярность каналов распределена с тяжёлым хвостом: большинство маленькие, единицы огромные
+        base_views = rng.lognormvariate(6, 1.6)
+        self._daily_stats(rng, channel, base_views)
+        self._demographics(rng, channel, base_views)
+        self._videos(rng, channel, channel_id, base_views)
+        if self.rollups:
+            self._count('rollups', rebuild_rollups(channel))
+
+    def _daily_stats(self, rng, channel, base_views):
+        writer = self.writer(YoutubeDailyStats, [
+            'channel_id', 'date', 'views', 'estimated_minutes_watched',
+            'subscribers_gained', 'subscribers_lost', 'likes', 'comments',
+        ])
+        growth = rng.uniform(0.2, 1.5)
+        watch_minutes = rng.uniform(1.5, 9)
+        for offset in range(self.days):
+            day = self.start_date + timedelta(days=offset)
+            trend = 1 + growth * offset / self.days
+            weekend = 1.15 if day.weekday() >= 5 else 1.0
+            views = max(0, int(base_views * trend * weekend * rng.lognormvariate(0, 0.25)))
+            gained = int(views * rng.uniform(0.001, 0.004))
+            writer.add(
+                channel.pk, day, views, int(views * watch_minutes),
+                gained, int(gained * rng.uniform(0.1, 0.5)), int(views * rng.uniform(0.02, 0.05)),
+                int(views * rng.uniform(0.001, 0.005)),
+            )
+        writer.flush()
+        self._count('daily_stats', writer.written)
+
+    def _demographics(self, rng, channel, base_views):
+        if not self.demographic_buckets:
+            return
+        writer = self.writer(YoutubeAudienceDemographics, [
+            'channel_id', 'age_group', 'gender', 'views', 'watch_time_minutes', 'viewer_percentage',
+        ])
+        weights = [rng.gammavariate(2, 1) for _ in self.demographic_buckets]
+        total_weight = sum(weights)
+        total_views = base_views * self.days
+        for (age_group, gender), weight in zip(self.demographic_buckets, weights):
+            share = weight / total_weight
+            writer.add(
+                channel.pk, age_group, gender, int(total_views * share),
+                round(total_views * share * rng.uniform(1.5, 9), 1), round(share * 100, 2),
+            )
+        writer.flush()
+        self._count('demographics', writer.written)
+
+    def _videos(self, rng, channel, channel_id, base_views):
+        if not self.videos_per_channel:
+            return
+        writer = self.writer(YouTubeVideo, [
+            'channel_id', 'video_id', 'title', 'published_at', 'views', 'likes', 'comments',
+        ])
+        videos = []
+        for index in range(self.videos_per_channel):
+            published = self.start_date + timedelta(days=rng.randrange(self.days))
+            # Просмотры видео — распределение Парето: несколько хитов собирают большую часть
+            views = int(base_views * rng.paretovariate(1.2))
+            likes, comments = int(views * rng.uniform(0.02, 0.06)), int(views * rng.uniform(0.001, 0.01))
+            video_id = f'{channel_id}_v{index}'
+            published_at = timezone.make_aware(datetime.combine(published, time(rng.randrange(24))))
+            writer.add(channel.pk, video_id, f'Synthetic video {index}', published_at, views, likes, comments)
+            videos.append((video_id, published, views, likes, comments))
+        writer.flush()
+        self._count('videos', writer.written)
+
+        if self.video_days:
+            self._video_snapshots(channel, videos)
+
+    def _video_snapshots(self, channel, videos):
+        pks = dict(YouTubeVideo.objects.filter(channel=channel).values_list('video_id', 'pk'))
+        first_day = self.end_date - timedelta(days=self.video_days - 1)
+
+        if packed_storage():
+            series = [
+                item
+                for video_id, *video in videos
+                for item in build_series(pks[video_id], self._snapshot_days(first_day, *video))
+            ]
+            YouTubeVideoSeries.objects.bulk_create(series, batch_size=self.batch_size)
+            self._count('video_series', len(series))
+            return
+
+        writer = self.writer(YouTubeVideoDailyStats, [
+            'video_id', 'date', 'views', 'likes', 'comments', 'views_delta', 'likes_delta', 'comments_delta',
+        ])
+        for video_id, *video in videos:
+            previous = None
+            for day, *current in self._snapshot_days(first_day, *video):
+                deltas = [c - p for c, p in zip(current, previous)] if previous else [None, None, None]
+                writer.add(pks[video_id], day, *current, *deltas)
+                previous = current
+        writer.flush()
+        self._count('video_daily_stats', writer.written)
+
+    def _snapshot_days(self, first_day, published, views, likes, comments):
+        """Снимки (день, views, likes, comments) видео с max(first_day, published) по end_date."""
+        start = max(first_day, published)
+        # Счётчики растут к текущим значениям по затухающей кривой: больше всего в первые дни
+        age = (self.end_date - published).days + 1
+        for offset in range((self.end_date - start).days + 1):
+            day = start + timedelta(days=offset)
+            progress = math.log1p((day - published).days + 1) / math.log1p(age)
+            yield day, int(views * progress), int(likes * progress), int(comments * progress)
@@ -0,0 +1,158 @@
+import logging
+
+from celery import shared_task
+from django.conf import settings
+from django.db.models import Q
+from django.utils import timezone
+
+from accounts.models import GoogleCredentials
+from .models import YouTubeChannel
+from .backfill import run_backfill
+from .partitioning import ensure_partitions
+from .quota import scheduler
+from .services import fetch_and_save_analytics_data, revalidate_channel_identity, update_all_videos
+
+logger = logging.getLogger(__name__)
+
+
+def enqueue_channel_sync(channel):
+    """
+    Ставит синхронизацию канала в очередь, если она ещё не поставлена.
+    Возвращает True, если задача была отправлена.
+    """
+    now = timezone.now()
+    claimable = (
+        Q(sync_status__in=[YouTubeChannel.SyncStatus.IDLE, YouTubeChannel.SyncStatus.FAILED])
+        | Q(sync_requested_at__lt=now - settings.YOUTUBE_SYNC_LOCK_TIMEOUT)
+        | Q(sync_requested_at__isnull=True)
+    )
+    # Условный UPDATE работает как блокировка: из параллельных запросов задачу поставит только один
+    claimed = YouTubeChannel.objects.filter(claimable, pk=channel.pk).update(
+        sync_status=YouTubeChannel.SyncStatus.QUEUED,
+        sync_requested_at=now,
+        sync_error='',
+    )
+    if not claimed:
+        return False
+
+    try:
+        sync_channel.delay(channel.pk)
+    except Exception as e:
+        logger.error(f"Failed to enqueue sync for channel {channel.channel_id}: {e}")
+        YouTubeChannel.objects.filter(pk=channel.pk).update(
+            sync_status=YouTubeChannel.SyncStatus.FAILED,
+            sync_error=str(e),
+        )
+        return False
+
+    channel.sync_status = YouTubeChannel.SyncStatus.QUEUED
+    channel.sync_requested_at = now
+    return True
+
+
+@shared_task
+def sync_channel(channel_pk):
+    try:
+        channel = YouTubeChannel.objects.select_related('credentials').get(pk=channel_pk)
+    except YouTubeChannel.DoesNotExist:
+        logger.warning(f"Sync requested for missing channel pk={channel_pk}")
+        return
+
+    YouTubeChannel.objects.filter(pk=channel.pk).update(
+        sync_status=YouTubeChannel.SyncStatus.RUNNING,
+        sync_requested_at=timezone.now(),
+    )
+
+    try:
+        creds_obj = channel.get_credentials()
+        if creds_obj is None:
+            raise GoogleCredentials.DoesNotExist(f"No Google credentials for channel {channel.channel_id}")
+        fetch_and_save_analytics_data(creds_obj, channel.channel_id)
+        usage = update_all_videos(creds_obj, channel_id=channel.channel_id)
+    except Exception as e:
+        logger.error(f"Error syncing channel {channel.channel_id}: {e}")
+        YouTubeChannel.objects.filter(pk=channel.pk).update(
+            sync_status=YouTubeChannel.SyncStatus.FAILED,
+            sync_error=str(e),
+        )
+        raise
+
+    YouTubeChannel.objects.filter(pk=channel.pk).update(
+        sync_status=YouTubeChannel.SyncStatus.IDLE,
+        sync_error='',
+        last_updated=timezone.now(),
+    )
+    return usage.as_dict()
+
+
+@shared_task
+def sync_stale_channels():
+    if not scheduler.remaining():
+        logger.warning(f"Skipping scheduled syncs: YouTube API quota exhausted ({scheduler.usage()})")
+        return 0
+
+    threshold = timezone.now() - settings.YOUTUBE_SYNC_INTERVAL
+    stale_channels = YouTubeChannel.objects.filter(
+        Q(last_updated__isnull=True) | Q(last_updated__lt=threshold)
+    )
+    queued = 0
+    for channel in stale_channels.iterator():
+        if enqueue_channel_sync(channel):
+            queued += 1
+    return queued
+
+
+def enqueue_channel_backfill(channel):
+    """Ставит загрузку полной истории канала в очередь; ошибка брокера не ломает запрос."""
+    try:
+        backfill_channel.delay(channel.pk)
+        return True
+    except Exception as e:
+        logger.error(f"Failed to enqueue backfill for channel {channel.channel_id}: {e}")
+        return False
+
+
+@shared_task
+def backfill_channel(channel_pk, restart=False):
+    channel = YouTubeChannel.objects.select_related('credentials').filter(pk=channel_pk).first()
+    creds_obj = channel.get_credentials() if channel else None
+    if creds_obj is None:
+        logger.warning(f"Backfill requested for channel pk={channel_pk} without channel or credentials")
+        return None
+
+    backfill = run_backfill(creds_obj, channel, restart=restart)
+    return backfill.status if backfill else None
+
+
+@shared_task
+def revalidate_channels():
+    """
+    Перепроверяет привязку каналов, которые давно не проверялись (YOUTUBE_CHANNEL_REVALIDATE_INTERVAL).
+    Дашборд берёт канал из базы и в Google за ним не ходит, поэтому отозванный доступ
+    и переименования замечает эта задача.
+    """
+    threshold = timezone.now() - settings.YOUTUBE_CHANNEL_REVALIDATE_INTERVAL
+    channels = YouTubeChannel.objects.select_related('credentials').filter(
+        Q(identity_checked_at__isnull=True) | Q(identity_checked_at__lt=threshold)
+    )
+    checked = 0
+    for channel in channels.iterator():
+        if not scheduler.remaining():
+            logger.warning(f"Stopping channel revalidation: YouTube API quota exhausted ({scheduler.usage()})")
+            break
+        try:
+            revalidate_channel_identity(channel)
+        except Exception as e:
+            logger.error(f"Error revalidating channel {channel.channel_id}: {e}")
+            continue
+        checked += 1
+    return checked
+
+
+@shared_task
+def ensure_stats_partitions():
+    """Заранее создаёт секции следующих месяцев; без секционирования или не на PostgreSQL ничего не делает."""
+    created = ensure_partitions()
+    if created:
+        logger.info(f"Created stats partitions: {', '.join(created)}")
+    return created
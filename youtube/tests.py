@@ -1,17 +1,97 @@
-from django.test import TestCase, Client
+from django.test import TestCase, Client, override_settings
 from django.urls import reverse
 from django.utils import timezone
 from datetime import date, timedelta
-from unittest.mock import patch, MagicMock
+from contextlib import contextmanager
+from unittest import skipUnless
+from unittest.mock import patch, AsyncMock, MagicMock
+import csv
+import gzip
+import io
+import itertools
 import json
+import os
+import tempfile
+import threading
+import time
 from django.conf import settings
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.core.cache import cache
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
 from google.oauth2.credentials import Credentials as GoogleCredentialsClass
+from googleapiclient.errors import HttpError
+from httplib2 import Response as HttpResponse
+import httpx
+import requests
+import subprocess
+import sys
+from prometheus_client import REGISTRY
+from prometheus_client.parser import text_string_to_metric_families
+from asgiref.sync import async_to_sync, iscoroutinefunction
+from rest_framework.authtoken.models import Token
 
 from accounts.models import CustomUser, GoogleCredentials
-from .models import YouTubeChannel, YoutubeDailyStats, YouTubeVideo, YoutubeAudienceDemographics
+from social_analytics.streaming import aiterate
+from social_analytics.transport import get_async_client, get_httplib2, get_session
+from .models import (
+    YouTubeChannel,
+    YoutubeDailyStats,
+    YouTubeVideo,
+    YoutubeAudienceDemographics,
+    YoutubeViewerActivity,
+    YoutubeStatsRollup,
+    YouTubeVideoDailyStats,
+    YouTubeVideoSeries,
+    YoutubeBackfill,
+)
+from . import exports
+from .clients import clear_service_cache, get_discovery_document, get_service
+from .quota import ApiUsage, Priority, QuotaExceededError, QuotaScheduler, TokenBucket, scheduler
+from .backfill import plan_chunks, run_backfill
+from .benchmarks import (
+    BENCHMARK_SETTINGS,
+    VIEW_QUERY_BUDGETS,
+    check_query_budgets,
+    compare_with_baseline,
+    create_fixture,
+    run_benchmarks,
+)
+from .caching import bump_data_version
+from .gemini import get_gemini_model, reset_gemini_model, stream_cached_summary
+from .prompts import build_channel_digest, estimate_tokens, render_digest
+from . import partitioning
+from .bulk import bulk_upsert
+from .rollups import rebuild_rollups
+from .series import decode as series_decode, pack_rows, read_packed, read_rows
+from .fakes import fake_channel_id
+from .services import (
+    ChannelLinkError,
+    advance_stats_watermark,
+    execute_reports,
+    fetch_and_save_analytics_data,
+    fetch_viewer_activity,
+    link_channel,
+    save_daily_stats,
+    save_demographics,
+    save_video_snapshots,
+    save_videos,
+    update_all_videos,
+)
+from .singleflight import SingleFlight, cache_lock
+from .tasks import (
+    enqueue_channel_sync,
+    ensure_stats_partitions,
+    revalidate_channels,
+    sync_channel,
+    sync_stale_channels,
+)
+from .views import channel_trends, gemini_chat, video_trends, viewer_activity, youtube_callback
 
 class YouTubeViewsTests(TestCase):
     def setUp(self):
+        cache.clear()
         self.client = Client()
         self.user = CustomUser.objects.create_user(email='testuser@example.com', password='testpassword')
         self.credentials = GoogleCredentials.objects.create(
@@ -121,7 +201,8 @@ class YouTubeViewsTests(TestCase):
     @patch('youtube.services.get_youtube_service', side_effect=mock_get_youtube_service)
     @patch('youtube.services.get_youtube_analytics_service', side_effect=mock_get_youtube_analytics_service)
     @patch('youtube.services.update_all_videos', side_effect=mock_update_services)
-    def test_youtube_dashboard_view_success(self, mock_update_videos, mock_get_analytics, mock_get_youtube, mock_creds_info):
+    @patch('youtube.tasks.sync_channel.delay')
+    def test_youtube_dashboard_view_success(self, mock_delay, mock_update_videos, mock_get_analytics, mock_get_youtube, mock_creds_info):
         """Проверка, что страница дашборда загружается корректно для авторизованного пользователя."""
         self.client.force_login(self.user)
         response = self.client.get(reverse('youtube-dashboard'))
@@ -133,10 +214,10 @@ class YouTubeViewsTests(TestCase):
     def test_unauthenticated_api_access(self):
         """Проверка, что неаутентифицированные пользователи не могут получить доступ к API."""
         response = self.client.get(reverse('channel_trends'))
-        self.assertEqual(response.status_code, 302)
+        self.assertEqual(response.status_code, 401)
         
         response = self.client.get(reverse('video_trends'))
-        self.assertEqual(response.status_code, 302)
+        self.assertEqual(response.status_code, 401)
         
     def test_channel_trends_api_view_success(self):
         """Проверка, что API трендов канала возвращает корректные данные."""
@@ -228,7 +309,7 @@ class YouTubeViewsTests(TestCase):
         """
         response = self.client.get(reverse('viewer_activity'))
         
-        self.assertEqual(response.status_code, 302) 
+        self.assertEqual(response.status_code, 401)
         
     def test_viewer_activity_api_view_no_credentials(self):
         """
@@ -272,4 +353,2109 @@ class YouTubeViewsTests(TestCase):
         })
         
         self.assertEqual(response.status_code, 404)
-        self.assertIn('No channels found for this user', response.json()['error'])    
\ No newline at end of file
+        self.assertIn('No channels found for this user', response.json()['error'])
+
+
+class YouTubeSyncTests(TestCase):
+    def setUp(self):
+        self.client = Client()
+        self.user = CustomUser.objects.create_user(email='syncuser@example.com', password='testpassword')
+        self.credentials = GoogleCredentials.objects.create(
+            user=self.user,
+            access_token='fake_access_token',
+            refresh_token='fake_refresh_token',
+            token_expiry=timezone.now() + timedelta(hours=1),
+            scopes=' '.join(settings.YOUTUBE_SCOPES),
+            client_id=settings.YOUTUBE_CLIENT_ID,
+            client_secret=settings.YOUTUBE_CLIENT_SECRET,
+            token_uri="https://oauth2.googleapis.com/token",
+        )
+        self.channel = YouTubeChannel.objects.create(
+            user=self.user,
+            channel_id='UC_sync_channel_id',
+            title='Sync Channel'
+        )
+
+    @patch('youtube.views.fetch_viewer_activity', return_value={'device_type': [], 'subscribed_status': []})
+    @patch('youtube.views.fetch_channel_identity', side_effect=AssertionError('dashboard must not call Google'))
+    @patch('youtube.tasks.sync_channel.delay')
+    def test_dashboard_enqueues_sync_for_stale_channel(self, mock_delay, mock_channel_id, mock_activity):
+        """Проверка, что дашборд не синхронизирует данные сам, а ставит задачу в очередь."""
+        self.client.force_login(self.user)
+        response = self.client.get(reverse('youtube-dashboard'))
+
+        self.assertEqual(response.status_code, 200)
+        mock_delay.assert_called_once_with(self.channel.pk)
+        self.assertEqual(response.context['sync_status'], YouTubeChannel.SyncStatus.QUEUED)
+
+    @patch('youtube.views.fetch_viewer_activity', return_value={'device_type': [], 'subscribed_status': []})
+    @patch('youtube.views.fetch_channel_identity', side_effect=AssertionError('dashboard must not call Google'))
+    @patch('youtube.tasks.sync_channel.delay')
+    def test_dashboard_skips_sync_for_fresh_channel(self, mock_delay, mock_channel_id, mock_activity):
+        """Проверка, что свежие данные не вызывают синхронизацию."""
+        self.channel.last_updated = timezone.now()
+        self.channel.save()
+        self.client.force_login(self.user)
+
+        response = self.client.get(reverse('youtube-dashboard'))
+
+        self.assertEqual(response.status_code, 200)
+        mock_delay.assert_not_called()
+
+    @patch('youtube.tasks.sync_channel.delay')
+    def test_enqueue_is_deduplicated(self, mock_delay):
+        """Проверка, что повторный запрос не ставит вторую задачу, пока первая в очереди."""
+        self.assertTrue(enqueue_channel_sync(self.channel))
+        self.assertFalse(enqueue_channel_sync(self.channel))
+        mock_delay.assert_called_once_with(self.channel.pk)
+
+    @patch('youtube.tasks.sync_channel.delay')
+    def test_enqueue_restarts_expired_lock(self, mock_delay):
+        """Проверка, что зависшая синхронизация перезапускается после таймаута."""
+        YouTubeChannel.objects.filter(pk=self.channel.pk).update(
+            sync_status=YouTubeChannel.SyncStatus.RUNNING,
+            sync_requested_at=timezone.now() - settings.YOUTUBE_SYNC_LOCK_TIMEOUT - timedelta(minutes=1),
+        )
+        self.assertTrue(enqueue_channel_sync(self.channel))
+        mock_delay.assert_called_once()
+
+    @patch('youtube.tasks.update_all_videos')
+    @patch('youtube.tasks.fetch_and_save_analytics_data')
+    def test_sync_channel_task_updates_channel(self, mock_fetch, mock_update):
+        """Проверка, что задача синхронизации вызывает сервисы и обновляет статус канала."""
+        mock_update.return_value = ApiUsage()
+        sync_channel(self.channel.pk)
+
+        mock_fetch.assert_called_once_with(self.credentials, 'UC_sync_channel_id')
+        mock_update.assert_called_once_with(self.credentials, channel_id='UC_sync_channel_id')
+        self.channel.refresh_from_db()
+        self.assertEqual(self.channel.sync_status, YouTubeChannel.SyncStatus.IDLE)
+        self.assertIsNotNone(self.channel.last_updated)
+
+    @patch('youtube.tasks.update_all_videos')
+    @patch('youtube.tasks.fetch_and_save_analytics_data', side_effect=RuntimeError('boom'))
+    def test_sync_channel_task_marks_failure(self, mock_fetch, mock_update):
+        """Проверка, что ошибка синхронизации сохраняется в статусе канала."""
+        with self.assertRaises(RuntimeError):
+            sync_channel(self.channel.pk)
+
+        self.channel.refresh_from_db()
+        self.assertEqual(self.channel.sync_status, YouTubeChannel.SyncStatus.FAILED)
+        self.assertEqual(self.channel.sync_error, 'boom')
+        self.assertIsNone(self.channel.last_updated)
+
+    @patch('youtube.tasks.sync_channel.delay')
+    def test_sync_stale_channels_only_queues_stale(self, mock_delay):
+        """Проверка, что периодическая задача ставит в очередь только устаревшие каналы."""
+        YouTubeChannel.objects.create(
+            user=self.user,
+            channel_id='UC_fresh_channel_id',
+            title='Fresh Channel',
+            last_updated=timezone.now(),
+        )
+
+        self.assertEqual(sync_stale_channels(), 1)
+        mock_delay.assert_called_once_with(self.channel.pk)
+
+    def test_sync_status_api_view(self):
+        """Проверка, что эндпоинт статуса синхронизации возвращает состояние канала."""
+        self.client.force_login(self.user)
+        response = self.client.get(reverse('sync_status'), {'channel_id': self.channel.channel_id})
+
+        self.assertEqual(response.status_code, 200)
+        data = response.json()
+        self.assertEqual(data['status'], YouTubeChannel.SyncStatus.IDLE)
+        self.assertTrue(data['is_stale'])
+        self.assertIsNone(data['last_updated'])
+
+    def test_sync_status_api_view_no_channel(self):
+        """Проверка, что эндпоинт статуса возвращает 404 без канала."""
+        other_user = CustomUser.objects.create_user(email='other@example.com', password='password')
+        self.client.force_login(other_user)
+        response = self.client.get(reverse('sync_status'))
+        self.assertEqual(response.status_code, 404)
+
+
+class UpdateAllVideosTests(TestCase):
+    def setUp(self):
+        self.user = CustomUser.objects.create_user(email='videos@example.com', password='testpassword')
+        self.channel = YouTubeChannel.objects.create(
+            user=self.user,
+            channel_id='UC_videos_channel_id',
+            title='Videos Channel'
+        )
+
+    def make_service(self, pages):
+        service = MagicMock()
+        service.channels.return_value.list.return_value.execute.return_value = {
+            'items': [{
+                'id': 'UC_videos_channel_id',
+                'contentDetails': {'relatedPlaylists': {'uploads': 'UU_videos_channel_id'}},
+            }]
+        }
+        service.playlistItems.return_value.list.return_value.execute.side_effect = [
+            {
+                'items': [{'contentDetails': {'videoId': video_id}} for video_id in page],
+                **({'nextPageToken': f'page_{i + 1}'} if i + 1 < len(pages) else {}),
+            }
+            for i, page in enumerate(pages)
+        ]
+
+        def videos_list(part, id, maxResults):
+            request = MagicMock()
+            request.execute.return_value = {
+                'items': [
+                    {
+                        'id': video_id,
+                        'snippet': {'title': f'Video {video_id}', 'publishedAt': '2025-08-01T00:00:00Z'},
+                        'statistics': {'viewCount': '10', 'likeCount': '2', 'commentCount': '1'},
+                    }
+                    for video_id in id.split(',')
+                ]
+            }
+            return request
+
+        service.videos.return_value.list.side_effect = videos_list
+        return service
+
+    @patch('youtube.services.get_youtube_service')
+    def test_walks_uploads_playlist_with_batched_statistics(self, mock_get_service):
+        """Проверка, что видео обходятся постранично, а статистика запрашивается пачками по 50."""
+        pages = [[f'vid_{i}' for i in range(50)], [f'vid_{i}' for i in range(50, 70)]]
+        service = self.make_service(pages)
+        mock_get_service.return_value = service
+
+        usage = update_all_videos(MagicMock(), channel_id='UC_videos_channel_id')
+
+        self.assertEqual(YouTubeVideo.objects.filter(channel=self.channel).count(), 70)
+        self.assertEqual(service.videos.return_value.list.call_count, 2)
+        service.search.assert_not_called()
+        # channels.list + 2 x playlistItems.list + 2 x videos.list
+        self.assertEqual(usage.total_calls, 5)
+        self.assertEqual(usage.quota_units, 5)
+
+    @patch('youtube.services.get_youtube_service')
+    def test_max_pages_limits_walk(self, mock_get_service):
+        """Проверка, что max_pages ограничивает число страниц плейлиста."""
+        pages = [[f'vid_{i}'] for i in range(3)]
+        service = self.make_service(pages)
+        mock_get_service.return_value = service
+
+        usage = update_all_videos(MagicMock(), channel_id='UC_videos_channel_id', max_pages=1)
+
+        self.assertEqual(YouTubeVideo.objects.filter(channel=self.channel).count(), 1)
+        self.assertEqual(usage.calls['playlistItems.list'], 1)
+
+    @patch('youtube.services.get_youtube_service')
+    def test_sync_writes_daily_snapshot(self, mock_get_service):
+        """Проверка, что синхронизация видео пишет дневной снимок счётчиков."""
+        mock_get_service.return_value = self.make_service([['vid_0', 'vid_1']])
+
+        update_all_videos(MagicMock(), channel_id='UC_videos_channel_id')
+
+        snapshot = YouTubeVideoDailyStats.objects.get(video__video_id='vid_0')
+        self.assertEqual((snapshot.date, snapshot.views, snapshot.likes), (timezone.localdate(), 10, 2))
+        self.assertIsNone(snapshot.views_delta)
+        self.assertEqual(YouTubeVideoDailyStats.objects.count(), 2)
+
+    @patch('youtube.tasks.fetch_and_save_analytics_data')
+    @patch('youtube.services.get_youtube_service')
+    def test_failed_page_fails_sync(self, mock_get_service, mock_fetch):
+        """Проверка, что сбой videos.list посреди обхода помечает синхронизацию FAILED, а не IDLE."""
+        service = self.make_service([['vid_0'], ['vid_1'], ['vid_2']])
+        videos_list = service.videos.return_value.list.side_effect
+
+        def failing_videos_list(part, id, maxResults):
+            if id == 'vid_1':
+                raise HttpError(HttpResponse({'status': 400}), b'{}')
+            return videos_list(part, id, maxResults)
+
+        service.videos.return_value.list.side_effect = failing_videos_list
+        mock_get_service.return_value = service
+        self.channel.credentials = GoogleCredentials.objects.create(
+            user=self.user,
+            access_token='token',
+            token_expiry=timezone.now() + timedelta(hours=1),
+            scopes=' '.join(settings.YOUTUBE_SCOPES),
+        )
+        self.channel.save(update_fields=['credentials'])
+
+        with self.assertRaises(HttpError):
+            sync_channel(self.channel.pk)
+
+        self.channel.refresh_from_db()
+        self.assertEqual(self.channel.sync_status, YouTubeChannel.SyncStatus.FAILED)
+        self.assertIsNone(self.channel.last_updated)
+        self.assertEqual(list(YouTubeVideo.objects.values_list('video_id', flat=True)), ['vid_0'])
+
+
+class VideoSnapshotTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.client = Client()
+        self.user = CustomUser.objects.create_user(email='snapshots@example.com', password='testpassword')
+        self.channel = YouTubeChannel.objects.create(
+            user=self.user,
+            channel_id='UC_snapshot_channel_id',
+            title='Snapshot Channel'
+        )
+        self.video = YouTubeVideo.objects.create(
+            channel=self.channel,
+            video_id='vid_snapshot',
+            title='Snapshot Video',
+            published_at=timezone.now(),
+        )
+
+    def item(self, views, likes=0, comments=0):
+        return {
+            'id': 'vid_snapshot',
+            'statistics': {'viewCount': str(views), 'likeCount': str(likes), 'commentCount': str(comments)},
+        }
+
+    def test_deltas_against_previous_snapshot(self):
+        """Проверка, что прирост считается от последнего предыдущего снимка, даже через пропуск."""
+        save_video_snapshots(self.channel, [self.item(100, 10)], date(2025, 1, 1))
+        save_video_snapshots(self.channel, [self.item(150, 12)], date(2025, 1, 4))
+
+        latest = YouTubeVideoDailyStats.objects.get(video=self.video, date=date(2025, 1, 4))
+        self.assertEqual((latest.views_delta, latest.likes_delta, latest.comments_delta), (50, 2, 0))
+
+    def test_same_day_rerun_updates_snapshot(self):
+        """Проверка, что повторный запуск за день перезаписывает снимок, а не добавляет строку."""
+        save_video_snapshots(self.channel, [self.item(100)], date(2025, 1, 1))
+        save_video_snapshots(self.channel, [self.item(120)], date(2025, 1, 2))
+        save_video_snapshots(self.channel, [self.item(130)], date(2025, 1, 2))
+
+        snapshots = YouTubeVideoDailyStats.objects.filter(video=self.video)
+        self.assertEqual(snapshots.count(), 2)
+        self.assertEqual(snapshots.get(date=date(2025, 1, 2)).views_delta, 30)
+
+    def test_timeseries_endpoint(self):
+        """Проверка ряда одного видео и того, что чужое видео недоступно."""
+        save_video_snapshots(self.channel, [self.item(100)], date(2025, 1, 1))
+        save_video_snapshots(self.channel, [self.item(140)], date(2025, 1, 2))
+        self.client.force_login(self.user)
+
+        response = self.client.get(
+            reverse('video_timeseries', args=['vid_snapshot']),
+            {'date_from': '2025-01-01', 'date_to': '2025-01-31'}
+        )
+
+        data = response.json()
+        self.assertEqual(data['dates'], ['2025-01-01', '2025-01-02'])
+        self.assertEqual(data['views'], [100, 140])
+        self.assertEqual(data['views_delta'], [None, 40])
+
+        other = CustomUser.objects.create_user(email='intruder@example.com', password='testpassword')
+        self.client.force_login(other)
+        response = self.client.get(reverse('video_timeseries', args=['vid_snapshot']))
+        self.assertEqual(response.status_code, 404)
+
+
+class BulkUpsertTests(TestCase):
+    def setUp(self):
+        self.user = CustomUser.objects.create_user(email='bulk@example.com', password='testpassword')
+        self.channel = YouTubeChannel.objects.create(
+            user=self.user,
+            channel_id='UC_bulk_channel_id',
+            title='Bulk Channel'
+        )
+
+    def daily_rows(self, days, views=100):
+        start = date(2022, 1, 1)
+        return [
+            [(start + timedelta(days=i)).isoformat(), views + i, 5, 1]
+            for i in range(days)
+        ]
+
+    def test_backfill_uses_constant_number_of_queries(self):
+        """Проверка, что многолетняя загрузка укладывается в несколько запросов."""
+        rows = self.daily_rows(3 * 365)
+        # На Postgres это SELECT + INSERT на пачку плюс GROUP BY и upsert на каждую гранулярность
+        # агрегатов; SQLite дополнительно дробит INSERT по лимиту параметров
+        with CaptureQueriesContext(connection) as queries:
+            written = save_daily_stats(self.channel, rows)
+
+        self.assertLess(len(queries), 30)
+        self.assertEqual(written, 3 * 365)
+        self.assertEqual(YoutubeDailyStats.objects.filter(channel=self.channel).count(), 3 * 365)
+
+    def test_unchanged_rows_are_skipped(self):
+        """Проверка, что строки без изменений не перезаписываются, а изменённые обновляются."""
+        rows = self.daily_rows(10)
+        save_daily_stats(self.channel, rows)
+
+        self.assertEqual(save_daily_stats(self.channel, rows), 0)
+
+        rows[3][1] = 999
+        self.assertEqual(save_daily_stats(self.channel, rows), 1)
+        self.assertEqual(
+            YoutubeDailyStats.objects.get(channel=self.channel, date=rows[3][0]).views,
+            999
+        )
+
+    def test_demographics_are_replaced(self):
+        """Проверка, что демография обновляется, а исчезнувшие группы удаляются."""
+        save_demographics(self.channel, [['age18-24', 'female', 40.0], ['age25-34', 'male', 60.0]])
+        save_demographics(self.channel, [['age18-24', 'female', 55.0], ['age35-44', 'male', 45.0]])
+
+        demographics = {
+            (d.age_group, d.gender): d.viewer_percentage
+            for d in YoutubeAudienceDemographics.objects.filter(channel=self.channel)
+        }
+        self.assertEqual(demographics, {('age18-24', 'female'): 55.0, ('age35-44', 'male'): 45.0})
+
+    def test_videos_upsert_parses_api_strings(self):
+        """Проверка, что строковые значения из API не вызывают лишних перезаписей."""
+        items = [
+            {
+                'id': 'bulk_video',
+                'snippet': {'title': 'Bulk Video', 'publishedAt': '2025-08-01T00:00:00Z'},
+                'statistics': {'viewCount': '10', 'likeCount': '2', 'commentCount': '1'},
+            }
+        ]
+        self.assertEqual(save_videos(self.channel, items), 1)
+        self.assertEqual(save_videos(self.channel, items), 0)
+        self.assertEqual(YouTubeVideo.objects.get(video_id='bulk_video').views, 10)
+
+
+class ServiceFactoryTests(TestCase):
+    def setUp(self):
+        clear_service_cache()
+        cache.clear()
+        self.creds_obj = MagicMock(pk=1, access_token='token_a', token_expiry=timezone.now() + timedelta(hours=1))
+
+    @patch('youtube.clients.build_credentials')
+    @patch('youtube.clients.build_from_document')
+    def test_client_is_reused_for_same_credentials(self, mock_build, mock_credentials):
+        """Проверка, что клиент строится один раз для одних и тех же учётных данных."""
+        first = get_service('youtube', 'v3', self.creds_obj)
+        second = get_service('youtube', 'v3', self.creds_obj)
+
+        self.assertIs(first, second)
+        mock_build.assert_called_once()
+        mock_credentials.assert_called_once_with(self.creds_obj)
+
+    @patch('youtube.clients.build_credentials')
+    @patch('youtube.clients.build_from_document', side_effect=lambda *args, **kwargs: MagicMock())
+    def test_new_token_builds_new_client(self, mock_build, mock_credentials):
+        """Проверка, что смена токена или API даёт отдельный клиент."""
+        first = get_service('youtube', 'v3', self.creds_obj)
+        analytics = get_service('youtubeAnalytics', 'v2', self.creds_obj)
+        self.creds_obj.access_token = 'token_b'
+        second = get_service('youtube', 'v3', self.creds_obj)
+
+        self.assertIsNot(first, analytics)
+        self.assertIsNot(first, second)
+        self.assertEqual(mock_build.call_count, 3)
+
+    @patch('youtube.clients.build_credentials')
+    @patch('youtube.clients.build_from_document', side_effect=lambda *args, **kwargs: MagicMock())
+    def test_clients_are_not_shared_between_threads(self, mock_build, mock_credentials):
+        """Проверка, что каждый поток получает свой клиент (httplib2 не потокобезопасен)."""
+        clients = []
+        thread = threading.Thread(target=lambda: clients.append(get_service('youtube', 'v3', self.creds_obj)))
+        thread.start()
+        thread.join()
+
+        self.assertIsNot(clients[0], get_service('youtube', 'v3', self.creds_obj))
+
+    @patch('youtube.clients.build_credentials')
+    @patch('youtube.clients.build_from_document', side_effect=lambda *args, **kwargs: MagicMock())
+    def test_clients_share_thread_connection_pool(self, mock_build, mock_credentials):
+        """Проверка, что клиенты разных API в одном потоке работают через общий httplib2.Http."""
+        get_service('youtube', 'v3', self.creds_obj)
+        get_service('youtubeAnalytics', 'v2', self.creds_obj)
+
+        first, second = (call.kwargs['http'].http for call in mock_build.call_args_list)
+        self.assertIs(first, second)
+        self.assertIs(first, get_httplib2())
+
+    def test_session_does_not_retry_token_refresh_post(self):
+        """Проверка, что общая сессия повторяет GET, но не POST обновления токена после ошибки чтения."""
+        retry = get_session().get_adapter('https://oauth2.googleapis.com/token').max_retries
+
+        self.assertTrue(retry.is_retry('GET', 503))
+        self.assertFalse(retry.is_retry('POST', 503))
+        self.assertFalse(retry._is_method_retryable('POST'))
+
+    def test_discovery_document_is_parsed_once(self):
+        """Проверка, что статический discovery-документ разбирается один раз."""
+        first = get_discovery_document('youtubeAnalytics', 'v2')
+        second = get_discovery_document('youtubeAnalytics', 'v2')
+
+        self.assertIs(first, second)
+        self.assertIn('rootUrl', first)
+
+
+class ResponseCacheTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.client = Client()
+        self.user = CustomUser.objects.create_user(email='cache@example.com', password='testpassword')
+        GoogleCredentials.objects.create(
+            user=self.user,
+            access_token='fake_access_token',
+            refresh_token='fake_refresh_token',
+            token_expiry=timezone.now() + timedelta(hours=1),
+            scopes=' '.join(settings.YOUTUBE_SCOPES),
+            client_id=settings.YOUTUBE_CLIENT_ID,
+            client_secret=settings.YOUTUBE_CLIENT_SECRET,
+            token_uri="https://oauth2.googleapis.com/token",
+        )
+        self.channel = YouTubeChannel.objects.create(
+            user=self.user,
+            channel_id='UC_cache_channel_id',
+            title='Cache Channel'
+        )
+        self.today = date.today()
+        YoutubeDailyStats.objects.create(channel=self.channel, date=self.today, views=100)
+        self.client.force_login(self.user)
+        self.params = {'channel_id': self.channel.channel_id}
+
+    def test_trends_response_has_validators_and_returns_304(self):
+        """Проверка, что ответ содержит ETag и Last-Modified, а повторный условный запрос получает 304."""
+        response = self.client.get(reverse('channel_trends'), self.params)
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('ETag', response)
+        self.assertIn('Last-Modified', response)
+
+        response = self.client.get(
+            reverse('channel_trends'), self.params, HTTP_IF_NONE_MATCH=response['ETag']
+        )
+        self.assertEqual(response.status_code, 304)
+
+    def test_cached_response_is_invalidated_by_ingestion(self):
+        """Проверка, что ответ берётся из кэша до записи новых данных и обновляется после неё."""
+        first = self.client.get(reverse('channel_trends'), self.params)
+        self.assertEqual(first.json()['views'], [100])
+
+        # Прямое изменение в базе в обход ингестии не видно: ответ из кэша
+        YoutubeDailyStats.objects.filter(channel=self.channel).update(views=150)
+        self.assertEqual(self.client.get(reverse('channel_trends'), self.params).json()['views'], [100])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            save_daily_stats(self.channel, [[self.today.isoformat(), 200, 0, 0]])
+
+        second = self.client.get(reverse('channel_trends'), self.params, HTTP_IF_NONE_MATCH=first['ETag'])
+        self.assertEqual(second.status_code, 200)
+        self.assertEqual(second.json()['views'], [200])
+
+    def test_cache_is_scoped_by_date_range(self):
+        """Проверка, что разные диапазоны дат кэшируются отдельно."""
+        yesterday = self.today - timedelta(days=1)
+        YoutubeDailyStats.objects.create(channel=self.channel, date=yesterday, views=50)
+
+        full = self.client.get(reverse('channel_trends'), self.params)
+        narrow = self.client.get(
+            reverse('channel_trends'), {**self.params, 'date_from': self.today.isoformat()}
+        )
+
+        self.assertEqual(full.json()['views'], [50, 100])
+        self.assertEqual(narrow.json()['views'], [100])
+        self.assertNotEqual(full['ETag'], narrow['ETag'])
+
+    def test_unchanged_ingestion_keeps_cache(self):
+        """Проверка, что запись без изменений не сбрасывает кэш."""
+        first = self.client.get(reverse('audience_demographics'), self.params)
+        with self.captureOnCommitCallbacks(execute=True):
+            save_daily_stats(self.channel, [[self.today.isoformat(), 100, 0, 0]])
+        second = self.client.get(reverse('audience_demographics'), self.params)
+
+        self.assertEqual(first['ETag'], second['ETag'])
+
+
+class ViewerActivityStorageTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = CustomUser.objects.create_user(email='activity@example.com', password='testpassword')
+        self.channel = YouTubeChannel.objects.create(
+            user=self.user,
+            channel_id='UC_activity_channel_id',
+            title='Activity Channel'
+        )
+        self.end = date.today() - timedelta(days=10)
+        self.start = self.end - timedelta(days=4)
+
+    def make_analytics(self):
+        analytics = MagicMock()
+
+        def query(ids, startDate, endDate, metrics, dimensions):
+            start = date.fromisoformat(startDate)
+            days = [(start + timedelta(days=i)).isoformat() for i in range((date.fromisoformat(endDate) - start).days + 1)]
+            request = MagicMock()
+            if dimensions == 'day,deviceType':
+                rows = [[day, 'MOBILE', 10] for day in days] + [[day, 'DESKTOP', 5] for day in days]
+            else:
+                rows = [[day, 'SUBSCRIBED', 3] for day in days]
+            request.execute.return_value = {'rows': rows}
+            return request
+
+        analytics.reports.return_value.query.side_effect = query
+        return analytics
+
+    def fetch(self, start=None, end=None):
+        return fetch_viewer_activity(
+            MagicMock(), self.channel.channel_id, (start or self.start).isoformat(), (end or self.end).isoformat()
+        )
+
+    @patch('youtube.services.get_youtube_analytics_service')
+    def test_activity_is_stored_and_read_from_database(self, mock_get_service):
+        """Проверка, что после первой загрузки данные читаются из базы без вызовов API."""
+        analytics = self.make_analytics()
+        mock_get_service.return_value = analytics
+
+        first = self.fetch()
+        second = self.fetch()
+
+        self.assertEqual(first, second)
+        self.assertEqual(first['device_type'], [['MOBILE', 50], ['DESKTOP', 25]])
+        self.assertEqual(first['subscribed_status'], [['SUBSCRIBED', 15]])
+        self.assertEqual(YoutubeViewerActivity.objects.filter(channel=self.channel).count(), 5)
+        self.assertEqual(analytics.reports.return_value.query.call_count, 2)
+
+    @patch('youtube.services.get_youtube_analytics_service')
+    def test_only_missing_days_are_fetched(self, mock_get_service):
+        """Проверка, что из API запрашивается только недостающий поддиапазон."""
+        analytics = self.make_analytics()
+        mock_get_service.return_value = analytics
+        self.fetch()
+        analytics.reports.return_value.query.reset_mock()
+
+        self.fetch(end=self.end + timedelta(days=2))
+
+        for call in analytics.reports.return_value.query.call_args_list:
+            self.assertEqual(call.kwargs['startDate'], (self.end + timedelta(days=1)).isoformat())
+            self.assertEqual(call.kwargs['endDate'], (self.end + timedelta(days=2)).isoformat())
+        self.assertEqual(analytics.reports.return_value.query.call_count, 2)
+
+    @patch('youtube.services.get_youtube_analytics_service')
+    def test_unsettled_days_are_refetched(self, mock_get_service):
+        """Проверка, что последние дни, которые YouTube ещё пересчитывает, загружаются повторно."""
+        analytics = self.make_analytics()
+        mock_get_service.return_value = analytics
+        recent_start = date.today() - timedelta(days=1)
+
+        self.fetch(start=recent_start, end=date.today())
+        self.fetch(start=recent_start, end=date.today())
+
+        self.assertEqual(analytics.reports.return_value.query.call_count, 4)
+
+    @patch('youtube.services.get_youtube_analytics_service')
+    def test_busy_lock_skips_fetch(self, mock_get_service):
+        """Проверка, что без блокировки канала данные не запрашиваются повторно, а читаются из базы."""
+        analytics = self.make_analytics()
+        mock_get_service.return_value = analytics
+        cache.add(f'lock:viewer_activity:{self.channel.pk}', 'other', timeout=60)
+
+        # Каждое обращение к часам сдвигает время на 100 с: ожидание блокировки сразу истекает
+        with patch('youtube.singleflight.time.monotonic', side_effect=itertools.count(0, 100)):
+            result = self.fetch()
+
+        analytics.reports.return_value.query.assert_not_called()
+        self.assertEqual(result, {'device_type': [], 'subscribed_status': []})
+        self.assertEqual(cache.get(f'lock:viewer_activity:{self.channel.pk}'), 'other')
+
+    @patch('youtube.services.get_youtube_analytics_service')
+    def test_lock_outlives_slow_fetch(self, mock_get_service):
+        """Проверка, что блокировка берётся на время, достаточное для всех отчётов с повторами."""
+        mock_get_service.return_value = self.make_analytics()
+
+        with patch('youtube.services.cache_lock', wraps=cache_lock) as lock:
+            self.fetch()
+
+        self.assertGreater(lock.call_args.kwargs['timeout'], 60)
+
+    def test_unknown_channel_returns_empty(self):
+        """Проверка, что для неизвестного канала возвращаются пустые данные."""
+        result = fetch_viewer_activity(MagicMock(), 'UC_unknown', self.start.isoformat(), self.end.isoformat())
+        self.assertEqual(result, {'device_type': [], 'subscribed_status': []})
+
+
+class SingleFlightTests(TestCase):
+    def test_concurrent_calls_are_collapsed(self):
+        """Проверка, что одновременные вызовы с одним ключом выполняют функцию один раз."""
+        flight = SingleFlight()
+        started = threading.Event()
+        release = threading.Event()
+        calls = []
+
+        def slow():
+            calls.append(1)
+            started.set()
+            release.wait(5)
+            return 'result'
+
+        results = []
+        leader = threading.Thread(target=lambda: results.append(flight.do('key', slow)))
+        leader.start()
+        started.wait(5)
+        followers = [threading.Thread(target=lambda: results.append(flight.do('key', slow))) for _ in range(3)]
+        for follower in followers:
+            follower.start()
+        # Даём ведомым потокам дойти до ожидания результата
+        time.sleep(0.2)
+        release.set()
+        for thread in [leader, *followers]:
+            thread.join(5)
+
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(results, ['result'] * 4)
+
+    def test_error_is_shared_and_key_is_released(self):
+        """Проверка, что после ошибки ключ освобождается и следующий вызов выполняется заново."""
+        flight = SingleFlight()
+
+        def fail():
+            raise RuntimeError('boom')
+
+        with self.assertRaises(RuntimeError):
+            flight.do('key', fail)
+        self.assertEqual(flight.do('key', lambda: 'ok'), 'ok')
+
+
+    def test_cache_lock_keeps_lock_taken_by_new_owner(self):
+        """Проверка, что владелец истёкшей блокировки не снимает блокировку следующего владельца."""
+        with cache_lock('key', timeout=60) as acquired:
+            self.assertTrue(acquired)
+            # Блокировка истекла, её взял другой процесс
+            cache.set('lock:key', 'other', timeout=60)
+        self.assertEqual(cache.get('lock:key'), 'other')
+
+        cache.delete('lock:key')
+        with cache_lock('key') as acquired:
+            self.assertTrue(acquired)
+        self.assertIsNone(cache.get('lock:key'))
+
+class AnalyticsFanOutTests(TestCase):
+    def setUp(self):
+        self.user = CustomUser.objects.create_user(email='fanout@example.com', password='testpassword')
+        self.channel = YouTubeChannel.objects.create(
+            user=self.user,
+            channel_id='UC_fanout_channel_id',
+            title='Fan-out Channel'
+        )
+
+    def make_analytics(self, responses, barrier=None):
+        analytics = MagicMock()
+
+        def query(**kwargs):
+            request = MagicMock()
+
+            def execute():
+                if barrier:
+                    barrier.wait()
+                response = responses[kwargs['dimensions']]
+                if isinstance(response, Exception):
+                    raise response
+                return response
+
+            request.execute.side_effect = execute
+            return request
+
+        analytics.reports.return_value.query.side_effect = query
+        return analytics
+
+    @patch('youtube.services.get_youtube_analytics_service')
+    def test_reports_run_concurrently(self, mock_get_service):
+        """Проверка, что независимые запросы выполняются одновременно, а не по очереди."""
+        # Барьер пропустит потоки, только если оба запроса ждут на нём одновременно
+        barrier = threading.Barrier(2, timeout=5)
+        mock_get_service.return_value = self.make_analytics({'day': {'rows': []}, 'ageGroup,gender': {'rows': []}}, barrier)
+
+        results = execute_reports(MagicMock(), {
+            'daily_stats': {'dimensions': 'day'},
+            'demographics': {'dimensions': 'ageGroup,gender'},
+        })
+
+        self.assertEqual(results, {'daily_stats': {'rows': []}, 'demographics': {'rows': []}})
+
+    @patch('youtube.services.get_youtube_analytics_service')
+    def test_failed_report_does_not_block_others(self, mock_get_service):
+        """Проверка, что ошибка одного запроса не мешает сохранить результат другого, но пробрасывается."""
+        mock_get_service.return_value = self.make_analytics({
+            'day': {'rows': [['2025-08-17', 100, 5, 1]]},
+            'ageGroup,gender': RuntimeError('demographics failed'),
+        })
+
+        with self.assertRaisesMessage(RuntimeError, 'demographics failed'):
+            fetch_and_save_analytics_data(MagicMock(), self.channel.channel_id)
+
+        self.assertEqual(YoutubeDailyStats.objects.filter(channel=self.channel).count(), 1)
+        self.assertFalse(YoutubeAudienceDemographics.objects.filter(channel=self.channel).exists())
+
+    @patch('youtube.services.get_youtube_analytics_service')
+    def test_failed_daily_stats_keeps_watermark_and_fails_sync(self, mock_get_service):
+        """Проверка, что ошибка дневной статистики не сдвигает водяной знак и отмечает синхронизацию FAILED."""
+        error = HttpError(HttpResponse({'status': 400}), b'{}')
+        mock_get_service.return_value = self.make_analytics({'day': error, 'ageGroup,gender': {'rows': []}})
+        self.channel.credentials = GoogleCredentials.objects.create(
+            user=self.channel.user,
+            access_token='fake_access_token',
+            token_expiry=timezone.now() + timedelta(hours=1),
+            scopes=' '.join(settings.YOUTUBE_SCOPES),
+        )
+        self.channel.save()
+
+        with self.assertRaises(HttpError):
+            sync_channel(self.channel.pk)
+
+        self.channel.refresh_from_db()
+        self.assertIsNone(self.channel.stats_settled_through)
+        self.assertEqual(self.channel.sync_status, YouTubeChannel.SyncStatus.FAILED)
+
+
+class IncrementalSyncTests(TestCase):
+    def setUp(self):
+        self.user = CustomUser.objects.create_user(email='watermark@example.com', password='testpassword')
+        self.channel = YouTubeChannel.objects.create(
+            user=self.user,
+            channel_id='UC_watermark_channel_id',
+            title='Watermark Channel'
+        )
+        self.queries = []
+
+    def run_sync(self, response=None):
+        def execute(creds_obj, queries, usage=None):
+            self.queries.append(queries['daily_stats'])
+            return {'daily_stats': response or {'rows': []}, 'demographics': {'rows': []}}
+
+        with patch('youtube.services.execute_reports', side_effect=execute):
+            fetch_and_save_analytics_data(MagicMock(), self.channel.channel_id)
+        self.channel.refresh_from_db()
+
+    def test_first_sync_uses_initial_window_and_sets_watermark(self):
+        """Проверка, что первая синхронизация берёт начальное окно и ставит водяной знак."""
+        self.run_sync()
+
+        today = date.today()
+        self.assertEqual(self.queries[0]['startDate'], (today - timedelta(days=settings.YOUTUBE_INITIAL_SYNC_DAYS)).isoformat())
+        self.assertEqual(
+            self.channel.stats_settled_through,
+            today - timedelta(days=settings.YOUTUBE_ANALYTICS_SETTLE_DAYS)
+        )
+
+    def test_routine_sync_requests_only_days_after_watermark(self):
+        """Проверка, что следующая синхронизация запрашивает только окно пересматриваемых дней."""
+        self.run_sync()
+        self.run_sync()
+
+        window = (date.fromisoformat(self.queries[1]['endDate']) - date.fromisoformat(self.queries[1]['startDate'])).days + 1
+        self.assertEqual(window, settings.YOUTUBE_ANALYTICS_SETTLE_DAYS)
+
+    def test_failed_fetch_keeps_watermark(self):
+        """Проверка, что ошибка загрузки пробрасывается и не сдвигает водяной знак."""
+        with self.assertRaisesMessage(RuntimeError, 'boom'):
+            self.run_sync(RuntimeError('boom'))
+
+        self.channel.refresh_from_db()
+        self.assertIsNone(self.channel.stats_settled_through)
+
+    def test_watermark_never_moves_backwards(self):
+        """Проверка, что знак не откатывается назад (например, после backfill до более поздней даты)."""
+        ahead = date.today()
+        YouTubeChannel.objects.filter(pk=self.channel.pk).update(stats_settled_through=ahead)
+        self.channel.refresh_from_db()
+
+        advance_stats_watermark(self.channel, date.today() - timedelta(days=10))
+
+        self.channel.refresh_from_db()
+        self.assertEqual(self.channel.stats_settled_through, ahead)
+
+
+@patch('youtube.tasks.sync_channel.delay')
+@patch('youtube.views.fetch_channel_identity', side_effect=AssertionError('dashboard must not call Google'))
+class DashboardPayloadTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.client = Client()
+        self.user = CustomUser.objects.create_user(email='payload@example.com', password='testpassword')
+        GoogleCredentials.objects.create(
+            user=self.user,
+            access_token='fake_access_token',
+            refresh_token='fake_refresh_token',
+            token_expiry=timezone.now() + timedelta(hours=1),
+            scopes=' '.join(settings.YOUTUBE_SCOPES),
+            client_id=settings.YOUTUBE_CLIENT_ID,
+            client_secret=settings.YOUTUBE_CLIENT_SECRET,
+            token_uri="https://oauth2.googleapis.com/token",
+        )
+        self.channel = YouTubeChannel.objects.create(
+            user=self.user,
+            channel_id='UC_payload_channel_id',
+            title='Payload Channel',
+            last_updated=timezone.now(),
+        )
+        self.today = date.today()
+        YoutubeDailyStats.objects.bulk_create([
+            YoutubeDailyStats(
+                channel=self.channel,
+                date=self.today - timedelta(days=i),
+                views=10,
+                subscribers_gained=2,
+                subscribers_lost=1
+            )
+            for i in range(60)
+        ])
+        YouTubeVideo.objects.bulk_create([
+            YouTubeVideo(
+                channel=self.channel,
+                video_id=f'payload_video_{i}',
+                title=f'Payload Video {i}',
+                published_at=timezone.now() - timedelta(days=i),
+                views=i * 10,
+                likes=1,
+                comments=1
+            )
+            for i in range(20)
+        ])
+        self.client.force_login(self.user)
+
+    def test_dashboard_renders_kpis_for_selected_range(self, mock_channel_id, mock_delay):
+        """Проверка, что KPI считаются в базе только за выбранный диапазон."""
+        response = self.client.get(reverse('youtube-dashboard'), {
+            'start_date': (self.today - timedelta(days=9)).isoformat(),
+            'end_date': self.today.isoformat(),
+        })
+
+        kpis = response.context['kpis']
+        self.assertEqual(kpis['views'], 100)
+        self.assertEqual(kpis['subscribers_net'], 10)
+        self.assertEqual(kpis['video_count'], 20)
+
+    def test_dashboard_embeds_only_top_videos(self, mock_channel_id, mock_delay):
+        """Проверка, что в страницу попадают только топ-5 видео, а не все строки."""
+        response = self.client.get(reverse('youtube-dashboard'))
+
+        top_videos = response.context['top_videos']
+        self.assertEqual([video['video_id'] for video in top_videos], [f'payload_video_{i}' for i in range(19, 14, -1)])
+        self.assertNotIn('video_stats', response.context['dashboard_data'])
+        self.assertNotIn('subscriber_trends', response.context['dashboard_data'])
+        self.assertNotContains(response, 'payload_video_0')
+
+    def test_dashboard_query_count_does_not_grow_with_data(self, mock_channel_id, mock_delay):
+        """Проверка, что число запросов дашборда не зависит от числа видео и дней."""
+        with CaptureQueriesContext(connection) as small:
+            self.client.get(reverse('youtube-dashboard'))
+
+        YouTubeVideo.objects.bulk_create([
+            YouTubeVideo(
+                channel=self.channel,
+                video_id=f'extra_video_{i}',
+                title=f'Extra Video {i}',
+                published_at=timezone.now(),
+            )
+            for i in range(200)
+        ])
+        with CaptureQueriesContext(connection) as large:
+            self.client.get(reverse('youtube-dashboard'))
+
+        self.assertEqual(len(small), len(large))
+
+    def test_trend_endpoints_are_gzip_compressed(self, mock_channel_id, mock_delay):
+        """Проверка, что JSON эндпоинтов графиков сжимается, если клиент это поддерживает."""
+        response = self.client.get(
+            reverse('channel_trends'),
+            {'channel_id': self.channel.channel_id, 'date_from': (self.today - timedelta(days=59)).isoformat()},
+            HTTP_ACCEPT_ENCODING='gzip',
+        )
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+
+    def test_video_trends_limit_and_sort(self, mock_channel_id, mock_delay):
+        """Проверка, что video_trends поддерживает limit и отклоняет неизвестную сортировку."""
+        response = self.client.get(reverse('video_trends'), {
+            'date_from': (self.today - timedelta(days=30)).isoformat(),
+            'limit': 3,
+        })
+        self.assertEqual([video['views'] for video in response.json()['videos']], [190, 180, 170])
+
+        response = self.client.get(reverse('video_trends'), {'sort_by': 'channel__user__password'})
+        self.assertEqual(response.status_code, 400)
+
+
+class StatsRollupTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.client = Client()
+        self.user = CustomUser.objects.create_user(email='rollups@example.com', password='testpassword')
+        GoogleCredentials.objects.create(
+            user=self.user,
+            access_token='fake_access_token',
+            refresh_token='fake_refresh_token',
+            token_expiry=timezone.now() + timedelta(hours=1),
+            scopes=' '.join(settings.YOUTUBE_SCOPES),
+            client_id=settings.YOUTUBE_CLIENT_ID,
+            client_secret=settings.YOUTUBE_CLIENT_SECRET,
+            token_uri="https://oauth2.googleapis.com/token",
+        )
+        self.channel = YouTubeChannel.objects.create(
+            user=self.user,
+            channel_id='UC_rollup_channel_id',
+            title='Rollup Channel'
+        )
+        # 2024-01-01 — понедельник, 60 дней ровно покрывают январь и високосный февраль
+        self.start = date(2024, 1, 1)
+        self.rows = [[(self.start + timedelta(days=i)).isoformat(), 10, 2, 1] for i in range(60)]
+
+    def rollup(self, granularity, period):
+        return YoutubeStatsRollup.objects.get(channel=self.channel, granularity=granularity, period_start=period)
+
+    def test_rollups_are_built_on_ingestion(self):
+        """Проверка, что запись дневной статистики обновляет недельные и месячные агрегаты."""
+        save_daily_stats(self.channel, self.rows)
+
+        january = self.rollup('month', date(2024, 1, 1))
+        self.assertEqual((january.days, january.views, january.subscribers_gained), (31, 310, 62))
+        self.assertEqual(self.rollup('month', date(2024, 2, 1)).days, 29)
+        self.assertEqual(self.rollup('week', date(2024, 1, 8)).views, 70)
+
+    def test_revised_day_updates_only_its_periods(self):
+        """Проверка, что пересмотр одного дня пересчитывает его неделю и месяц."""
+        save_daily_stats(self.channel, self.rows)
+
+        save_daily_stats(self.channel, [['2024-01-10', 110, 2, 1]])
+
+        self.assertEqual(self.rollup('week', date(2024, 1, 8)).views, 170)
+        self.assertEqual(self.rollup('month', date(2024, 1, 1)).views, 410)
+        self.assertEqual(self.rollup('month', date(2024, 2, 1)).views, 290)
+
+    def test_channel_trends_reads_rollups(self):
+        """Проверка, что channel_trends с granularity=month отдаёт несколько агрегированных точек."""
+        save_daily_stats(self.channel, self.rows)
+        self.client.force_login(self.user)
+
+        response = self.client.get(reverse('channel_trends'), {
+            'channel_id': self.channel.channel_id,
+            'date_from': '2024-01-15',
+            'date_to': '2024-02-29',
+            'granularity': 'month',
+        })
+
+        data = response.json()
+        self.assertEqual(data['granularity'], 'month')
+        self.assertEqual(data['dates'], ['2024-01-01', '2024-02-01'])
+        self.assertEqual(data['views'], [310, 290])
+
+    def test_channel_trends_rejects_unknown_granularity(self):
+        """Проверка, что неизвестная гранулярность возвращает 400."""
+        self.client.force_login(self.user)
+        response = self.client.get(reverse('channel_trends'), {'granularity': 'year'})
+        self.assertEqual(response.status_code, 400)
+
+    def test_rebuild_command(self):
+        """Проверка, что команда пересчитывает агрегаты для уже загруженных данных."""
+        YoutubeDailyStats.objects.bulk_create([
+            YoutubeDailyStats(channel=self.channel, date=date.fromisoformat(day), views=views)
+            for day, views, _, _ in self.rows
+        ])
+        self.assertEqual(YoutubeStatsRollup.objects.count(), 0)
+
+        call_command('rebuild_youtube_rollups', channels=[self.channel.channel_id], stdout=MagicMock())
+
+        self.assertEqual(self.rollup('month', date(2024, 2, 1)).views, 290)
+        self.assertEqual(rebuild_rollups(self.channel), 0)
+
+
+@override_settings(YOUTUBE_VIDEO_SERIES_STORAGE='packed')
+class VideoSeriesTests(VideoSnapshotTests):
+    """Те же проверки снимков видео на хранилище 'packed' и совпадение его с хранилищем 'rows'."""
+
+    def stored(self, day):
+        return read_packed(self.video.pk, day, day)
+
+    def test_deltas_against_previous_snapshot(self):
+        """Проверка, что прирост считается от последнего предыдущего снимка, даже через пропуск."""
+        save_video_snapshots(self.channel, [self.item(100, 10)], date(2025, 1, 1))
+        save_video_snapshots(self.channel, [self.item(150, 12)], date(2025, 1, 4))
+
+        latest = self.stored(date(2025, 1, 4))
+        self.assertEqual((latest['views_delta'], latest['likes_delta'], latest['comments_delta']), ([50], [2], [0]))
+        self.assertFalse(YouTubeVideoDailyStats.objects.exists())
+
+    def test_same_day_rerun_updates_snapshot(self):
+        """Проверка, что день дописывается в конец ряда, а повтор за день перезаписывает свою строку."""
+        save_video_snapshots(self.channel, [self.item(100)], date(2025, 1, 1))
+        save_video_snapshots(self.channel, [self.item(120)], date(2025, 1, 2))
+        self.assertEqual(save_video_snapshots(self.channel, [self.item(130)], date(2025, 1, 2)), 1)
+        self.assertEqual(save_video_snapshots(self.channel, [self.item(130)], date(2025, 1, 2)), 0)
+
+        series = YouTubeVideoSeries.objects.get(video=self.video, year=2025)
+        self.assertEqual(series_decode(series.data).tolist(), [[100, 0, 0], [130, 0, 0]])
+        self.assertEqual(self.stored(date(2025, 1, 2))['views_delta'], [30])
+
+    def test_history_before_first_day(self):
+        """Проверка, что снимок раньше начала ряда дописывается в его начало."""
+        save_video_snapshots(self.channel, [self.item(100)], date(2025, 3, 10))
+        save_video_snapshots(self.channel, [self.item(90)], date(2025, 3, 7))
+        save_video_snapshots(self.channel, [self.item(120)], date(2025, 3, 11))
+
+        series = YouTubeVideoSeries.objects.get(video=self.video)
+        self.assertEqual(series.first_day, 65)
+        data = read_packed(self.video.pk, date(2025, 3, 1), date(2025, 3, 31))
+        self.assertEqual(data['dates'], ['2025-03-07', '2025-03-10', '2025-03-11'])
+        self.assertEqual(data['views_delta'], [None, 10, 20])
+
+    def test_packed_matches_rows(self):
+        """Проверка, что перенесённые ряды читаются так же, как строки, в том числе через границу года и пропуски."""
+        start = date(2024, 12, 20)
+        with override_settings(YOUTUBE_VIDEO_SERIES_STORAGE='rows'):
+            for offset in range(30):
+                if offset % 7 != 3:
+                    day = start + timedelta(days=offset)
+                    save_video_snapshots(self.channel, [self.item(100 + offset ** 2, offset)], day)
+
+        self.assertEqual(pack_rows(), (1, 2))
+        for date_from, date_to in [
+            (start, start + timedelta(days=40)),
+            (date(2025, 1, 1), date(2025, 1, 10)),
+            (date(2024, 12, 24), date(2024, 12, 24)),
+            (date(2025, 3, 1), date(2025, 3, 31)),
+        ]:
+            self.assertEqual(
+                read_packed(self.video.pk, date_from, date_to), read_rows(self.video.pk, date_from, date_to),
+                (date_from, date_to)
+            )
+
+    def test_packed_export_matches_rows(self):
+        """Проверка, что выгрузка video_daily из рядов совпадает с выгрузкой из строк."""
+        with override_settings(YOUTUBE_VIDEO_SERIES_STORAGE='rows'):
+            for day, views in [(date(2024, 12, 30), 10), (date(2025, 1, 2), 25), (date(2025, 1, 3), 40)]:
+                save_video_snapshots(self.channel, [self.item(views)], day)
+            expected = list(exports.export_queryset('video_daily', user=self.user, date_from=date(2025, 1, 1)))
+        pack_rows(delete_rows=True)
+
+        rows = exports.export_queryset('video_daily', user=self.user, date_from=date(2025, 1, 1))
+        self.assertEqual(list(rows.iterator(chunk_size=100)), [
+            (video_id, day.isoformat(), *values) for video_id, day, *values in expected
+        ])
+        self.assertEqual(expected[0][-3:], (15, 0, 0))
+
+
+class ExportTests(TestCase):
+    def setUp(self):
+        self.client = Client()
+        self.user = CustomUser.objects.create_user(email='export@example.com', password='testpassword')
+        self.channel = YouTubeChannel.objects.create(
+            user=self.user,
+            channel_id='UC_export_channel_id',
+            title='Export Channel'
+        )
+        other_user = CustomUser.objects.create_user(email='other@example.com', password='testpassword')
+        other_channel = YouTubeChannel.objects.create(user=other_user, channel_id='UC_other', title='Other')
+
+        start = date(2024, 1, 1)
+        YoutubeDailyStats.objects.bulk_create(
+            [YoutubeDailyStats(channel=self.channel, date=start + timedelta(days=i), views=i) for i in range(25)]
+            + [YoutubeDailyStats(channel=other_channel, date=start, views=999)]
+        )
+        video = YouTubeVideo.objects.create(
+            channel=self.channel,
+            video_id='vid_export',
+            title='Title, with "quotes"',
+            published_at=timezone.now(),
+            views=10,
+        )
+        YouTubeVideoDailyStats.objects.create(video=video, date=start, views=3)
+        self.client.force_login(self.user)
+
+    def export(self, dataset, **params):
+        response = self.client.get(reverse('export_data', args=[dataset]), params)
+        self.assertTrue(response.streaming)
+        return response
+
+    def test_csv_export_streams_only_own_rows(self):
+        """Проверка, что CSV выгружает только строки каналов пользователя."""
+        response = self.export('channel_daily', date_from='2024-01-03')
+
+        self.assertEqual(response['Content-Type'], 'text/csv; charset=utf-8')
+        rows = list(csv.reader(io.StringIO(b''.join(response.streaming_content).decode())))
+        self.assertEqual(rows[0][:3], ['channel_id', 'date', 'subscribers_gained'])
+        self.assertEqual(len(rows), 1 + 23)
+        self.assertEqual(rows[1][:2], ['UC_export_channel_id', '2024-01-03'])
+
+    def test_ndjson_export(self):
+        """Проверка формата NDJSON: один JSON-объект на строку."""
+        response = self.export('videos', format='ndjson')
+
+        lines = b''.join(response.streaming_content).decode().splitlines()
+        self.assertEqual(len(lines), 1)
+        self.assertEqual(json.loads(lines[0])['title'], 'Title, with "quotes"')
+
+    async def test_asgi_export_streams_before_generator_finishes(self):
+        """Проверка, что под ASGI первый кусок выгрузки уходит до того, как генератор дошёл до конца."""
+        progress = []
+
+        def lines(*args):
+            for line in ('header\n', 'row\n'):
+                progress.append(line)
+                yield line
+            progress.append('done')
+
+        await self.async_client.aforce_login(self.user)
+        for params, content_type in (({}, 'text/csv; charset=utf-8'), ({'gzip': '1'}, 'application/gzip')):
+            with self.subTest(**params), patch('youtube.views.stream_export', side_effect=lines):
+                progress.clear()
+                response = await self.async_client.get(reverse('export_data', args=['channel_daily']), params)
+                self.assertEqual(response['Content-Type'], content_type)
+                self.assertTrue(response.is_async)
+                content = aiter(response.streaming_content)
+
+                first = [await anext(content)]
+                self.assertNotIn('done', progress)
+                body = b''.join(first + [part async for part in content])
+
+                self.assertEqual(progress[-1], 'done')
+                self.assertEqual(gzip.decompress(body) if params else body, b'header\nrow\n')
+
+    def test_gzip_export(self):
+        """Проверка, что gzip=1 отдаёт сжатый файл с теми же строками."""
+        response = self.export('video_daily', gzip='1')
+
+        self.assertEqual(response['Content-Type'], 'application/gzip')
+        self.assertIn('video_daily.csv.gz', response['Content-Disposition'])
+        content = gzip.decompress(b''.join(response.streaming_content)).decode()
+        self.assertEqual(content.splitlines(), [
+            'video_id,date,views,likes,comments,views_delta,likes_delta,comments_delta',
+            'vid_export,2024-01-01,3,0,0,,,',
+        ])
+
+    def test_rejects_unknown_dataset_and_format(self):
+        """Проверка ответов на неизвестный набор данных и формат."""
+        self.assertEqual(self.client.get(reverse('export_data', args=['secrets'])).status_code, 404)
+        self.assertEqual(self.client.get(reverse('export_data', args=['videos']), {'format': 'xml'}).status_code, 400)
+
+    def test_export_command_reads_in_chunks(self):
+        """Проверка, что команда пишет gzip-файл и читает базу кусками chunk_size."""
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'daily.ndjson.gz')
+            with patch('youtube.exports._iter_rows', wraps=exports._iter_rows) as iter_rows:
+                call_command(
+                    'export_youtube_stats', 'channel_daily',
+                    format='ndjson', channels=[self.channel.channel_id],
+                    chunk_size=10, output=path, gzip=True, stderr=io.StringIO(),
+                )
+            with gzip.open(path, 'rt') as f:
+                lines = f.read().splitlines()
+
+        self.assertEqual(iter_rows.call_args.args[1], 10)
+        self.assertEqual(len(lines), 25)
+        self.assertEqual(json.loads(lines[-1])['views'], 24)
+
+
+def google_http_error(status, reason):
+    content = json.dumps({'error': {'code': status, 'errors': [{'reason': reason}]}}).encode()
+    return HttpError(HttpResponse({'status': status}), content)
+
+
+@override_settings(YOUTUBE_QUOTA_DAILY_BUDGET=300, YOUTUBE_QUOTA_INTERACTIVE_RESERVE=100)
+class QuotaSchedulerTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.sleep = MagicMock()
+        self.scheduler = QuotaScheduler(sleep=self.sleep)
+
+    def request(self, *results):
+        request = MagicMock()
+        request.execute.side_effect = list(results)
+        return request
+
+    def test_bucket_without_lock_gives_no_token(self):
+        """Проверка, что без блокировки bucket не выдаёт токен и не меняет своё состояние."""
+        bucket = TokenBucket('locked', rate=1, burst=5)
+        self.assertEqual(bucket.take(), 0)
+        state = cache.get(bucket.key)
+
+        @contextmanager
+        def busy_lock(*args, **kwargs):
+            yield False
+
+        with patch('youtube.quota.cache_lock', busy_lock):
+            self.assertEqual(bucket.take(), TokenBucket.LOCK_RETRY_DELAY)
+        self.assertEqual(cache.get(bucket.key), state)
+
+    def test_charges_method_cost_per_project_and_user(self):
+        """Проверка, что расход считается по стоимости метода и виден в разрезе пользователя."""
+        usage = ApiUsage(user_id=7)
+        self.scheduler.execute(self.request({}), 'search.list', usage)
+        self.scheduler.execute(self.request({}), 'videos.list', usage)
+        self.scheduler.execute(self.request({}), 'reports.query', usage)
+
+        self.assertEqual(usage.quota_units, 101)
+        data = self.scheduler.usage(user_id=7)
+        self.assertEqual((data['used'], data['remaining'], data['used_by_user']), (101, 199, 101))
+
+    def test_background_work_keeps_interactive_reserve(self):
+        """Проверка, что фоновые запросы не расходуют резерв интерактивных."""
+        self.scheduler.execute(self.request({}), 'search.list', ApiUsage())
+        self.scheduler.execute(self.request({}), 'search.list', ApiUsage())
+        request = self.request({})
+
+        with self.assertRaises(QuotaExceededError):
+            self.scheduler.execute(request, 'search.list', ApiUsage())
+        request.execute.assert_not_called()
+
+        self.scheduler.execute(request, 'search.list', ApiUsage(priority=Priority.INTERACTIVE))
+        self.assertEqual(self.scheduler.used(), 300)
+
+    def test_quota_exceeded_stops_further_calls(self):
+        """Проверка, что после 403 quotaExceeded следующие запросы дня не уходят в API."""
+        with self.assertRaises(QuotaExceededError):
+            self.scheduler.execute(self.request(google_http_error(403, 'quotaExceeded')), 'videos.list', ApiUsage())
+
+        request = self.request({})
+        with self.assertRaises(QuotaExceededError):
+            self.scheduler.execute(request, 'videos.list', ApiUsage(priority=Priority.INTERACTIVE))
+        request.execute.assert_not_called()
+        self.sleep.assert_not_called()
+
+    def test_rate_limit_retries_with_exponential_backoff(self):
+        """Проверка повторов на 429 и 403 rateLimitExceeded с растущей задержкой."""
+        request = self.request(
+            google_http_error(429, 'rateLimitExceeded'),
+            google_http_error(403, 'userRateLimitExceeded'),
+            {'items': []},
+        )
+
+        response = self.scheduler.execute(request, 'videos.list', ApiUsage())
+
+        self.assertEqual(response, {'items': []})
+        first, second = (call.args[0] for call in self.sleep.call_args_list)
+        self.assertLess(first, second)
+        # Каждая попытка тратит квоту
+        self.assertEqual(self.scheduler.used(), 3)
+
+    def test_server_errors_and_timeouts_are_retried(self):
+        """Проверка повторов на 5xx и таймаут соединения."""
+        request = self.request(google_http_error(503, 'backendError'), TimeoutError('timed out'), {'items': []})
+
+        response = self.scheduler.execute(request, 'videos.list', ApiUsage())
+
+        self.assertEqual(response, {'items': []})
+        self.assertEqual(self.sleep.call_count, 2)
+
+    def test_other_forbidden_errors_are_not_retried(self):
+        """Проверка, что 403 без признаков лимита отдаётся сразу."""
+        with self.assertRaises(HttpError):
+            self.scheduler.execute(self.request(google_http_error(403, 'forbidden')), 'videos.list', ApiUsage())
+        self.sleep.assert_not_called()
+
+    @override_settings(YOUTUBE_RATE_LIMIT_PROJECT=(5, 1))
+    def test_interactive_requests_jump_the_queue(self):
+        """Проверка, что при пустом bucket интерактивный запрос обгоняет ожидающий фоновый."""
+        self.scheduler.execute(self.request({}), 'reports.query', ApiUsage())
+        order = []
+
+        def run(name, priority):
+            request = MagicMock()
+            request.execute.side_effect = lambda: order.append(name)
+            self.scheduler.execute(request, 'reports.query', ApiUsage(priority=priority))
+
+        background = threading.Thread(target=run, args=('background', Priority.BACKGROUND))
+        background.start()
+        while not self.scheduler._waiters:
+            time.sleep(0.01)
+        interactive = threading.Thread(target=run, args=('interactive', Priority.INTERACTIVE))
+        interactive.start()
+        background.join()
+        interactive.join()
+
+        self.assertEqual(order, ['interactive', 'background'])
+
+    def test_scheduled_syncs_pause_when_quota_is_exhausted(self):
+        """Проверка, что плановые синхронизации не ставятся при исчерпанной квоте."""
+        with override_settings(YOUTUBE_QUOTA_INTERACTIVE_RESERVE=300), \
+                patch('youtube.tasks.enqueue_channel_sync') as mock_enqueue:
+            self.assertEqual(sync_stale_channels(), 0)
+        mock_enqueue.assert_not_called()
+
+    def test_usage_endpoint(self):
+        """Проверка эндпоинта с расходом квоты."""
+        user = CustomUser.objects.create_user(email='quota@example.com', password='testpassword')
+        scheduler.execute(self.request({}), 'search.list', ApiUsage(user_id=user.pk))
+        self.client.force_login(user)
+
+        data = self.client.get(reverse('quota_usage')).json()
+
+        self.assertEqual((data['daily_budget'], data['used'], data['used_by_user']), (300, 100, 100))
+
+
+@override_settings(YOUTUBE_ANALYTICS_MAX_WORKERS=2)
+class BackfillTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = CustomUser.objects.create_user(email='backfill@example.com', password='testpassword')
+        self.creds = GoogleCredentials.objects.create(
+            user=self.user,
+            access_token='fake_access_token',
+            refresh_token='fake_refresh_token',
+            token_expiry=timezone.now() + timedelta(hours=1),
+            scopes=' '.join(settings.YOUTUBE_SCOPES),
+        )
+        self.channel = YouTubeChannel.objects.create(
+            user=self.user,
+            channel_id='UC_backfill_channel_id',
+            title='Backfill Channel'
+        )
+        self.requested = []
+
+    def fake_reports(self, fail_from=None):
+        def execute(creds_obj, queries, usage=None):
+            results = {}
+            for name, query in queries.items():
+                self.requested.append(query['startDate'])
+                if fail_from and query['startDate'] >= fail_from:
+                    results[name] = RuntimeError('quota')
+                else:
+                    results[name] = {'rows': [[query['startDate'], 5, 1, 0], [query['endDate'], 5, 1, 0]]}
+            return results
+        return execute
+
+    def test_plan_chunks_cover_range_without_gaps(self):
+        """Проверка, что куски покрывают весь период и не пересекаются."""
+        chunks = plan_chunks(date(2020, 1, 1), date(2020, 12, 31), 100)
+
+        self.assertEqual(chunks[0][0], date(2020, 1, 1))
+        self.assertEqual(chunks[-1][1], date(2020, 12, 31))
+        for (_, prev_end), (next_start, _) in zip(chunks, chunks[1:]):
+            self.assertEqual(next_start, prev_end + timedelta(days=1))
+        self.assertEqual(len(chunks), 4)
+
+    def test_backfill_loads_all_chunks(self):
+        """Проверка, что история загружается кусками и канал помечается загруженным."""
+        start = date.today() - timedelta(days=99)
+        with patch('youtube.backfill.execute_reports', side_effect=self.fake_reports()):
+            backfill = run_backfill(self.creds, self.channel, start_date=start, chunk_days=30)
+
+        self.assertEqual(backfill.status, YoutubeBackfill.Status.DONE)
+        self.assertEqual(len(backfill.completed_chunks), 4)
+        self.assertEqual(len(self.requested), 4)
+        self.assertTrue(YoutubeDailyStats.objects.filter(channel=self.channel, date=start).exists())
+
+    def test_interrupted_backfill_resumes_from_checkpoint(self):
+        """Проверка, что после сбоя повторный запуск запрашивает только недостающие куски."""
+        start = date.today() - timedelta(days=149)
+        failing_chunk = (start + timedelta(days=60)).isoformat()
+        with patch('youtube.backfill.execute_reports', side_effect=self.fake_reports(fail_from=failing_chunk)):
+            with self.assertRaises(RuntimeError):
+                run_backfill(self.creds, self.channel, start_date=start, chunk_days=30)
+
+        state = YoutubeBackfill.objects.get(channel=self.channel)
+        self.assertEqual(state.status, YoutubeBackfill.Status.FAILED)
+        self.assertEqual(len(state.completed_chunks), 2)
+
+        self.requested.clear()
+        with patch('youtube.backfill.execute_reports', side_effect=self.fake_reports()):
+            backfill = run_backfill(self.creds, self.channel)
+
+        self.assertEqual(backfill.status, YoutubeBackfill.Status.DONE)
+        self.assertEqual(self.requested[0], failing_chunk)
+        self.assertEqual(len(self.requested), 3)
+
+    def test_command_skips_finished_channels(self):
+        """Проверка, что команда без --channel не трогает каналы с загруженной историей."""
+        YoutubeBackfill.objects.create(channel=self.channel, status=YoutubeBackfill.Status.DONE)
+
+        with patch('youtube.management.commands.backfill_youtube_channels.run_backfill') as mock_run:
+            call_command('backfill_youtube_channels', stdout=io.StringIO())
+
+        mock_run.assert_not_called()
+
+
+class GeminiChatTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.client = Client()
+        self.user = CustomUser.objects.create_user(email='gemini@example.com', password='testpassword')
+        self.channel = YouTubeChannel.objects.create(
+            user=self.user,
+            channel_id='UC_gemini_channel_id',
+            title='Gemini Channel'
+        )
+        self.date_to = date(2025, 6, 30)
+        save_daily_stats(self.channel, [
+            [(self.date_to - timedelta(days=i)).isoformat(), 100 + i, 3, 1] for i in range(365)
+        ])
+        YouTubeVideo.objects.bulk_create([
+            YouTubeVideo(
+                channel=self.channel,
+                video_id=f'vid_{i}',
+                title=f'Video number {i} with a rather long descriptive title for the prompt',
+                published_at=timezone.now(),
+                views=i,
+            )
+            for i in range(300)
+        ])
+        self.client.force_login(self.user)
+
+    def test_digest_fits_token_budget(self):
+        """Проверка, что сводка большого канала укладывается в бюджет токенов."""
+        digest = build_channel_digest(self.channel, self.date_to - timedelta(days=364), self.date_to)
+
+        text = render_digest(digest)
+
+        self.assertLessEqual(estimate_tokens(text), settings.GEMINI_PROMPT_TOKEN_BUDGET)
+        self.assertIn('Video number 299', text)
+        self.assertIn('Просмотры по месяцам', text)
+
+    def test_small_budget_keeps_totals(self):
+        """Проверка, что при малом бюджете отбрасываются списки, а итоги остаются."""
+        digest = build_channel_digest(self.channel, self.date_to - timedelta(days=29), self.date_to)
+
+        text = render_digest(digest, token_budget=120)
+
+        self.assertIn('Итого: просмотры', text)
+        self.assertNotIn('Video number 290', text)
+        self.assertLessEqual(estimate_tokens(text), 120)
+
+    @patch('youtube.gemini.get_gemini_model')
+    def test_identical_questions_are_answered_from_cache(self, mock_model):
+        """Проверка, что одинаковый вопрос по тем же данным не уходит в Gemini повторно."""
+        generate = mock_model.return_value.generate_content_async = AsyncMock(return_value=MagicMock(text='Ответ'))
+        payload = {'message': 'Как растёт канал?', 'dashboard_data': {'videos': ['x'] * 1000}}
+
+        first = self.client.post(reverse('gemini_chat'), payload, content_type='application/json').json()
+        second = self.client.post(
+            reverse('gemini_chat'), {'message': '  как растёт   канал?'}, content_type='application/json'
+        ).json()
+
+        self.assertEqual((first['cached'], second['cached']), (False, True))
+        self.assertEqual(generate.call_count, 1)
+        prompt = generate.call_args.args[0]
+        self.assertNotIn("'x', 'x'", prompt)
+
+        bump_data_version(self.channel.pk)
+        self.client.post(reverse('gemini_chat'), payload, content_type='application/json')
+        self.assertEqual(generate.call_count, 2)
+
+    @patch('youtube.gemini.get_gemini_model')
+    def test_errors_are_not_cached(self, mock_model):
+        """Проверка, что ошибка генерации не попадает в кэш."""
+        mock_model.return_value.generate_content_async = AsyncMock(
+            side_effect=[RuntimeError('down'), MagicMock(text='Ответ')]
+        )
+        payload = {'message': 'Что улучшить?'}
+
+        with self.assertLogs('youtube.gemini', level='ERROR') as logs:
+            self.client.post(reverse('gemini_chat'), payload, content_type='application/json')
+        response = self.client.post(reverse('gemini_chat'), payload, content_type='application/json').json()
+
+        self.assertEqual(response, {'response': 'Ответ', 'cached': False})
+        self.assertIn('RuntimeError: down', logs.output[0])
+
+
+    @patch('youtube.gemini.get_gemini_model')
+    def test_api_token_authentication(self, mock_model):
+        """Проверка, что чат принимает заголовок Authorization: Token, а без входа отвечает 401 JSON."""
+        mock_model.return_value.generate_content_async = AsyncMock(return_value=MagicMock(text='Ответ'))
+        token = Token.objects.create(user=self.user)
+        client = Client(enforce_csrf_checks=True)
+        payload = {'message': 'Кто я?'}
+
+        response = client.post(
+            reverse('gemini_chat'), payload, content_type='application/json', HTTP_AUTHORIZATION=f'Token {token.key}'
+        )
+        self.assertEqual(response.json(), {'response': 'Ответ', 'cached': False})
+
+        response = client.post(reverse('gemini_chat'), payload, content_type='application/json')
+        self.assertEqual(response.status_code, 401)
+        self.assertIn('error', response.json())
+
+        response = client.post(
+            reverse('gemini_chat'), payload, content_type='application/json', HTTP_AUTHORIZATION='Token wrong'
+        )
+        self.assertEqual(response.status_code, 401)
+
+        # Вход по сессии по-прежнему требует CSRF-токен, как у api_view
+        client.force_login(self.user)
+        response = client.post(reverse('gemini_chat'), payload, content_type='application/json')
+        self.assertEqual(response.status_code, 403)
+
+
+@override_settings(GEMINI_MODEL_FACTORY='youtube.fakes.FakeGenerativeModel')
+class GeminiStreamTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        reset_gemini_model()
+        self.addCleanup(reset_gemini_model)
+        self.client = Client()
+        self.user = CustomUser.objects.create_user(email='stream@example.com', password='testpassword')
+        self.channel = YouTubeChannel.objects.create(
+            user=self.user,
+            channel_id='UC_stream_channel_id',
+            title='Stream Channel'
+        )
+        self.client.force_login(self.user)
+
+    def events(self, response):
+        body = b''.join(response.streaming_content).decode()
+        events = []
+        for block in body.strip().split('\n\n'):
+            name, data = block.split('\n')
+            events.append((name.removeprefix('event: '), json.loads(data.removeprefix('data: '))))
+        return events
+
+    def test_model_client_is_shared(self):
+        """Проверка, что клиент модели создаётся один раз на процесс."""
+        self.assertIs(get_gemini_model(), get_gemini_model())
+
+    def test_stream_sends_tokens_and_caches_answer(self):
+        """Проверка, что ответ приходит событиями token, а повторный вопрос берётся из кэша."""
+        url = reverse('gemini_chat_stream')
+        response = self.client.get(url, {'message': 'Что дальше?'})
+
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        events = self.events(response)
+        tokens = [data['text'] for name, data in events if name == 'token']
+        self.assertGreater(len(tokens), 1)
+        self.assertEqual(''.join(tokens), get_gemini_model().reply)
+        self.assertEqual(events[-1], ('done', {'cached': False}))
+
+        events = self.events(self.client.get(url, {'message': 'Что дальше?'}))
+        self.assertEqual(events, [('token', {'text': get_gemini_model().reply}), ('done', {'cached': True})])
+        self.assertEqual(len(get_gemini_model().prompts), 1)
+
+    def test_disconnect_cancels_generation(self):
+        """Проверка, что при отключении клиента поток модели закрывается, а обрывок не кэшируется."""
+        url = reverse('gemini_chat_stream')
+        response = self.client.get(url, {'message': 'Оборвём?'})
+
+        next(iter(response.streaming_content))
+        response.close()
+
+        self.assertEqual(get_gemini_model().closed_streams, 1)
+        events = self.events(self.client.get(url, {'message': 'Оборвём?'}))
+        self.assertEqual(events[-1], ('done', {'cached': False}))
+
+    def test_stream_error_is_logged_and_sent_as_event(self):
+        """Проверка, что сбой модели посреди ответа пишется в лог и уходит клиенту событием error."""
+        def chunks():
+            yield MagicMock(text='Нача')
+            raise RuntimeError('stream broke')
+
+        with patch('youtube.gemini.get_gemini_model') as mock_model, \
+                self.assertLogs('youtube.gemini', level='ERROR') as logs:
+            mock_model.return_value.generate_content.return_value = chunks()
+            events = self.events(self.client.get(reverse('gemini_chat_stream'), {'message': 'Сломаем?'}))
+
+        self.assertEqual(events, [('token', {'text': 'Нача'}), ('error', {'error': 'Ошибка при генерации контента.'})])
+        self.assertIn('RuntimeError: stream broke', logs.output[0])
+
+    async def test_asgi_stream_sends_first_token_before_model_finishes(self):
+        """Проверка, что под ASGI первое событие уходит до конца генерации, а не после сбора всего ответа."""
+        progress = []
+
+        def chunks():
+            for text in ('Пер', 'вый'):
+                progress.append(text)
+                yield MagicMock(text=text)
+            progress.append('done')
+
+        await self.async_client.aforce_login(self.user)
+        with patch('youtube.gemini.get_gemini_model') as mock_model:
+            mock_model.return_value.generate_content.return_value = chunks()
+            response = await self.async_client.get(reverse('gemini_chat_stream'), {'message': 'Потоком?'})
+            self.assertTrue(response.is_async)
+            content = aiter(response.streaming_content)
+
+            first = await anext(content)
+            self.assertEqual(progress, ['Пер'])
+            rest = [part async for part in content]
+
+        self.assertIn('Пер', first.decode())
+        self.assertEqual(progress[-1], 'done')
+        self.assertIn(b'event: done', rest[-1])
+
+    async def test_async_adapter_closes_model_stream(self):
+        """Проверка, что закрытие асинхронного потока закрывает и поток модели."""
+        stream = aiterate(stream_cached_summary('gemini:test:closed', lambda: 'prompt'))
+
+        self.assertIn('event: token', await anext(stream))
+        await stream.aclose()
+
+        self.assertEqual(get_gemini_model().closed_streams, 1)
+
+    def test_stream_requires_message(self):
+        """Проверка, что без вопроса поток не открывается."""
+        response = self.client.get(reverse('gemini_chat_stream'))
+        self.assertEqual(response.status_code, 400)
+
+
+class AsyncViewsTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.client = Client()
+        self.user = CustomUser.objects.create_user(email='async@example.com', password='testpassword')
+        self.requests = []
+
+    def google(self, request):
+        self.requests.append(request.url.path)
+        if request.url.path == '/token':
+            return httpx.Response(200, json={
+                'access_token': 'async_access_token',
+                'refresh_token': 'async_refresh_token',
+                'expires_in': 3600,
+                'scope': 'openid',
+            })
+        return httpx.Response(200, json={'email': self.user.email})
+
+    def mock_client(self, handler):
+        return patch(
+            'youtube.views.get_async_client',
+            side_effect=lambda: httpx.AsyncClient(transport=httpx.MockTransport(handler)),
+        )
+
+    @patch('youtube.tasks.backfill_channel.delay')
+    @patch('youtube.views.fetch_channel_identity', return_value={
+        'channel_id': 'UC_async_channel', 'title': 'Async channel', 'description': '', 'uploads_playlist_id': 'UU_async',
+    })
+    def test_youtube_callback_saves_credentials(self, mock_identity, mock_backfill):
+        """Проверка, что async OAuth callback обменивает код, логинит и сохраняет токены и канал."""
+        with self.mock_client(self.google):
+            response = self.client.get(reverse('youtube_callback'), {'code': 'abc'})
+
+        self.assertRedirects(response, reverse('youtube-dashboard'), fetch_redirect_response=False)
+        self.assertEqual(self.requests, ['/token', '/oauth2/v3/userinfo'])
+        creds = GoogleCredentials.objects.get(user=self.user)
+        self.assertEqual((creds.access_token, creds.refresh_token), ('async_access_token', 'async_refresh_token'))
+        self.assertEqual(int(self.client.session['_auth_user_id']), self.user.pk)
+        channel = YouTubeChannel.objects.get(channel_id='UC_async_channel')
+        self.assertEqual((channel.user, channel.credentials, channel.uploads_playlist_id), (self.user, creds, 'UU_async'))
+        mock_backfill.assert_called_once_with(channel.pk)
+
+    @patch('youtube.views.fetch_channel_identity', side_effect=TimeoutError('timed out'))
+    def test_youtube_callback_link_failure_drops_credentials(self, mock_identity):
+        """Проверка, что при любой ошибке привязки канала сохранённый токен удаляется, а пользователь видит страницу ошибки."""
+        with self.mock_client(self.google), self.assertLogs('youtube.views', level='ERROR') as logs:
+            response = self.client.get(reverse('youtube_callback'), {'code': 'abc'})
+
+        self.assertEqual(response.status_code, 200)
+        self.assertTemplateUsed(response, 'youtube/error_page.html')
+        self.assertFalse(GoogleCredentials.objects.exists())
+        self.assertIn('TimeoutError: timed out', logs.output[0])
+
+    def test_youtube_callback_token_error(self):
+        """Проверка, что ошибка обмена кода возвращает на вход через Google."""
+        with self.mock_client(lambda request: httpx.Response(400, json={'error': 'invalid_grant'})):
+            response = self.client.get(reverse('youtube_callback'), {'code': 'abc'})
+
+        self.assertRedirects(response, reverse('google_login'), fetch_redirect_response=False)
+        self.assertFalse(GoogleCredentials.objects.exists())
+
+    def test_async_client_is_pooled_per_loop(self):
+        """Проверка, что в пределах цикла событий используется один HTTP-клиент."""
+        async def clients():
+            return get_async_client(), get_async_client()
+
+        first, second = async_to_sync(clients)()
+        self.assertIs(first, second)
+        self.assertIsInstance(first, httpx.AsyncClient)
+
+    def test_trend_views_are_async(self):
+        """Проверка, что тяжёлые представления выполняются как корутины, а не в потоке."""
+        for view in (channel_trends, video_trends, viewer_activity, gemini_chat, youtube_callback):
+            self.assertTrue(iscoroutinefunction(view), view.__name__)
+
+
+class BenchmarkTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        clear_service_cache()
+        self.addCleanup(clear_service_cache)
+
+    @override_settings(**BENCHMARK_SETTINGS, YOUTUBE_FAKE_API_VIDEOS=120)
+    def test_fake_api_serves_full_sync(self):
+        """Проверка, что синхронизация через фейковый API проходит все страницы плейлиста."""
+        user, creds_obj, channel = create_fixture()
+
+        usage = update_all_videos(creds_obj, channel.channel_id)
+
+        self.assertEqual(YouTubeVideo.objects.filter(channel=channel).count(), 120)
+        self.assertEqual(YouTubeVideoDailyStats.objects.filter(video__channel=channel).count(), 120)
+        self.assertEqual(usage.calls, {'channels.list': 1, 'playlistItems.list': 3, 'videos.list': 3})
+
+    def test_views_stay_within_query_budgets(self):
+        """Проверка бюджетов SQL-запросов представлений и загрузки на небольшом канале."""
+        results = run_benchmarks(videos=120, days=60, iterations=2)
+
+        self.assertEqual(check_query_budgets(results), [])
+        self.assertEqual(set(results['views']), set(VIEW_QUERY_BUDGETS))
+        self.assertGreater(results['ingest']['rows'], 300)
+        self.assertLessEqual(results['views']['channel_trends']['p50_ms'], results['views']['channel_trends']['p95_ms'])
+        rows, packed = results['video_series']['rows'], results['video_series']['packed']
+        self.assertLessEqual(packed['append_queries'], rows['append_queries'])
+        if rows['bytes'] is not None:
+            self.assertLess(packed['bytes'], rows['bytes'])
+
+    def test_baseline_comparison_flags_regressions(self):
+        """Проверка, что сравнение с baseline ловит падение пропускной способности, рост p95 и запросов."""
+        baseline = {
+            'ingest': {'rows_per_sec': 1000, 'queries': 50},
+            'views': {'channel_trends': {'p95_ms': 10.0, 'queries': 6}},
+        }
+        results = {
+            'ingest': {'rows_per_sec': 900, 'queries': 50},
+            'views': {
+                'channel_trends': {'p95_ms': 12.0, 'queries': 6},
+                'video_trends': {'p95_ms': 500.0, 'queries': 50},
+            },
+        }
+        self.assertEqual(compare_with_baseline(results, baseline), [])
+
+        results['ingest']['rows_per_sec'] = 500
+        results['views']['channel_trends'] = {'p95_ms': 20.0, 'queries': 7}
+        self.assertEqual(len(compare_with_baseline(results, baseline)), 3)
+
+
+class SyntheticDataTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.options = dict(
+            users=2, channels_per_user=2, videos_per_channel=5, years=0.5, demographic_buckets=4,
+            video_days=3, seed=7, end_date=date(2025, 6, 30), stdout=io.StringIO(),
+        )
+
+    def generated_values(self):
+        return (
+            list(YoutubeDailyStats.objects.order_by('channel__title', 'date').values_list('views', flat=True)),
+            list(YouTubeVideo.objects.order_by('video_id').values_list('title', 'views', 'published_at')),
+        )
+
+    def test_generates_requested_volume(self):
+        """Проверка, что генератор создаёт заданное число строк во всех таблицах."""
+        call_command('generate_youtube_data', **self.options)
+
+        self.assertEqual(YouTubeChannel.objects.count(), 4)
+        self.assertEqual(YoutubeDailyStats.objects.count(), 4 * 182)
+        self.assertEqual(YouTubeVideo.objects.count(), 20)
+        self.assertEqual(YoutubeAudienceDemographics.objects.count(), 16)
+        self.assertTrue(YoutubeStatsRollup.objects.exists())
+        snapshots = YouTubeVideoDailyStats.objects.all()
+        self.assertTrue(0 < snapshots.count() <= 20 * 3)
+        self.assertFalse(snapshots.filter(views_delta__lt=0).exists())
+
+    def test_same_seed_gives_same_data(self):
+        """Проверка, что повторный запуск с тем же seed даёт те же данные, а другой seed — другие."""
+        call_command('generate_youtube_data', **self.options)
+        first = self.generated_values()
+
+        call_command('generate_youtube_data', clear=True, **self.options)
+        self.assertEqual(self.generated_values(), first)
+
+        call_command('generate_youtube_data', clear=True, **{**self.options, 'seed': 8})
+        self.assertNotEqual(self.generated_values(), first)
+
+    def test_packed_storage_gets_same_snapshots(self):
+        """Проверка, что в хранилище 'packed' генератор пишет те же снимки видео рядами."""
+        call_command('generate_youtube_data', **self.options)
+        period = (date(2025, 6, 28), date(2025, 6, 30))
+        expected = {pk: read_rows(pk, *period) for pk in YouTubeVideo.objects.values_list('pk', flat=True)}
+
+        with override_settings(YOUTUBE_VIDEO_SERIES_STORAGE='packed'):
+            call_command('generate_youtube_data', clear=True, **self.options)
+        videos = YouTubeVideo.objects.order_by('pk').values_list('pk', flat=True)
+
+        self.assertFalse(YouTubeVideoDailyStats.objects.exists())
+        self.assertEqual([read_packed(pk, *period) for pk in videos], [expected[pk] for pk in sorted(expected)])
+
+    def test_refuses_to_duplicate_previous_run(self):
+        """Проверка, что без --clear второй запуск с тем же префиксом не создаёт дубликатов."""
+        call_command('generate_youtube_data', **self.options)
+
+        with self.assertRaises(CommandError):
+            call_command('generate_youtube_data', **self.options)
+
+    def test_generated_channel_is_served_by_views(self):
+        """Проверка, что сгенерированный канал отдаётся API трендов его пользователю."""
+        call_command('generate_youtube_data', **self.options)
+        user = CustomUser.objects.get(email='synthetic-0@example.com')
+        self.client.force_login(user)
+
+        response = self.client.get(reverse('channel_trends'), {'date_from': '2025-01-01', 'date_to': '2025-06-30'})
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.json()['dates']), 181)
+
+
+class MetricsTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.client = Client()
+
+    def sample(self, name, **labels):
+        return REGISTRY.get_sample_value(name, labels) or 0
+
+    def test_view_latency_and_queries_are_recorded(self):
+        """Проверка, что по представлению пишутся время ответа и число SQL-запросов, в том числе у async."""
+        user, _, _ = create_fixture()
+        self.client.force_login(user)
+        before = {
+            view: (
+                self.sample('django_view_latency_seconds_count', view=view, method='GET', status='200'),
+                self.sample('django_view_db_queries_sum', view=view),
+            )
+            for view in ('sync_status', 'channel_trends')
+        }
+
+        self.client.get(reverse('sync_status'))
+        self.client.get(reverse('channel_trends'))
+
+        for view, (count, queries) in before.items():
+            self.assertEqual(
+                self.sample('django_view_latency_seconds_count', view=view, method='GET', status='200'), count + 1
+            )
+            self.assertGreater(self.sample('django_view_db_queries_sum', view=view), queries, view)
+
+    def test_outbound_calls_are_recorded_by_endpoint_and_status(self):
+        """Проверка, что вызовы Google API считаются по методу и статусу ответа."""
+        scheduler = QuotaScheduler(sleep=MagicMock())
+        request = MagicMock()
+        request.execute.side_effect = [google_http_error(404, 'notFound'), {}]
+        labels = dict(service='youtube', endpoint='videos.list')
+        before = {status: self.sample('outbound_request_seconds_count', status=status, **labels)
+                  for status in ('404', '200')}
+
+        with self.assertRaises(HttpError):
+            scheduler.execute(request, 'videos.list', ApiUsage())
+        scheduler.execute(request, 'videos.list', ApiUsage())
+
+        for status, count in before.items():
+            self.assertEqual(self.sample('outbound_request_seconds_count', status=status, **labels), count + 1)
+
+    def test_pooled_session_records_google_endpoint(self):
+        """Проверка, что запросы общей сессии попадают в метрику с хостом и путём без параметров."""
+        labels = dict(service='google', endpoint='oauth2.googleapis.com/token', status='400')
+        before = self.sample('outbound_request_seconds_count', **labels)
+        response = requests.Response()
+        response.status_code = 400
+
+        with patch('requests.adapters.HTTPAdapter.send', return_value=response):
+            get_session().post('https://oauth2.googleapis.com/token?x=1', data={})
+
+        self.assertEqual(self.sample('outbound_request_seconds_count', **labels), before + 1)
+
+    def test_metrics_are_summed_across_processes(self):
+        """Проверка, что в multiprocess-режиме /metrics отдаёт сумму значений всех процессов."""
+        observe = (
+            "from prometheus_client import Histogram; "
+            "Histogram('outbound_request_seconds', 'x', ['service', 'endpoint', 'status'])"
+            ".labels('gemini', 'generate_content', '200').observe(0.5)"
+        )
+        with tempfile.TemporaryDirectory() as directory:
+            env = {**os.environ, 'PROMETHEUS_MULTIPROC_DIR': directory}
+            for _ in range(2):
+                subprocess.run([sys.executable, '-c', observe], env=env, check=True)
+
+            with patch('social_analytics.metrics.MULTIPROC_DIR', directory):
+                response = self.client.get('/metrics')
+
+        self.assertEqual(response.status_code, 200)
+        samples = {
+            (sample.name, sample.labels.get('service')): sample.value
+            for family in text_string_to_metric_families(response.content.decode())
+            for sample in family.samples
+        }
+        self.assertEqual(samples[('outbound_request_seconds_count', 'gemini')], 2)
+        self.assertEqual(samples[('outbound_request_seconds_sum', 'gemini')], 1.0)
+
+
+class ChannelIdentityTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.client = Client()
+        self.user = CustomUser.objects.create_user(email='channels@example.com', password='testpassword')
+
+    def credentials(self, user=None, refresh_token='fake_refresh_token'):
+        return GoogleCredentials.objects.create(
+            user=user or self.user,
+            access_token='fake_access_token',
+            refresh_token=refresh_token,
+            token_expiry=timezone.now() + timedelta(hours=1),
+            scopes=' '.join(settings.YOUTUBE_SCOPES),
+            client_id=settings.YOUTUBE_CLIENT_ID,
+            client_secret=settings.YOUTUBE_CLIENT_SECRET,
+            token_uri="https://oauth2.googleapis.com/token",
+        )
+
+    def identity(self, channel_id, title='Channel'):
+        return {'channel_id': channel_id, 'title': title, 'description': '', 'uploads_playlist_id': f'UU{channel_id}'}
+
+    def test_user_links_several_channels_with_own_tokens(self):
+        """Проверка, что каждый привязанный канал хранит свой токен, а повторная привязка его заменяет."""
+        first_creds, second_creds = self.credentials(), self.credentials()
+        first, created = link_channel(self.user, first_creds, self.identity('UC_first'))
+        self.assertTrue(created)
+        second, _ = link_channel(self.user, second_creds, self.identity('UC_second'))
+        self.assertEqual((first.credentials, second.credentials), (first_creds, second_creds))
+
+        relinked_creds = self.credentials(refresh_token='')
+        channel, created = link_channel(self.user, relinked_creds, self.identity('UC_first', title='Renamed'))
+
+        self.assertFalse(created)
+        self.assertEqual((channel.title, channel.credentials), ('Renamed', relinked_creds))
+        self.assertFalse(GoogleCredentials.objects.filter(pk=first_creds.pk).exists())
+        relinked_creds.refresh_from_db()
+        self.assertEqual(relinked_creds.refresh_token, 'fake_refresh_token')
+        self.assertEqual(self.user.youtube_channels.count(), 2)
+
+    @patch('youtube.views.fetch_viewer_activity', return_value={})
+    def test_api_views_use_selected_channel_token(self, mock_fetch):
+        """Проверка, что API берут токен выбранного канала, а не последний токен пользователя."""
+        first_creds, second_creds = self.credentials(), self.credentials()
+        link_channel(self.user, first_creds, self.identity('UC_first'))
+        link_channel(self.user, second_creds, self.identity('UC_second'))
+        self.client.force_login(self.user)
+        period = {'channel_id': 'UC_first', 'date_from': '2025-01-01', 'date_to': '2025-01-31'}
+
+        self.assertEqual(self.client.get(reverse('viewer_activity'), period).status_code, 200)
+        self.assertEqual(mock_fetch.call_args.args[0], first_creds)
+
+        # Без refresh token истёкший токен первого канала не обновить, хотя токен второго в порядке
+        GoogleCredentials.objects.filter(pk=first_creds.pk).update(
+            refresh_token='', token_expiry=timezone.now() - timedelta(hours=1)
+        )
+        self.assertEqual(self.client.get(reverse('channel_trends'), period).status_code, 401)
+        self.assertEqual(self.client.get(reverse('channel_trends'), {**period, 'channel_id': 'UC_second'}).status_code, 200)
+        self.assertEqual(self.client.get(reverse('channel_trends'), {**period, 'channel_id': 'UC_unknown'}).status_code, 404)
+
+    def test_channel_of_another_user_is_not_relinked(self):
+        """Проверка, что чужой канал не перепривязывается к другому пользователю."""
+        other = CustomUser.objects.create_user(email='other@example.com', password='testpassword')
+        link_channel(other, self.credentials(other), self.identity('UC_taken'))
+
+        with self.assertRaises(ChannelLinkError):
+            link_channel(self.user, self.credentials(), self.identity('UC_taken'))
+        self.assertEqual(YouTubeChannel.objects.get(channel_id='UC_taken').user, other)
+
+    @patch('youtube.tasks.sync_channel.delay')
+    @patch('youtube.views.fetch_channel_identity', side_effect=AssertionError('dashboard must not call Google'))
+    def test_dashboard_switches_channels_without_google(self, mock_identity, mock_delay):
+        """Проверка, что дашборд переключает каналы из базы и ставит синхронизацию каждого устаревшего."""
+        first, _ = link_channel(self.user, self.credentials(), self.identity('UC_first'))
+        second, _ = link_channel(self.user, self.credentials(), self.identity('UC_second'))
+        self.client.force_login(self.user)
+
+        response = self.client.get(reverse('youtube-dashboard'))
+        self.assertEqual(response.context['channel_id'], 'UC_first')
+        self.assertEqual(sorted(call.args[0] for call in mock_delay.call_args_list), [first.pk, second.pk])
+
+        response = self.client.get(reverse('youtube-dashboard'), {'channel_id': 'UC_second'})
+        self.assertEqual(response.context['channel_id'], 'UC_second')
+        self.assertContains(response, '<option value="UC_first">')
+
+        # Выбор запоминается в сессии и используется API без channel_id
+        response = self.client.get(reverse('youtube-dashboard'))
+        self.assertEqual(response.context['channel_id'], 'UC_second')
+        response = self.client.get(reverse('sync_status'))
+        self.assertEqual(response.json()['channel_id'], 'UC_second')
+        response = self.client.get(reverse('channel_trends'))
+        self.assertEqual(response.status_code, 200)
+
+    @patch('youtube.services.fetch_uploads_playlist_id')
+    def test_video_sync_uses_stored_uploads_playlist(self, mock_playlist):
+        """Проверка, что синхронизация видео не запрашивает channels.list у привязанного канала."""
+        channel, _ = link_channel(self.user, self.credentials(), self.identity('UC_stored'))
+
+        with patch('youtube.services.iter_playlist_video_ids', return_value=iter([])) as mock_iter, \
+                patch('youtube.services.get_youtube_service'):
+            update_all_videos(channel.credentials, channel_id='UC_stored')
+
+        mock_playlist.assert_not_called()
+        self.assertEqual(mock_iter.call_args.args[1], 'UUUC_stored')
+
+    @override_settings(YOUTUBE_API_FACTORY='youtube.fakes.FakeYouTubeApi')
+    def test_background_revalidation(self):
+        """Проверка, что фоновая проверка обновляет канал и помечает канал с отозванным доступом."""
+        clear_service_cache()
+        self.addCleanup(clear_service_cache)
+        creds = self.credentials()
+        valid = YouTubeChannel.objects.create(
+            user=self.user, credentials=creds, channel_id=fake_channel_id(self.user.pk), title='Old title'
+        )
+        revoked = YouTubeChannel.objects.create(user=self.user, credentials=creds, channel_id='UC_gone', title='Gone')
+        fresh = YouTubeChannel.objects.create(
+            user=self.user, credentials=creds, channel_id='UC_fresh', title='Fresh', identity_checked_at=timezone.now()
+        )
+
+        self.assertEqual(revalidate_channels(), 2)
+
+        valid.refresh_from_db()
+        revoked.refresh_from_db()
+        fresh.refresh_from_db()
+        self.assertEqual(valid.title, f'Fake channel {valid.channel_id}')
+        self.assertIsNotNone(valid.identity_checked_at)
+        self.assertEqual(valid.sync_status, YouTubeChannel.SyncStatus.IDLE)
+        self.assertEqual(revoked.sync_status, YouTubeChannel.SyncStatus.FAILED)
+        self.assertEqual(fresh.sync_status, YouTubeChannel.SyncStatus.IDLE)
+
+
+class PartitioningTests(TestCase):
+    def test_month_helpers(self):
+        """Проверка перечисления месяцев и имён секций."""
+        months = list(partitioning.iter_months(date(2024, 11, 20), date(2025, 2, 1)))
+
+        self.assertEqual(months, [date(2024, 11, 1), date(2024, 12, 1), date(2025, 1, 1), date(2025, 2, 1)])
+        self.assertEqual(partitioning.partition_name('stats', months[1]), 'stats_p2024_12')
+        with patch('django.utils.timezone.localdate', return_value=date(2025, 11, 15)):
+            self.assertEqual(partitioning.last_partition_month(3), date(2026, 2, 1))
+
+    def test_pruning_report_flags_partitions_outside_range(self):
+        """Проверка, что отчёт по EXPLAIN находит секции вне диапазона запроса."""
+        queryset = MagicMock()
+        queryset.model = YoutubeDailyStats
+        table = YoutubeDailyStats._meta.db_table
+        partitions = [f'{table}_p2025_0{month}' for month in (1, 2, 3)] + [f'{table}_default']
+
+        def explain(*scanned):
+            nodes = [{'Node Type': 'Seq Scan', 'Relation Name': name} for name in scanned]
+            plan = {'Node Type': 'Append', 'Plans': [{'Node Type': 'Seq Scan', 'Relation Name': 'youtube_youtubechannel'}, *nodes]}
+            return json.dumps([{'Plan': plan}])
+
+        with patch('youtube.partitioning.list_partitions', return_value=partitions):
+            queryset.explain.return_value = explain(partitions[1], partitions[3])
+            report = partitioning.pruning_report(queryset, date(2025, 2, 3), date(2025, 2, 20))
+            self.assertTrue(report['pruned'])
+            self.assertEqual(report['scanned'], sorted([partitions[1], partitions[3]]))
+
+            queryset.explain.return_value = explain(*partitions)
+            self.assertFalse(partitioning.pruning_report(queryset, date(2025, 2, 3), date(2025, 2, 20))['pruned'])
+
+    @skipUnless(connection.vendor != 'postgresql', 'Проверка поведения без PostgreSQL')
+    def test_noop_without_postgres(self):
+        """Проверка, что без PostgreSQL задача ничего не делает, а команда сообщает об ошибке."""
+        self.assertEqual(ensure_stats_partitions(), [])
+        with self.assertRaises(CommandError):
+            call_command('partition_youtube_stats', '--convert')
+
+    @skipUnless(connection.vendor == 'postgresql', 'Секционирование есть только в PostgreSQL')
+    def test_convert_keeps_data_and_prunes_partitions(self):
+        """Проверка перевода таблиц с данными, upsert в секции, переноса из секции по умолчанию и отсечения."""
+        user = CustomUser.objects.create_user(email='partitions@example.com', password='testpassword')
+        channel = YouTubeChannel.objects.create(user=user, channel_id='UC_partitioned', title='Partitioned')
+        today = timezone.localdate()
+        old_day = today - timedelta(days=400)
+        YoutubeDailyStats.objects.create(channel=channel, date=today - timedelta(days=40), views=1)
+        YoutubeDailyStats.objects.create(channel=channel, date=today, views=2)
+
+        out = io.StringIO()
+        call_command('partition_youtube_stats', '--convert', stdout=out)
+        self.assertIn('2 rows moved', out.getvalue())
+        table = YoutubeDailyStats._meta.db_table
+        self.assertTrue(partitioning.is_partitioned(table))
+
+        # Строка старше первой секции уходит в секцию по умолчанию, а при создании секции переносится
+        bulk_upsert(
+            YoutubeDailyStats,
+            [YoutubeDailyStats(channel=channel, date=today, views=5), YoutubeDailyStats(channel=channel, date=old_day)],
+            unique_fields=['channel', 'date'],
+            update_fields=['views'],
+        )
+        self.assertEqual(YoutubeDailyStats.objects.get(channel=channel, date=today).views, 5)
+        created = partitioning.ensure_partitions(start=old_day)
+        self.assertIn(partitioning.partition_name(table, old_day), created)
+        self.assertEqual(partitioning.partition_status()[0]['default_rows'], 0)
+        self.assertEqual(YoutubeDailyStats.objects.filter(channel=channel).count(), 3)
+
+        reports = partitioning.verify_pruning(today - timedelta(days=10), today)
+        self.assertTrue(all(report['pruned'] for report in reports), reports)
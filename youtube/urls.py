@@ -5,9 +5,14 @@ from .views import (
     youtube_dashboard,
     channel_trends,
     video_trends,
+    video_timeseries,
     audience_demographics,
     viewer_activity,
-    gemini_chat
+    sync_status,
+    quota_usage,
+    export_data,
+    gemini_chat,
+    gemini_chat_stream,
 )
 
 urlpatterns = [
@@ -18,7 +23,12 @@ urlpatterns = [
     path('trends/audience_demographic/', audience_demographics, name='audience_demographics'),
     path('trends/channel/', channel_trends, name='channel_trends'),
     path('trends/videos/', video_trends, name='video_trends'),
+    path('trends/videos/<str:video_id>/', video_timeseries, name='video_timeseries'),
     path('api/viewer_activity/', viewer_activity, name='viewer_activity'), 
+    path('api/sync_status/', sync_status, name='sync_status'),
+    path('api/quota/', quota_usage, name='quota_usage'),
+    path('export/<slug:dataset>/', export_data, name='export_data'),
     
     path('gemini-chat/', gemini_chat, name='gemini_chat'),
+    path('gemini-chat/stream/', gemini_chat_stream, name='gemini_chat_stream'),
 ]
\ No newline at end of file
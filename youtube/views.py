@@ -1,41 +1,72 @@
-import requests
-import logging
 import json
+import logging
+from functools import wraps
 from datetime import date, timedelta
 from django.conf import settings
 from django.shortcuts import redirect, render
 from django.utils import timezone
-from django.http import JsonResponse
+from django.http import Http404, JsonResponse, StreamingHttpResponse
 from django.contrib.auth.decorators import login_required
-from django.contrib.auth import get_user_model, login
-from django.db.models import ObjectDoesNotExist
+from django.contrib.auth import alogin, get_user_model
+from django.db.models import Count, Sum
+from django.db.models.functions import Coalesce
 from django.utils.dateparse import parse_date
+from django.utils.text import compress_sequence
 from django.views import View
-from django.views.decorators.http import require_GET
+from django.views.decorators.gzip import gzip_page
+from django.views.decorators.http import require_GET, require_POST
 from django.urls import reverse
 from django.utils.decorators import method_decorator
+from django.views.decorators.csrf import csrf_exempt
 from rest_framework.decorators import api_view
+from rest_framework.exceptions import APIException
+from rest_framework.request import Request
 from rest_framework.response import Response
+from rest_framework.settings import api_settings
 
+import httpx
+from asgiref.sync import sync_to_async
 from google.oauth2.credentials import Credentials
-from google.auth.transport import requests as google_requests
 from google.oauth2 import id_token
-from googleapiclient.discovery import build
 
 from accounts.models import CustomUser, GoogleCredentials
-from .models import YouTubeChannel, YoutubeDailyStats, YouTubeVideo, YoutubeAudienceDemographics
+from accounts.services import (
+    MissingRefreshTokenError,
+    TokenRefreshError,
+    acache_access_token,
+    aget_valid_access_token,
+)
+from social_analytics.streaming import streaming_content
+from social_analytics.transport import get_async_client
+from .models import (
+    YouTubeChannel,
+    YoutubeDailyStats,
+    YouTubeVideo,
+    YoutubeAudienceDemographics,
+    YoutubeStatsRollup,
+)
+from .rollups import period_start
+from .series import read_video_series
 from .services import (
-    fetch_and_save_analytics_data, 
-    fetch_own_channel_id, 
-    update_all_videos, 
-    fetch_viewer_activity
+    ChannelLinkError,
+    fetch_channel_identity,
+    fetch_viewer_activity,
+    link_channel,
 )
-from .gemini import generate_content_summary
+from .caching import acached_json_response, cached_json_response, get_data_version
+from .exports import EXPORT_DATASETS, EXPORT_FORMATS, export_filename, export_queryset, stream_export
+from .quota import scheduler
+from .tasks import enqueue_channel_backfill, enqueue_channel_sync
+from .gemini import agenerate_cached_summary, chat_cache_key, stream_cached_summary
+from .prompts import build_channel_digest, build_chat_prompt, render_digest
 
 logger = logging.getLogger(__name__)
 
 User = get_user_model()
 
+# Канал, выбранный на дашборде; API без channel_id отдают данные по нему
+SELECTED_CHANNEL_SESSION_KEY = 'youtube_channel_id'
+
 
 @login_required
 @require_GET
@@ -54,7 +85,8 @@ def youtube_auth(request):
     return redirect(f"{base_url}?{query_string}")
 
 
-def youtube_callback(request):
+@require_GET
+async def youtube_callback(request):
     code = request.GET.get('code')
 
     if not code:
@@ -69,11 +101,12 @@ def youtube_callback(request):
         'grant_type': 'authorization_code',
     }
 
+    client = get_async_client()
     try:
-        token_resp = requests.post('https://oauth2.googleapis.com/token', data=token_data)
+        token_resp = await client.post('https://oauth2.googleapis.com/token', data=token_data)
         token_resp.raise_for_status()
         token_json = token_resp.json()
-    except requests.exceptions.HTTPError as e:
+    except httpx.HTTPError:
         return redirect('google_login')
 
     access_token = token_json.get('access_token')
@@ -82,240 +115,377 @@ def youtube_callback(request):
     scopes = token_json.get('scope')
 
     try:
-        userinfo_resp = requests.get(
+        userinfo_resp = await client.get(
             'https://www.googleapis.com/oauth2/v3/userinfo',
             headers={'Authorization': f'Bearer {access_token}'}
         )
         userinfo_resp.raise_for_status()
         user_data = userinfo_resp.json()
         email = user_data.get('email')
-    except requests.exceptions.HTTPError as e:
+    except httpx.HTTPError:
         return redirect('google_login')
 
     if not email:
         return redirect('google_login')
 
     try:
-        user = CustomUser.objects.get(email=email)
+        user = await CustomUser.objects.aget(email=email)
     except CustomUser.DoesNotExist:
         return redirect('google_login')
 
-    login(request, user)
+    await alogin(request, user)
 
-    creds_obj, created = GoogleCredentials.objects.get_or_create(user=user)
-    creds_obj.access_token = access_token
+    fields = {
+        'access_token': access_token,
+        'token_expiry': timezone.now() + timedelta(seconds=expires_in),
+        'scopes': scopes,
+        'client_id': settings.YOUTUBE_CLIENT_ID,
+        'client_secret': settings.YOUTUBE_CLIENT_SECRET,
+        'token_uri': 'https://oauth2.googleapis.com/token',
+    }
     if refresh_token:
-        creds_obj.refresh_token = refresh_token
-    creds_obj.token_expiry = timezone.now() + timedelta(seconds=expires_in)
-    creds_obj.scopes = scopes
-    creds_obj.client_id = settings.YOUTUBE_CLIENT_ID
-    creds_obj.client_secret = settings.YOUTUBE_CLIENT_SECRET
-    creds_obj.token_uri = 'https://oauth2.googleapis.com/token'
-    creds_obj.save()
+        fields['refresh_token'] = refresh_token
+    # Токен выдаётся на один канал (при согласии пользователь выбирает канал), поэтому канал
+    # определяется здесь один раз и сохраняется вместе с токеном; дашборд в Google за ним не ходит
+    creds_obj = await GoogleCredentials.objects.acreate(user=user, **fields)
+    try:
+        identity = await sync_to_async(fetch_channel_identity)(creds_obj)
+        if not identity:
+            raise ChannelLinkError('No channels found for this user.')
+        channel, created = await sync_to_async(link_channel)(user, creds_obj, identity)
+    except Exception as e:
+        # Любая ошибка (не только ChannelLinkError/HttpError/QuotaExceededError, но и таймауты,
+        # TokenRefreshError, ошибки базы) не должна оставлять токен без канала
+        logger.exception(f"Failed to link YouTube channel for user {user.pk}: {e}")
+        await creds_obj.adelete()
+        return await sync_to_async(render)(request, 'youtube/error_page.html', {'error_message': str(e)})
+
+    await acache_access_token(creds_obj)
+    await request.session.aset(SELECTED_CHANNEL_SESSION_KEY, channel.channel_id)
+    if created:
+        await sync_to_async(enqueue_channel_backfill)(channel)
 
     return redirect('youtube-dashboard')
 
 
+TOP_VIDEOS_LIMIT = 5
+VIDEO_SORT_FIELDS = {'views', 'likes', 'comments', 'published_at', 'title'}
+
+
+def _parse_date_range(date_from_str, date_to_str, default_days=30):
+    date_to = (parse_date(date_to_str) if date_to_str else None) or date.today()
+    date_from = (parse_date(date_from_str) if date_from_str else None) or (date_to - timedelta(days=default_days))
+    return date_from, date_to
+
+
+def _channel_kpis(channel, date_from, date_to):
+    kpis = YoutubeDailyStats.objects.filter(
+        channel=channel,
+        date__range=[date_from, date_to]
+    ).aggregate(
+        views=Coalesce(Sum('views'), 0),
+        estimated_minutes_watched=Coalesce(Sum('estimated_minutes_watched'), 0),
+        subscribers_gained=Coalesce(Sum('subscribers_gained'), 0),
+        subscribers_lost=Coalesce(Sum('subscribers_lost'), 0),
+    )
+    kpis['subscribers_net'] = kpis['subscribers_gained'] - kpis['subscribers_lost']
+    kpis.update(YouTubeVideo.objects.filter(channel=channel).aggregate(
+        video_count=Count('id'),
+        likes=Coalesce(Sum('likes'), 0),
+        comments=Coalesce(Sum('comments'), 0),
+    ))
+    return kpis
+
+
 @login_required
 def youtube_dashboard(request):
-    try:
-        creds_obj = GoogleCredentials.objects.get(user=request.user)
-
-        channel_id = fetch_own_channel_id(creds_obj)
-        if not channel_id:
-            return render(request, 'youtube/error_page.html', {'error_message': 'No channels found for this user.'})
+    # Каналы и их токены читаются из базы, переключение между каналами не ходит в Google
+    channels = list(
+        YouTubeChannel.objects.filter(user=request.user).select_related('credentials').order_by('created_at', 'pk')
+    )
+    if not channels:
+        return redirect('youtube_auth')
 
-        channel_obj, created = YouTubeChannel.objects.get_or_create(
-            channel_id=channel_id,
-            defaults={'user': request.user, 'title': 'My YouTube Channel'}
-        )
+    saved_id = request.session.get(SELECTED_CHANNEL_SESSION_KEY)
+    selected_id = request.GET.get('channel_id') or saved_id
+    channel_obj = next((channel for channel in channels if channel.channel_id == selected_id), channels[0])
+    # Сессия пишется только при переключении канала
+    if selected_id != saved_id and channel_obj.channel_id == selected_id:
+        request.session[SELECTED_CHANNEL_SESSION_KEY] = channel_obj.channel_id
 
-        last_update = channel_obj.last_updated if channel_obj else None
-
-        if not last_update or (timezone.now() - last_update) > timedelta(hours=24):
-            print("Updating YouTube analytics data...")
-            try:
-                fetch_and_save_analytics_data(creds_obj, channel_id)
-                update_all_videos(creds_obj)
-                channel_obj.last_updated = timezone.now()
-                channel_obj.save()
-            except Exception as e:
-                print(f"Error during data update: {e}")
-
-        start_date_str = request.GET.get('start_date')
-        end_date_str = request.GET.get('end_date')
-        if not start_date_str or not end_date_str:
-            end_date = date.today()
-            start_date = end_date - timedelta(days=30)
-            start_date_str = start_date.isoformat()
-            end_date_str = end_date.isoformat()
-
-        viewer_activity_data = fetch_viewer_activity(
-            creds_obj, 
-            channel_id, 
-            start_date_str, 
-            end_date_str
+    try:
+        creds_obj = channel_obj.get_credentials()
+        if creds_obj is None:
+            return redirect('youtube_auth')
+
+        # Отдаём то, что уже есть в базе, а обновление уходит в фон (stale-while-revalidate).
+        # У каждого канала своя задача, так что каналы пользователя синхронизируются параллельно
+        for channel in channels:
+            if channel.is_stale():
+                enqueue_channel_sync(channel)
+
+        start_date, end_date = _parse_date_range(
+            request.GET.get('start_date'), request.GET.get('end_date'), default_days=30
         )
 
-        video_stats = [
-            {
-                'title': v.title,
-                'views': v.views,
-                'likes': v.likes,
-                'comments': v.comments,
-                'published_at': v.published_at.date().isoformat(),
-            }
-            for v in YouTubeVideo.objects.filter(channel__user=request.user)
-        ]
-        
-        subscriber_trends = [
-            {
-                'date': stat.date.isoformat(),
-                'subscribers_gained': stat.subscribers_gained,
-                'subscribers_lost': stat.subscribers_lost,
-            }
-            for stat in YoutubeDailyStats.objects.filter(channel__user=request.user).order_by('date')
-        ]
-        
-        top_videos = sorted(video_stats, key=lambda x: x['views'], reverse=True)[:5]
-        
+        # Страница содержит только KPI и топ видео; графики догружаются с API по выбранному диапазону
         dashboard_data = {
-            'viewer_activity': viewer_activity_data,
-            'video_stats': video_stats,
-            'subscriber_trends': subscriber_trends,
-            'top_videos': top_videos,
+            'kpis': _channel_kpis(channel_obj, start_date, end_date),
+            'top_videos': list(
+                YouTubeVideo.objects.filter(channel=channel_obj)
+                .order_by('-views')
+                .values('video_id', 'title', 'views', 'likes', 'comments', 'published_at')[:TOP_VIDEOS_LIMIT]
+            ),
         }
 
         context = {
             'youtube_access_token': creds_obj.access_token,
             'channel_title': channel_obj.title,
-            'channel_id': channel_id,
-            'start_date': start_date_str,
-            'end_date': end_date_str,
-            'viewer_activity_data': json.dumps(viewer_activity_data),
-            'dashboard_data_json': json.dumps(dashboard_data),
+            'channel_id': channel_obj.channel_id,
+            'channels': channels,
+            'start_date': start_date.isoformat(),
+            'end_date': end_date.isoformat(),
+            'sync_status': channel_obj.sync_status,
+            'last_updated': channel_obj.last_updated,
+            'kpis': dashboard_data['kpis'],
+            'top_videos': dashboard_data['top_videos'],
+            'dashboard_data': dashboard_data,
         }
-        
 
         return render(request, 'youtube/dashboard.html', context)
 
-    except GoogleCredentials.DoesNotExist:
-        return redirect('youtube_auth')
     except Exception as e:
         return render(request, 'youtube/error_page.html', {'error_message': str(e)})
 
-# API views
-@api_view(['GET'])
-@login_required
-def channel_trends(request):
-    try:
-        creds_obj = GoogleCredentials.objects.get(user=request.user)
+def _api_authenticate(request):
+    # Те же аутентификаторы, что у api_view (REST_FRAMEWORK.DEFAULT_AUTHENTICATION_CLASSES);
+    # SessionAuthentication сам проверяет CSRF для входа по сессии
+    drf_request = Request(request, authenticators=[auth() for auth in api_settings.DEFAULT_AUTHENTICATION_CLASSES])
+    return drf_request.user
 
-        if creds_obj.token_expiry <= timezone.now() + timedelta(minutes=5):
-            if not creds_obj.refresh_token:
-                return JsonResponse({'error': 'Token expired. Please re-authenticate.'}, status=401)
 
-            token_data = {
-                'grant_type': 'refresh_token',
-                'client_id': settings.YOUTUBE_CLIENT_ID,
-                'client_secret': settings.YOUTUBE_CLIENT_SECRET,
-                'refresh_token': creds_obj.refresh_token,
-            }
-            token_resp = requests.post('https://oauth2.googleapis.com/token', data=token_data)
-            token_resp.raise_for_status()
-            token_json = token_resp.json()
-
-            creds_obj.access_token = token_json['access_token']
-            creds_obj.token_expiry = timezone.now() + timedelta(seconds=token_json['expires_in'])
-            creds_obj.save()
-
-    except ObjectDoesNotExist:
+def async_api_login_required(view):
+    """
+    Аналог login_required для async API-представлений: пользователь определяется
+    аутентификаторами DRF (сессия или заголовок Authorization: Token ...), без входа — 401 JSON
+    вместо перенаправления на страницу входа.
+    """
+    @csrf_exempt
+    @wraps(view)
+    async def wrapper(request, *args, **kwargs):
+        try:
+            user = await sync_to_async(_api_authenticate)(request)
+        except APIException as e:
+            return JsonResponse({'error': str(e.detail)}, status=e.status_code)
+        if not user.is_authenticated:
+            return JsonResponse({'error': 'Authentication credentials were not provided'}, status=401)
+
+        async def auser():
+            return user
+
+        request.user, request.auser = user, auser
+        return await view(request, *args, **kwargs)
+    return wrapper
+
+
+async def _acredentials(user, channel=None):
+    # Токен выбранного канала (канал загружен с select_related('credentials')). Без канала и у каналов,
+    # привязанных до хранения токена на канале, — последний токен пользователя, как в get_credentials
+    if channel is not None and channel.credentials_id:
+        return channel.credentials
+    return await GoogleCredentials.objects.filter(user=user).order_by('-pk').afirst()
+
+
+async def _acheck_credentials(creds_obj):
+    # Для async-представлений: None, если токен в порядке, иначе ответ 401
+    if creds_obj is None:
         return JsonResponse({'error': 'No credentials found for this user'}, status=401)
-    except requests.exceptions.HTTPError:
+    try:
+        await aget_valid_access_token(creds_obj)
+    except MissingRefreshTokenError as e:
+        return JsonResponse({'error': str(e)}, status=401)
+    except TokenRefreshError:
         return JsonResponse({'error': 'Token refresh failed'}, status=401)
+    return None
 
-    user_channels = YouTubeChannel.objects.filter(user=request.user)
-    channel_id = request.GET.get('channel_id') or (user_channels.first().channel_id if user_channels else None)
 
-    if not channel_id:
-        return JsonResponse({'error': 'No channels found for this user'}, status=404)
+async def _adefault_channel_id(request, user):
+    # Канал, выбранный на дашборде, иначе первый привязанный канал пользователя
+    selected = await request.session.aget(SELECTED_CHANNEL_SESSION_KEY)
+    if selected:
+        return selected
+    channel = await YouTubeChannel.objects.filter(user=user).order_by('created_at', 'pk').afirst()
+    return channel.channel_id if channel else None
 
-    date_from_str = request.GET.get('date_from')
-    date_from = parse_date(date_from_str) if date_from_str else (date.today() - timedelta(days=30))
-    date_to = parse_date(request.GET.get('date_to')) if request.GET.get('date_to') else date.today()
 
-    stats_qs = YoutubeDailyStats.objects.filter(
-        channel__channel_id=channel_id,
-        date__range=[date_from, date_to]
-    ).order_by('date')
+# API views
+@api_view(['GET'])
+@login_required
+def sync_status(request):
+    user_channels = YouTubeChannel.objects.filter(user=request.user)
+    channel_id = request.GET.get('channel_id') or request.session.get(SELECTED_CHANNEL_SESSION_KEY)
+    channel = user_channels.filter(channel_id=channel_id).first() if channel_id else user_channels.first()
 
-    dates = [stat.date.isoformat() for stat in stats_qs]
-    views = [stat.views for stat in stats_qs]
-    subscribers_gained = [stat.subscribers_gained for stat in stats_qs]
-    subscribers_lost = [stat.subscribers_lost for stat in stats_qs]
+    if not channel:
+        return JsonResponse({'error': 'No channels found for this user'}, status=404)
 
     return JsonResponse({
-        'dates': dates,
-        'views': views,
-        'subscribers_gained': subscribers_gained,
-        'subscribers_lost': subscribers_lost
+        'channel_id': channel.channel_id,
+        'status': channel.sync_status,
+        'last_updated': channel.last_updated.isoformat() if channel.last_updated else None,
+        'is_stale': channel.is_stale(),
+        'error': channel.sync_error or None,
     })
 
 
 @api_view(['GET'])
 @login_required
-def video_trends(request):
-    try:
-        creds_obj = GoogleCredentials.objects.get(user=request.user)
+def quota_usage(request):
+    return JsonResponse(scheduler.usage(user_id=request.user.pk))
 
-        if creds_obj.token_expiry <= timezone.now() + timedelta(minutes=5):
-            if not creds_obj.refresh_token:
-                return JsonResponse({'error': 'Token expired. Please re-authenticate.'}, status=401)
 
-            token_data = {
-                'grant_type': 'refresh_token',
-                'client_id': settings.YOUTUBE_CLIENT_ID,
-                'client_secret': settings.YOUTUBE_CLIENT_SECRET,
-                'refresh_token': creds_obj.refresh_token,
-            }
-            token_resp = requests.post('https://oauth2.googleapis.com/token', data=token_data)
-            token_resp.raise_for_status()
-            token_json = token_resp.json()
+@gzip_page
+@require_GET
+@async_api_login_required
+async def channel_trends(request):
+    user = await request.auser()
+    channel_id = request.GET.get('channel_id') or await _adefault_channel_id(request, user)
+    channel = await YouTubeChannel.objects.select_related('credentials').filter(
+        user=user, channel_id=channel_id
+    ).afirst() if channel_id else None
+
+    error = await _acheck_credentials(await _acredentials(user, channel))
+    if error:
+        return error
+    if not channel:
+        return JsonResponse({'error': 'No channels found for this user'}, status=404)
 
-            creds_obj.access_token = token_json['access_token']
-            creds_obj.token_expiry = timezone.now() + timedelta(seconds=token_json['expires_in'])
-            creds_obj.save()
+    date_from_str = request.GET.get('date_from')
+    date_from = parse_date(date_from_str) if date_from_str else (date.today() - timedelta(days=30))
+    date_to = parse_date(request.GET.get('date_to')) if request.GET.get('date_to') else date.today()
 
-    except ObjectDoesNotExist:
-        return JsonResponse({'error': 'No credentials found for this user'}, status=401)
-    except requests.exceptions.HTTPError:
-        return JsonResponse({'error': 'Token refresh failed'}, status=401)
+    granularity = request.GET.get('granularity', 'day')
+    if granularity != 'day' and granularity not in YoutubeStatsRollup.Granularity.values:
+        return JsonResponse({'error': f'Unsupported granularity: {granularity}'}, status=400)
+
+    async def compute_payload():
+        if granularity == 'day':
+            stats = YoutubeDailyStats.objects.filter(
+                channel=channel,
+                date__range=[date_from, date_to]
+            ).order_by('date').values_list('date', 'views', 'subscribers_gained', 'subscribers_lost')
+        else:
+            # Длинные диапазоны читаются из заранее посчитанных агрегатов; крайние периоды берутся целиком
+            stats = YoutubeStatsRollup.objects.filter(
+                channel=channel,
+                granularity=granularity,
+                period_start__range=[period_start(granularity, date_from), date_to]
+            ).order_by('period_start').values_list('period_start', 'views', 'subscribers_gained', 'subscribers_lost')
+
+        dates, views, subscribers_gained, subscribers_lost = [], [], [], []
+        async for stat_date, stat_views, gained, lost in stats:
+            dates.append(stat_date.isoformat())
+            views.append(stat_views)
+            subscribers_gained.append(gained)
+            subscribers_lost.append(lost)
+
+        return {
+            'granularity': granularity,
+            'dates': dates,
+            'views': views,
+            'subscribers_gained': subscribers_gained,
+            'subscribers_lost': subscribers_lost
+        }
+
+    return await acached_json_response(
+        request,
+        'channel_trends',
+        [channel.pk],
+        {'channel_id': channel_id, 'date_from': date_from, 'date_to': date_to, 'granularity': granularity},
+        compute_payload
+    )
+
+
+@gzip_page
+@require_GET
+@async_api_login_required
+async def video_trends(request):
+    user = await request.auser()
+    # Видео всех каналов пользователя: отдельного канала нет, проверяется последний токен
+    error = await _acheck_credentials(await _acredentials(user))
+    if error:
+        return error
 
     date_from_str = request.GET.get('date_from')
     date_from = parse_date(date_from_str) if date_from_str else (date.today() - timedelta(days=30))
     date_to = parse_date(request.GET.get('date_to')) if request.GET.get('date_to') else date.today()
 
     sort_by = request.GET.get('sort_by', '-views')
+    if sort_by.lstrip('-') not in VIDEO_SORT_FIELDS:
+        return JsonResponse({'error': f'Unsupported sort_by: {sort_by}'}, status=400)
+
+    try:
+        limit = int(request.GET['limit']) if request.GET.get('limit') else None
+        offset = int(request.GET.get('offset') or 0)
+    except ValueError:
+        return JsonResponse({'error': 'limit and offset must be integers'}, status=400)
+
+    async def compute_payload():
+        videos = YouTubeVideo.objects.filter(
+            channel__user=user,
+            published_at__date__range=[date_from, date_to]
+        ).order_by(sort_by, 'pk').only('title', 'published_at', 'views', 'likes', 'comments')
+        videos = videos[offset:offset + limit] if limit else videos[offset:]
+
+        videos_data = [
+            {
+                'title': v.title,
+                'published_at': v.published_at.date().isoformat(),
+                'views': v.views,
+                'likes': v.likes,
+                'comments': v.comments,
+            }
+            async for v in videos
+        ]
+
+        return {'videos': videos_data}
+
+    channel_pks = [pk async for pk in YouTubeChannel.objects.filter(user=user).values_list('pk', flat=True)]
+    return await acached_json_response(
+        request,
+        'video_trends',
+        channel_pks,
+        {'date_from': date_from, 'date_to': date_to, 'sort_by': sort_by, 'limit': limit, 'offset': offset},
+        compute_payload
+    )
 
-    videos = YouTubeVideo.objects.filter(
-        channel__user=request.user,
-        published_at__date__range=[date_from, date_to]
-    ).order_by(sort_by)
-
-    videos_data = [
-        {
-            'title': v.title,
-            'published_at': v.published_at.date().isoformat(),
-            'views': v.views,
-            'likes': v.likes,
-            'comments': v.comments,
-        }
-        for v in videos
-    ]
 
-    return JsonResponse({'videos': videos_data})
+@gzip_page
+@api_view(['GET'])
+@login_required
+def video_timeseries(request, video_id):
+    video = YouTubeVideo.objects.filter(
+        channel__user=request.user, video_id=video_id
+    ).only('pk', 'channel_id', 'title').first()
+    if not video:
+        return JsonResponse({'error': 'Video not found'}, status=404)
+
+    date_from, date_to = _parse_date_range(request.GET.get('date_from'), request.GET.get('date_to'), default_days=90)
+
+    def compute_payload():
+        series = read_video_series(video.pk, date_from, date_to)
+        return {'video_id': video_id, 'title': video.title, **series}
+
+    return cached_json_response(
+        request,
+        'video_timeseries',
+        [video.channel_id],
+        {'video_id': video_id, 'date_from': date_from, 'date_to': date_to},
+        compute_payload
+    )
 
 
+@gzip_page
 @api_view(['GET'])
 def audience_demographics(request):
     channel_id = request.query_params.get('channel_id')
@@ -326,28 +496,26 @@ def audience_demographics(request):
     try:
         channel = YouTubeChannel.objects.get(channel_id=channel_id)
 
-        demographics_data = YoutubeAudienceDemographics.objects.filter(channel=channel)
-
-        if not demographics_data.exists():
-            return JsonResponse({'demographics': {'age_groups': {}, 'genders': {}}})
+        def compute_payload():
+            demographics_data = YoutubeAudienceDemographics.objects.filter(channel=channel)
 
-        age_groups_dict = {}
-        genders_dict = {}
+            age_groups_dict = {}
+            genders_dict = {}
 
-        for item in demographics_data:
-            if item.age_group:
-                age_groups_dict[item.age_group] = item.viewer_percentage
-            if item.gender:
-                genders_dict[item.gender] = item.viewer_percentage
+            for item in demographics_data:
+                if item.age_group:
+                    age_groups_dict[item.age_group] = item.viewer_percentage
+                if item.gender:
+                    genders_dict[item.gender] = item.viewer_percentage
 
-        response_data = {
-            'demographics': {
-                'age_groups': age_groups_dict,
-                'genders': genders_dict,
+            return {
+                'demographics': {
+                    'age_groups': age_groups_dict,
+                    'genders': genders_dict,
+                }
             }
-        }
 
-        return JsonResponse(response_data)
+        return cached_json_response(request, 'audience_demographics', [channel.pk], {}, compute_payload)
 
     except YouTubeChannel.DoesNotExist:
         return Response({'error': 'Channel not found'}, status=404)
@@ -355,52 +523,140 @@ def audience_demographics(request):
         return Response({'error': str(e)}, status=500)
     
     
-@api_view(['GET'])
-@login_required
-def viewer_activity(request):
-    try:
-        creds_obj = GoogleCredentials.objects.get(user=request.user)
-    except ObjectDoesNotExist:
+@gzip_page
+@require_GET
+@async_api_login_required
+async def viewer_activity(request):
+    user = await request.auser()
+    channel_id = request.GET.get('channel_id') or await _adefault_channel_id(request, user)
+    channel = await YouTubeChannel.objects.select_related('credentials').filter(
+        user=user, channel_id=channel_id
+    ).afirst() if channel_id else None
+
+    # API Analytics вызывается токеном выбранного канала, а не последним токеном пользователя
+    creds_obj = await _acredentials(user, channel)
+    if creds_obj is None:
         return JsonResponse({'error': 'No credentials found for this user'}, status=401)
-    
+
     date_from_str = request.GET.get('date_from')
     date_to_str = request.GET.get('date_to')
 
     if not date_from_str or not date_to_str:
         return JsonResponse({'error': 'start_date and end_date are required'}, status=400)
 
-    user_channels = YouTubeChannel.objects.filter(user=request.user)
-    channel_id = request.GET.get('channel_id') or (user_channels.first().channel_id if user_channels else None)
-
-    if not channel_id:
+    if not channel:
         return JsonResponse({'error': 'No channels found for this user'}, status=404)
 
-    activity_data = fetch_viewer_activity(
+    # Сохранённые данные читаются из базы; googleapiclient и планировщик квоты синхронные,
+    # поэтому дозагрузка недостающих дней идёт в потоке
+    activity_data = await sync_to_async(fetch_viewer_activity)(
         creds_obj, 
         channel_id, 
         date_from_str, 
-        date_to_str
+        date_to_str,
+        channel=channel,
     )
 
     return JsonResponse(activity_data)    
 
 
-# GEMINI VIEW
-@api_view(['POST'])
 @login_required
-def gemini_chat(request):
-    message = request.data.get('message')
-    dashboard_data = request.data.get('dashboard_data', {})
-    
+@require_GET
+def export_data(request, dataset):
+    # Обычное Django-представление, а не api_view: DRF занимает параметр format под согласование контента
+    if dataset not in EXPORT_DATASETS:
+        raise Http404(f'Unknown dataset: {dataset}')
+
+    fmt = request.GET.get('format', 'csv')
+    if fmt not in EXPORT_FORMATS:
+        return JsonResponse({'error': f'Unsupported format: {fmt}'}, status=400)
+
+    date_from_str, date_to_str = request.GET.get('date_from'), request.GET.get('date_to')
+    date_from = parse_date(date_from_str) if date_from_str else None
+    date_to = parse_date(date_to_str) if date_to_str else None
+    if (date_from_str and not date_from) or (date_to_str and not date_to):
+        return JsonResponse({'error': 'date_from and date_to must be YYYY-MM-DD'}, status=400)
+
+    compress = request.GET.get('gzip') in ('1', 'true')
+    queryset = export_queryset(
+        dataset,
+        user=request.user,
+        channel_ids=request.GET.getlist('channel_id'),
+        date_from=date_from,
+        date_to=date_to,
+    )
+    chunks = (chunk.encode() for chunk in stream_export(dataset, fmt, queryset))
+
+    if compress:
+        response = StreamingHttpResponse(
+            streaming_content(request, compress_sequence(chunks)), content_type='application/gzip'
+        )
+    else:
+        response = StreamingHttpResponse(
+            streaming_content(request, chunks), content_type=f'{EXPORT_FORMATS[fmt]}; charset=utf-8'
+        )
+    response['Content-Disposition'] = f'attachment; filename="{export_filename(dataset, fmt, compress)}"'
+    return response
+
+
+# GEMINI VIEW
+def _chat_request(user, params):
+    """
+    Общая часть обычного и потокового чата: канал пользователя, ключ кэша ответа
+    и отложенная сборка промпта. Возвращает (ключ, build_prompt) или JsonResponse с ошибкой.
+    """
+    message = params.get('message')
     if not message:
         return JsonResponse({'error': 'Message is required'}, status=400)
-    
-    prompt = f"""
-    Ты аналитик YouTube. Пользователь просит: "{message}".
-    Вот текущие данные дашборда:
-    {dashboard_data}
-    Дай рекомендации, выводы и короткий анализ.
-    """
-    
-    response_text = generate_content_summary(prompt)
-    return JsonResponse({'response': response_text})
\ No newline at end of file
+
+    # dashboard_data от клиента больше не используется: сводка строится на сервере из базы
+    user_channels = YouTubeChannel.objects.filter(user=user)
+    channel_id = params.get('channel_id')
+    channel = user_channels.filter(channel_id=channel_id).first() if channel_id else user_channels.first()
+    if not channel:
+        return JsonResponse({'error': 'No channels found for this user'}, status=404)
+
+    date_from, date_to = _parse_date_range(params.get('date_from'), params.get('date_to'), default_days=90)
+    cache_key = chat_cache_key(message, get_data_version(channel.pk), channel.pk, date_from, date_to)
+    return cache_key, lambda: build_chat_prompt(
+        message, render_digest(build_channel_digest(channel, date_from, date_to))
+    )
+
+
+@require_POST
+@async_api_login_required
+async def gemini_chat(request):
+    if request.content_type == 'application/json':
+        try:
+            params = json.loads(request.body or b'{}')
+        except ValueError:
+            params = None
+        if not isinstance(params, dict):
+            return JsonResponse({'error': 'Invalid JSON'}, status=400)
+    else:
+        params = request.POST
+
+    chat = await sync_to_async(_chat_request)(await request.auser(), params)
+    if isinstance(chat, JsonResponse):
+        return chat
+
+    response_text, cached = await agenerate_cached_summary(*chat)
+    return JsonResponse({'response': response_text, 'cached': cached})
+
+
+@login_required
+@require_GET
+def gemini_chat_stream(request):
+    # Обычное Django-представление: EventSource шлёт GET с Accept: text/event-stream,
+    # который DRF отклонил бы при согласовании контента
+    chat = _chat_request(request.user, request.GET)
+    if isinstance(chat, JsonResponse):
+        return chat
+
+    response = StreamingHttpResponse(
+        streaming_content(request, stream_cached_summary(*chat)), content_type='text/event-stream'
+    )
+    response['Cache-Control'] = 'no-cache'
+    # Не даём nginx буферизовать поток, иначе токены придут клиенту одним куском
+    response['X-Accel-Buffering'] = 'no'
+    return response